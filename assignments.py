@@ -1,248 +1,800 @@
 """
 Functions which assign multiple non-overlapping teams of students
+
+Cliques are given as CliqueSets (see clique_store.py), or as lists of tuples
+of student ids, which get converted with CliqueSet.from_cliques. Greedy and
+random assignment walk through cliques with LiveCliques, which uses each
+CliqueSet's index of which cliques each student is in to rule out cliques
+that overlap chosen teams. The exact solver tracks students and teams as integer bitmasks
+of student ids, so checking for overlaps is a single AND.
+
+Functions that can take a long time accept an optional control argument, a
+solver.SolveControl. They call control.check() as they work, which raises
+solver.SolveStopped once the time budget runs out or the run is cancelled,
+and pass better assignments to control.improved() as they find them, so the
+best assignment so far is kept when they are stopped.
 """
-from random import shuffle
-from helpers import overlaps
-from scoring import assignment_cost, team_compatibility
+import heapq
+import numpy as np
+from math import exp
+from random import Random, shuffle
+from clique_store import CliqueSet, LiveCliques
+from helpers import num_size_teams, overlaps, team_mask
+from scoring import team_evaluation, team_evaluation_batch
+
+
+def _choose_non_overlapping(live, n, start_at):
+    """
+    Goes through the cliques of a LiveCliques in order, starting at index
+    start_at, and chooses every clique that does not overlap previously
+    chosen students until n cliques have been chosen or there are no cliques
+    left. The LiveCliques itself is not changed.
+
+    Returns a list of chosen teams.
+    """
+    live = live.copy(start_at)
+    teams = []
+    while len(teams) < n:
+        # Skip ahead to the next clique that doesn't overlap any assigned
+        # students
+        team_idx = live.next_live()
+        if team_idx is None:
+            break
+        # Add it to the list of chosen teams, and mark every clique that
+        # shares a student with it as dead
+        teams.append(live.cliques[team_idx])
+        live.assign(teams[-1])
+    return teams
 
 
-def assign_teams_greedy(four_cliques, five_cliques, n_4, n_5):
+def _check_coverable(four_cliques, five_cliques, n_4, n_5):
+    """
+    Raises a ValueError if there are not enough cliques to make the given
+    numbers of teams, or if some student is not in any clique of a size that
+    is still needed, since then no assignment can be found.
+    """
+    num_students = 4 * n_4 + 5 * n_5
+    covered = np.zeros(num_students, dtype=bool)
+    for cliques, n, size in [(four_cliques, n_4, 4), (five_cliques, n_5, 5)]:
+        if n == 0:
+            continue
+        if len(cliques) < n:
+            raise ValueError("Need %i teams of %i but only have %i cliques" %
+                             (n, size, len(cliques)))
+        starts, _ = cliques.postings
+        # A student is in a clique if their list of cliques isn't empty
+        num_cliques = np.diff(starts)[:num_students]
+        covered[:len(num_cliques)] |= num_cliques > 0
+
+    if not covered.all():
+        raise ValueError("Students %s are not in any usable clique" %
+                         np.flatnonzero(~covered).tolist())
+
+
+def assign_teams_greedy(four_cliques, five_cliques, n_4, n_5, four_offset=0,
+                        five_offset=0, control=None):
     """
     Assign students into the specified numbers of teams of 4 and 5 using a 
     greedy algorithm.
 
-    Returns a list of cliques representing the chosen teams.
+    The search starts four_offset cliques into four_cliques and five_offset
+    cliques into five_cliques. This gives the same result as slicing the
+    CliqueSets, but reuses their index of which cliques each student is in
+    rather than building a new one for each slice.
+
+    If control is given, it is checked before each restart.
+
+    Returns a list of teams (tuples of student ids) representing the chosen
+    teams.
     """
-    # Define assigned_students in case no 4-cliques are needed, in which case
-    # it would not be initialized in the 4-clique loop
-    assigned_students = set()
-    # List to store chosen teams of 4 - also needs to be pre-defined in case
-    # 4-cliques loop is skipped
-    teams_of_4 = []
+    four_cliques = CliqueSet.from_cliques(four_cliques)
+    five_cliques = CliqueSet.from_cliques(five_cliques)
+
     # What index the greedy algorithm will start at - if the algorithm reaches
     # the end of the clique list without finding enough non-overlapping
     # cliques, this will be incremented and it will try again
-    start_at = 0
-    while len(teams_of_4) < n_4:
-        # While there aren't enough 4-cliques, empty the collector variables
-        assigned_students = set()
-        teams_of_4 = []
-        # For this loop, start by choosing the team at index start_at
-        team_idx = start_at
-        # While there are still 4-cliques left to choose...
-        while team_idx < len(four_cliques):
-            # Pick current one as the next team to consider
-            curr_team = four_cliques[team_idx]
-            # Check whether this team overlaps with previously selected students
-            if not overlaps(curr_team.nodes, assigned_students):
-                # If not, add it to the list of chosen teams
-                teams_of_4.append(curr_team)
-                # Add students in this team to assigned_students
-                assigned_students |= curr_team.nodes
-                # If you have now collected enough 4-cliques, exit inner loop
-                if len(teams_of_4) == n_4:
-                    break
-            # If the last team overlapped or you still need more 4-cliques,
-            # increment the team index and continue
-            team_idx += 1
-        # If you ran out of 4-cliques to look at but there are not enough chosen
-        # 4-cliques yet, repeat the process starting with the next best team
-        start_at += 1
-
-    # Make a copy of the students have been assigned into teams of 4. This
-    # provides a point to reset to any time the greedy process for choosing
-    # teams of 5 needs to start over.
-    prev_assigned_students = set(assigned_students)
-    # List to store chosen teams of 5
-    teams_of_5 = []
+    _check_coverable(four_cliques, five_cliques, n_4, n_5)
+    four_live = LiveCliques(four_cliques)
+    for start_at in range(four_offset, len(four_cliques) + 1):
+        if control is not None:
+            control.check()
+        teams_of_4 = _choose_non_overlapping(four_live, n_4, start_at)
+        if len(teams_of_4) == n_4:
+            break
+        # If you ran out of 4-cliques to look at but there are not enough
+        # chosen 4-cliques yet, repeat the process starting with the next best
+        # team
+    else:
+        raise ValueError("Could not find %i non-overlapping 4-cliques" % n_4)
+
+    # The students assigned into teams of 4 are the point to reset to any time
+    # the greedy process for choosing teams of 5 needs to start over.
     # Since this is looking at a whole new list, reset the start_at index
-    start_at = 0
-    while len(teams_of_5) < n_5:
-        # While there aren't enough 5-cliques, empty the collector variables
-        assigned_students = prev_assigned_students
-        teams_of_5 = []
-        # For this loop, start by choosing the team at index start_at
-        team_idx = start_at
-        # While there are still 5-cliques left to choose...
-        while team_idx < len(five_cliques):
-            # Pick current one as the next team to consider
-            curr_team = five_cliques[team_idx]
-            # Check whether this team overlaps with previously selected students
-            if not overlaps(curr_team.nodes, assigned_students):
-                # If not, add it to the list of chosen teams
-                teams_of_5.append(curr_team)
-                # Add students in this team to assigned_students
-                assigned_students |= curr_team.nodes
-                # If you have now collected enough 5-cliques, exit inner loop
-                if len(teams_of_5) == n_5:
-                    break
-            # If the last team overlapped or you still need more 5-cliques,
-            # increment the team index and continue
-            team_idx += 1
-        # If you ran out of 5-cliques to look at but there are not enough chosen
-        # 5-cliques yet, repeat the process starting with the next best team
-        start_at += 1
+    five_live = LiveCliques(five_cliques)
+    for team in teams_of_4:
+        five_live.assign(team)
+    for start_at in range(five_offset, len(five_cliques) + 1):
+        if control is not None:
+            control.check()
+        teams_of_5 = _choose_non_overlapping(five_live, n_5, start_at)
+        if len(teams_of_5) == n_5:
+            break
+    else:
+        raise ValueError(
+            "Could not find %i 5-cliques that don't overlap the teams of 4" %
+            n_5)
 
+    if control is not None:
+        control.improved(teams_of_4 + teams_of_5)
     return teams_of_4 + teams_of_5
 
 
-def assign_teams_random(four_cliques, five_cliques, n_4, n_5):
+def select_teams(cliques, keys, team_counts, students, control=None):
+    """
+    Chooses non-overlapping teams from cliques of several sizes at once. This
+    is the selection behind assign_teams_joint_greedy and
+    assign_teams_random, and it can also assign only some of the students,
+    like when roster.Roster repairs teams.
+
+    A heap holds the next live clique of each size that is still needed, and
+    the one with the highest key is taken from it. Each CliqueSet is walked
+    in its own order, so keys must not increase along a CliqueSet.
+
+    A clique is skipped if choosing it would leave some unassigned student
+    with no live clique of a size that is still needed, since the rest of
+    the students could then never be split into teams.
+
+    Arguments:
+        cliques: dictionary of {team size: CliqueSet}
+        keys: dictionary of {team size: array with a key for each clique}
+        team_counts: dictionary of {team size: number of teams to make}
+        students: the ids of the students to assign. Cliques with any other
+            student are never chosen.
+        control: optionally, a SolveControl checked before each clique is
+            considered
+
+    Return:
+        a list of chosen teams (tuples of student ids), smallest teams first
+    """
+    teams_left = dict(team_counts)
+
+    # Students who still need a team. Cliques with any other student start
+    # dead.
+    students = np.asarray(students, dtype=np.intp)
+    size = max([int(students.max(initial=-1)) + 1] +
+               [c.num_students for c in cliques.values()])
+    unassigned = np.zeros(size, dtype=bool)
+    unassigned[students] = True
+    live = {}
+    # How many live cliques of each size every student is in
+    live_counts = {}
+    for team_size, clique_set in cliques.items():
+        live[team_size] = LiveCliques(clique_set)
+        live[team_size].dead[:] = ~unassigned[clique_set.members].all(axis=1)
+        live_counts[team_size] = np.bincount(
+            clique_set.members[~live[team_size].dead].ravel(), minlength=size)
+
+    def push_next(team_size):
+        # Add the next live clique of a size to the heap, if that size is
+        # still needed. Keys are negated since heapq pops the smallest.
+        if teams_left[team_size] == 0:
+            return
+        position = live[team_size].next_live()
+        if position is not None:
+            heapq.heappush(heap, (-float(keys[team_size][position]),
+                                  team_size, position))
+
+    heap = []
+    for team_size in cliques:
+        push_next(team_size)
+
+    teams = []
+    while heap:
+        if control is not None:
+            control.check()
+        _, team_size, position = heapq.heappop(heap)
+        # Move past this clique, whether or not it is chosen
+        live[team_size].cursor = position + 1
+        # The clique may have died since it was added to the heap, or its
+        # size may no longer be needed
+        if live[team_size].dead[position] or teams_left[team_size] == 0:
+            push_next(team_size)
+            continue
+        team = cliques[team_size][position]
+
+        # Work out which cliques choosing this team would kill, and how many
+        # live cliques every student would have left
+        newly_dead = {}
+        new_counts = {}
+        for other_size, clique_set in cliques.items():
+            containing = np.unique(clique_set.cliques_containing(team))
+            newly_dead[other_size] = \
+                containing[~live[other_size].dead[containing]]
+            new_counts[other_size] = live_counts[other_size] - np.bincount(
+                clique_set.members[newly_dead[other_size]].ravel(),
+                minlength=size)
+
+        # Check every other unassigned student can still be put on a team of
+        # a size that will still be needed
+        still_unassigned = unassigned.copy()
+        still_unassigned[list(team)] = False
+        coverable = np.zeros(size, dtype=bool)
+        for other_size in cliques:
+            if teams_left[other_size] - (other_size == team_size) > 0:
+                coverable |= new_counts[other_size] > 0
+        if not coverable[still_unassigned].all():
+            push_next(team_size)
+            continue
+
+        # Choose the team
+        teams.append(team)
+        teams_left[team_size] -= 1
+        unassigned = still_unassigned
+        for other_size in cliques:
+            live[other_size].dead[newly_dead[other_size]] = True
+            live_counts[other_size] = new_counts[other_size]
+        push_next(team_size)
+
+    if any(teams_left.values()):
+        raise ValueError("Ran out of cliques with %s teams still to make" %
+                         ", ".join("%i of %i" % (n, team_size)
+                                   for team_size, n in teams_left.items()
+                                   if n))
+
+    teams.sort(key=len)
+    if control is not None:
+        control.improved(teams)
+    return teams
+
+
+def assign_teams_random(four_cliques, five_cliques, n_4, n_5, control=None):
     """
     Randomly assign students into the specified numbers of teams of 4 and 5.
 
     The only restriction is that teams cannot have overlapping students.
-    Returns a list of cliques representing the chosen teams.
-    """
-    # Copy and randomly shuffle cliques to be chosen from - shuffle is in-place,
-    # so we don't want to modify the original clique lists which may be passed
-    # to another algorithm
-    four_cliques = four_cliques[:]
-    five_cliques = five_cliques[:]
-    shuffle(four_cliques)
-    shuffle(five_cliques)
-
-    # Define assigned_students in case no 5-cliques are needed, in which case
-    # it would not be initialized in the 5-clique loop
-    assigned_students = set()
-    # List to store chosen teams of 5 - also needs to be pre-defined in case
-    # 5-cliques loop is skipped
-    teams_of_5 = []
-    # What index the random algorithm will start at - if the algorithm reaches
-    # the end of the clique list without finding enough non-overlapping
-    # cliques, this will be incremented and it will try again
-    start_at = 0
-    while len(teams_of_5) < n_5:
-        # While there aren't enough 5-cliques, empty the collector variables
-        assigned_students = set()
-        teams_of_5 = []
-        # For this loop, start by choosing the team at index start_at
-        team_idx = start_at
-        # While there are still 5-cliques left to choose...
-        while team_idx < len(five_cliques):
-            # Pick current one as the next team to consider
-            curr_team = five_cliques[team_idx]
-            # Check whether this team overlaps with previously selected students
-            if not overlaps(curr_team.nodes, assigned_students):
-                # If not, add it to the list of chosen teams
-                teams_of_5.append(curr_team)
-                # Add students in this team to assigned_students
-                assigned_students |= curr_team.nodes
-                # If you have now collected enough 5-cliques, exit inner loop
-                if len(teams_of_5) == n_5:
-                    break
-            # If the last team overlapped or you still need more 5-cliques,
-            # increment the team index and continue
-            team_idx += 1
-        # If you ran out of 5-cliques to look at but there are not enough chosen
-        # 5-cliques yet, repeat the process starting with the next best team
-        start_at += 1
-
-    # Make a copy of the students have been assigned into teams of 5. This
-    # provides a point to reset to any time the process for choosing teams of 4
-    # needs to start over.
-    prev_assigned_students = set(assigned_students)
-    # List to store chosen teams of 4
-    teams_of_4 = []
-    # Since this is looking at a whole new list, reset the start_at index
-    start_at = 0
-    while len(teams_of_4) < n_4:
-        # While there aren't enough 4-cliques, empty the collector variables
-        assigned_students = prev_assigned_students
-        teams_of_4 = []
-        # For this loop, start by choosing the team at index start_at
-        team_idx = start_at
-        # While there are still 4-cliques left to choose...
-        while team_idx < len(four_cliques):
-            # Pick current one as the next team to consider
-            curr_team = four_cliques[team_idx]
-            # Check whether this team overlaps with previously selected students
-            if not overlaps(curr_team.nodes, assigned_students):
-                # If not, add it to the list of chosen teams
-                teams_of_4.append(curr_team)
-                # Add students in this team to assigned_students
-                assigned_students |= curr_team.nodes
-                # If you have now collected enough 4-cliques, exit inner loop
-                if len(teams_of_4) == n_4:
+    Cliques of both sizes are shuffled together, and chosen in that order
+    unless choosing one would leave some student unable to join a team.
+    Raises a ValueError if no assignment is found. If control is given, it
+    is checked before each clique is considered.
+
+    Returns a list of teams (tuples of student ids) representing the chosen
+    teams.
+    """
+    four_cliques = CliqueSet.from_cliques(four_cliques)
+    five_cliques = CliqueSet.from_cliques(five_cliques)
+    _check_coverable(four_cliques, five_cliques, n_4, n_5)
+
+    # Randomly shuffle the order of the cliques to be chosen from. Reordering
+    # a CliqueSet makes a shuffled copy, so the original clique lists which
+    # may be passed to another algorithm are not modified
+    four_order = list(range(len(four_cliques)))
+    five_order = list(range(len(five_cliques)))
+    shuffle(four_order)
+    shuffle(five_order)
+    cliques = {4: four_cliques.reordered(four_order),
+               5: five_cliques.reordered(five_order)}
+
+    # Shuffle where each size's cliques go in one combined order, and key
+    # each clique by its (negated) place in that order
+    sizes = [4] * len(four_cliques) + [5] * len(five_cliques)
+    shuffle(sizes)
+    sizes = np.array(sizes)
+    keys = {team_size: -np.flatnonzero(sizes == team_size)
+            for team_size in cliques}
+
+    return select_teams(cliques, keys, {4: n_4, 5: n_5},
+                         range(4 * n_4 + 5 * n_5), control)
+
+
+def assign_teams_joint_greedy(four_cliques, five_cliques, num_students,
+                              control=None):
+    """
+    Assign students into teams of 4 and 5 with a greedy algorithm that
+    considers both sizes at once, rather than choosing every team of one size
+    before the other.
+
+    The numbers of teams of each size come from helpers.num_size_teams. The
+    live clique with the highest compatibility score is chosen each time,
+    unless choosing it would leave some student unable to join a team. Each
+    CliqueSet should be sorted by compatibility score, highest first.
+
+    Raises a ValueError if the cliques can't cover the students, or if the
+    greedy choices run out of cliques before every team is made. If control
+    is given, it is checked before each clique is considered.
+
+    Returns a list of teams (tuples of student ids) representing the chosen
+    teams, with the teams of 4 first.
+    """
+    num_5, num_4 = num_size_teams(num_students)
+    if num_students and num_4 + num_5 == 0:
+        raise ValueError(
+            "%i students can't be split into teams of 4 and 5" % num_students)
+    cliques = {4: CliqueSet.from_cliques(four_cliques),
+               5: CliqueSet.from_cliques(five_cliques)}
+    _check_coverable(cliques[4], cliques[5], num_4, num_5)
+
+    # With no scores, every clique ties and is chosen in list order
+    keys = {team_size: np.zeros(len(clique_set))
+            if clique_set.compat is None else clique_set.compat
+            for team_size, clique_set in cliques.items()}
+    return select_teams(cliques, keys, {4: num_4, 5: num_5},
+                         range(num_students), control)
+
+
+def assign_students_random(n_4, n_5, seed=None):
+    """
+    Randomly split students into the specified numbers of teams of 4 and 5,
+    without looking at cliques. This gives a starting point for
+    improve_teams_annealing when there are too many students to find every
+    clique, but teams may include students who asked not to work together.
+
+    Returns a list of teams (tuples of student ids) representing the chosen
+    teams.
+    """
+    student_ids = list(range(4 * n_4 + 5 * n_5))
+    Random(seed).shuffle(student_ids)
+
+    teams = []
+    start = 0
+    for size in [4] * n_4 + [5] * n_5:
+        teams.append(tuple(sorted(student_ids[start:start + size])))
+        start += size
+    return teams
+
+
+def _lagrangian_multipliers(members, sizes, costs, team_counts, values,
+                            target, tolerance, iterations=500, control=None):
+    """
+    Finds a value for each student to use in a lower bound on the cost of
+    covering students with cliques (a Lagrangian relaxation).
+
+    If every student is given a value, a clique's reduced cost is its cost
+    minus the values of its members. Any way of covering a set of students
+    with the required numbers of teams of each size costs at least the sum
+    of those students' values, plus, for each team size, the number of teams
+    needed times the lowest reduced cost of any clique of that size. This
+    searches for student values that make that bound as high as possible,
+    using subgradient steps aimed at the cost of a known cover.
+
+    Arguments:
+        members: array with one row of student ids per clique, padded with
+            the placeholder id num_students
+        sizes: array with the size of each clique
+        costs: array with the cost of each clique
+        team_counts: dictionary of {team size: number of teams needed}
+        values: array of starting values, one per student plus a 0 for the
+            placeholder
+        target: the cost to aim the bound at. Stops once the bound is within
+            tolerance of it.
+        tolerance: how close to target the bound needs to get
+        iterations: the most improvement steps to take
+        control: optionally, a SolveControl checked before each step
+
+    Return:
+        a tuple of (array with one value per student plus a 0 for the
+        placeholder, lower bound on the cost of covering every student)
+    """
+    num_students = len(values) - 1
+    values = values.copy()
+    best_values, best_bound = values.copy(), -np.inf
+    step_scale, steps_without_improvement = 2.0, 0
+    size_indices = {size: np.flatnonzero(sizes == size)
+                    for size, count in team_counts.items() if count}
+
+    for _ in range(iterations):
+        if control is not None:
+            control.check()
+        reduced_costs = costs - values[members].sum(axis=1)
+        # Pick the cheapest cliques of each size by reduced cost, ignoring
+        # whether they overlap
+        bound = values[:num_students].sum()
+        picked = []
+        for size, indices in size_indices.items():
+            count = team_counts[size]
+            cheapest = indices[np.argpartition(
+                reduced_costs[indices], count - 1)[:count]]
+            bound += reduced_costs[cheapest].sum()
+            picked.extend(cheapest.tolist())
+
+        if bound > best_bound:
+            best_values, best_bound = values.copy(), bound
+            steps_without_improvement = 0
+        else:
+            # Take smaller steps if the bound has stopped improving
+            steps_without_improvement += 1
+            if steps_without_improvement == 20:
+                step_scale /= 2
+                steps_without_improvement = 0
+                if step_scale < 1e-3:
                     break
-            # If the last team overlapped or you still need more 4-cliques,
-            # increment the team index and continue
-            team_idx += 1
-        # If you ran out of 4-cliques to look at but there are not enough chosen
-        # 4-cliques yet, repeat the process starting with the next best team
-        start_at += 1
+        if best_bound + tolerance >= target:
+            break
 
-    return teams_of_4 + teams_of_5
+        # Raise the values of students that the picked cliques missed, and
+        # lower the values of students they covered more than once
+        coverage = np.bincount(members[picked].ravel(),
+                               minlength=num_students + 1)[:num_students]
+        gradient = 1 - coverage
+        if not gradient.any():
+            # The picked cliques cover everyone exactly once, so the bound
+            # can't get any better
+            break
+        values[:num_students] += step_scale \
+            * max(target - bound, tolerance) / (gradient @ gradient) * gradient
+
+    return best_values, best_bound
 
-# TODO: This doesn't quite work yet, but I would really like to get it working
-# in the future!
-def assign_teams_rec(four_cliques, five_cliques, i, chosen_cliques, assigned_students, num_students, n):
+
+def assign_teams_exact(four_cliques, five_cliques, n_4, n_5, table,
+                       control=None, initial_teams=None):
     """
-    Assign students into the specified numbers of teams of 4 and 5 using a 
-    recursive backtracking algorithm.
+    Assign students into the specified numbers of teams of 4 and 5, choosing
+    the non-overlapping cliques that cover every student with the lowest
+    possible assignment_cost.
+
+    Searches for an exact cover of the students by cliques (Algorithm X).
+    At each step, the unassigned student with the fewest cliques left to
+    choose from must go on one of those cliques, so each of them is tried in
+    turn, and every clique that overlaps it is removed from the choices for
+    the rest of the search. The best cost of covering each remaining set of
+    students is remembered, and branches are skipped when a lower bound on
+    their cost (see _lagrangian_multipliers) shows they can't beat the best
+    assignment found so far.
+
+    The search starts from a known assignment, initial_teams (such as the
+    result of a heuristic like multistart_greedy or improve_teams_annealing),
+    or the greedy assignment if none is given, and only looks for
+    assignments cheaper than it, so the lower bounds are aimed at its cost
+    from the start. If nothing cheaper is found, the starting assignment is
+    the optimal one. If the greedy algorithm can't find an assignment
+    either, the search first looks for any assignment under a cost limit,
+    raising the limit until one is found, and uses it as the starting
+    assignment.
+
+    If control is given, it is checked at every step of the search and told
+    about the starting assignment and each cheaper one found, so that if the
+    search is stopped early the best assignment so far is kept (but isn't
+    known to be optimal).
 
-    Returns a list of cliques representing the chosen teams.
+    Returns a list of teams (tuples of student ids) representing the chosen
+    teams. Raises a ValueError if the cliques can't cover every student.
     """
-    num_students_left = num_students - len(assigned_students)
-    # If you can divide remaining students by 4, but not 5,
-    if (num_students_left % 4 == 0) and (num_students_left % 5 != 0):
-        # Start picking from 4-cliques
-        cliques = four_cliques
-        # And make it impossible to go back to 5-cliques
-        five_cliques = four_cliques
-    else:
-        cliques = five_cliques
-
-    # Base case: no more cliques to choose from
-    if i >= len(cliques):
-        return 10000, None
-    # Base case: no more cliques required -> return cost & choices
-    if n == 0:
-        print(0, chosen_cliques)
-        return assignment_cost(chosen_cliques), chosen_cliques[:]
-
-    # Additional base case: choose the next best clique of unassigned students
-    if n == 1:
-        if num_students-len(assigned_students) < 4:
-            # Can't create any more teams, so just score what you have
-            return assignment_cost(chosen_cliques), chosen_cliques[:]
-
-        j = i
-        # Find the first team of unassigned students, since they are sorted
-        # by score
-        while j < 1000 and overlaps(cliques[j].nodes, assigned_students):
-            j += 1
-        if j >= len(cliques):
-            # There are no cliques with the remaining students without silver
-            # bullets
-            return 10000, None
-
-        new_cliques = chosen_cliques + [cliques[j]]
-        # Calculate the overall score
-        cost = assignment_cost(new_cliques)
-        return cost, new_cliques
-
-    # Recursive case:
-    # Get current clique
-    curr_clique = cliques[i]
-    # Set costs for including or excluding very high by default
-    cost_incl, cost_excl = 10000, 10000
-    # Set both team options to None
-    teams_incl, teams_excl = None, None
-    # If ith clique does not overlap:
-    if not overlaps(curr_clique.nodes, assigned_students):
-        #   Get cost & choices for including ith clique
-        new_cliques = chosen_cliques + [curr_clique]
-        new_assigned_students = assigned_students | curr_clique.nodes
-        cost_incl, teams_incl = assign_teams_rec(
-            four_cliques, five_cliques, i+1, new_cliques, new_assigned_students, num_students, n-1)
-
-    if not teams_incl or team_compatibility(teams_incl[-1]) < 8:
-        # Get cost & choices for excluding ith clique
-        cost_excl, teams_excl = assign_teams_rec(
-            four_cliques, five_cliques, i+1, chosen_cliques, assigned_students, num_students, n)
-
-    if cost_excl > cost_incl:
-        cost, teams = cost_incl, teams_incl
+    four_cliques = CliqueSet.from_cliques(four_cliques)
+    five_cliques = CliqueSet.from_cliques(five_cliques)
+    num_students = 4 * n_4 + 5 * n_5
+    num_words = max(1, -(-num_students // 64))
+
+    # Put both clique lists together, padding 4-cliques with a placeholder
+    # student id (num_students) so they fit in the same array as 5-cliques
+    members = np.full((len(four_cliques) + len(five_cliques), 5),
+                      num_students, dtype=np.intp)
+    members[:len(four_cliques), :4] = four_cliques.members
+    members[len(four_cliques):] = five_cliques.members
+    sizes = np.repeat([4, 5], [len(four_cliques), len(five_cliques)])
+    masks = np.concatenate([
+        four_cliques.masks[:, :num_words], five_cliques.masks[:, :num_words]])
+    # assignment_cost adds up the squared evaluation of each team, so each
+    # clique's share of the cost can be computed up front
+    costs = np.concatenate([
+        team_evaluation_batch(cliques.members, table)**2
+        for cliques in (four_cliques, five_cliques) if len(cliques)
+    ] or [np.zeros(0)])
+
+    # Order cliques by cost, so cheaper cliques are tried first when choices
+    # have equal lower bounds
+    order = np.argsort(costs, kind="stable")
+    members, sizes, masks, costs = (
+        members[order], sizes[order], masks[order], costs[order])
+    team_masks = [team_mask(team[:size])
+                  for team, size in zip(members.tolist(), sizes.tolist())]
+
+    # Student values used for lower bounds, and each clique's cost minus the
+    # values of its members. These start at 0 (so a clique's reduced cost is
+    # just its cost) until a first cover has been found.
+    values = np.zeros(num_students + 1)
+    reduced_costs = costs
+
+    # Only look for assignments that are better than the best one found so
+    # far by more than this, so that rounding differences (costs and lower
+    # bounds are added up in different orders) don't count as improvements
+    tolerance = 1e-9
+
+    # Best cost and first team for sets of remaining students that have been
+    # solved, and proven lower bounds for ones that couldn't be solved within
+    # the allowed cost
+    solved = {}
+    lower_bounds = {}
+
+    def search(remaining, n_4_left, bound, live, first_only=False):
+        """
+        Finds the cheapest way to cover the remaining students (a bitmask)
+        with n_4_left teams of 4 and the rest in teams of 5 using the live
+        cliques (indices of cliques that only contain remaining students), if
+        it costs less than bound. If first_only is True, settles for the
+        first cover found instead.
+
+        Returns a tuple of (cost, True) if one was found, or else (lower
+        bound on the cost that is at least bound, False).
+        """
+        if control is not None:
+            control.check()
+        if remaining == 0:
+            return 0.0, True
+        key = (remaining, n_4_left)
+        if key in solved:
+            return solved[key][0], solved[key][0] + tolerance < bound
+        known_bound = lower_bounds.get(key, 0)
+        if known_bound + tolerance >= bound:
+            return known_bound, False
+
+        # Only consider teams of sizes that are still needed
+        n_5_left = (remaining.bit_count() - 4 * n_4_left) // 5
+        if n_4_left == 0:
+            live = live[sizes[live] == 5]
+        if n_5_left == 0:
+            live = live[sizes[live] == 4]
+
+        # Any cover costs at least the values of the remaining students plus
+        # the lowest reduced cost of a live clique for each team still needed
+        remaining_ids = [i for i in range(num_students) if remaining >> i & 1]
+        min_reduced = {4: 0.0, 5: 0.0}
+        for size, count in ((4, n_4_left), (5, n_5_left)):
+            if count:
+                size_reduced = reduced_costs[live[sizes[live] == size]]
+                if len(size_reduced) < count:
+                    lower_bounds[key] = float("inf")
+                    return lower_bounds[key], False
+                min_reduced[size] = size_reduced.min()
+        lower_bound = values[remaining_ids].sum() \
+            + n_4_left * min_reduced[4] + n_5_left * min_reduced[5]
+        if lower_bound + tolerance >= bound:
+            lower_bounds[key] = lower_bound
+            return lower_bound, False
+
+        # Lower bound on the cost of a cover using each live clique, from its
+        # own cost and the reduced costs of the teams still needed after it.
+        # Cliques that can't be part of a cover cheaper than bound are left
+        # out when choosing which student to branch on.
+        clique_bounds = np.maximum(costs[live], (
+            lower_bound + reduced_costs[live]
+            - np.where(sizes[live] == 4, min_reduced[4], min_reduced[5])))
+        useful = clique_bounds + tolerance < bound
+        useful_bounds, useful = clique_bounds[useful], live[useful]
+
+        # A cover made of useful cliques costs at most the cost of the most
+        # expensive one for each team still needed. If even that is below
+        # the lower bound, there is no such cover. This matters when many
+        # cliques cost nothing: only they may be useful, and a cover of them
+        # would cost nothing, which the lower bound can rule out even if it
+        # isn't quite up to bound.
+        if costs[useful].max(initial=0) * (n_4_left + n_5_left) + \
+                tolerance < lower_bound:
+            lower_bounds[key] = bound
+            return bound, False
+
+        # Branch on the student with the fewest useful cliques left. If a
+        # student has none, no cover can cost less than bound.
+        counts = np.bincount(members[useful].ravel(),
+                             minlength=num_students + 1)
+        student_id = min(remaining_ids, key=counts.__getitem__)
+        if counts[student_id] == 0:
+            lower_bounds[key] = bound
+            return bound, False
+        on_student = (members[useful] == student_id).any(axis=1)
+        choices, choice_bounds = useful[on_student], useful_bounds[on_student]
+        order = np.argsort(choice_bounds, kind="stable")
+        choices, choice_bounds = choices[order], choice_bounds[order]
+
+        best_cost, best_team = float("inf"), None
+        lower_bound = float("inf")
+        for choice, choice_bound in zip(choices.tolist(),
+                                        choice_bounds.tolist()):
+            limit = min(bound, best_cost)
+            if choice_bound + tolerance >= limit:
+                # Choices are sorted by lower bound, so none of the rest can
+                # be better either
+                lower_bound = min(lower_bound, choice_bound)
+                break
+
+            child = remaining & ~team_masks[choice]
+            child_n_4_left = n_4_left - (sizes[choice] == 4)
+            # Check what is already known about the remaining students before
+            # working out which cliques are left for them
+            child_key = (child, child_n_4_left)
+            child_bound = lower_bounds.get(child_key, 0)
+            if child_key not in solved and \
+                    costs[choice] + child_bound + tolerance >= limit:
+                lower_bound = min(lower_bound, costs[choice] + child_bound)
+                continue
+
+            # Remove every clique that overlaps this one
+            child_live = live[~(masks[live] & masks[choice]).any(axis=1)]
+            rest_cost, found = search(
+                child, child_n_4_left, limit - costs[choice], child_live,
+                first_only)
+            if found:
+                best_cost = costs[choice] + rest_cost
+                best_team = tuple(members[choice, :sizes[choice]].tolist())
+                if first_only:
+                    break
+            else:
+                lower_bound = min(lower_bound, costs[choice] + rest_cost)
+
+        if best_team is not None:
+            solved[key] = (best_cost, best_team)
+            return best_cost, True
+        lower_bounds[key] = max(lower_bound, bound)
+        return lower_bounds[key], False
+
+    def chosen_teams():
+        """
+        Follows the first team chosen for each set of remaining students.
+        """
+        teams = []
+        remaining, n_4_left = everyone, n_4
+        while remaining:
+            team = solved[(remaining, n_4_left)][1]
+            teams.append(team)
+            remaining &= ~team_mask(team)
+            n_4_left -= len(team) == 4
+        return teams
+
+    everyone = (1 << num_students) - 1
+    all_cliques = np.arange(len(costs))
+    team_counts = {4: n_4, 5: n_5}
+
+    if initial_teams is None:
+        # Start from the greedy assignment, if the cliques have one
+        try:
+            initial_teams = assign_teams_greedy(
+                four_cliques, five_cliques, n_4, n_5)
+        except ValueError:
+            pass
+    if initial_teams is not None:
+        best_teams = sorted(initial_teams, key=len)
+        best_cost = sum(team_evaluation_batch(np.array([team]), table)[0]**2
+                        for team in best_teams)
     else:
-        cost, teams = cost_excl, teams_excl
-    return cost, teams
+        # Without a greedy assignment, look for any cover cheaper than a cost
+        # limit, raising the limit until one is found. Before each search,
+        # find student values that give lower bounds close to the limit, so
+        # that branches which can't beat it are cut off quickly. The smallest
+        # difference between clique costs is a first guess at how far to
+        # raise the limit. No cover can cost more than max_cost, so past that
+        # the search runs with no limit at all. The cover found this way is
+        # only a starting point, since the search settles for the first one
+        # under the limit.
+        cost_steps = np.diff(np.unique(costs))
+        cost_steps = cost_steps[cost_steps > tolerance]
+        step = cost_steps.min() if len(cost_steps) else 1.0
+        max_cost = (n_4 + n_5) * costs.max(initial=0)
+        # Costs are sorted, so start from the cost of the cheapest cliques
+        limit = costs[sizes == 4][:n_4].sum() + costs[sizes == 5][:n_5].sum()
+        while True:
+            limit += step
+            step *= 2
+            if limit > max_cost:
+                limit = float("inf")
+            else:
+                values, lower_bound = _lagrangian_multipliers(
+                    members, sizes, costs, team_counts, values, limit,
+                    tolerance, control=control)
+                reduced_costs = costs - values[members].sum(axis=1)
+            best_cost, found = search(everyone, n_4, limit, all_cliques,
+                                      first_only=True)
+            if found:
+                break
+            if limit == float("inf"):
+                raise ValueError(
+                    "The cliques cannot cover every student with %i teams "
+                    "of 4 and %i teams of 5" % (n_4, n_5))
+            # Nothing was found, so every assignment costs at least the
+            # limit
+            limit = max(limit, lower_bound)
+        best_teams = chosen_teams()
+    if control is not None:
+        control.improved(best_teams)
+
+    # Aim the lower bounds at the cost of the best assignment so far, and
+    # search for anything cheaper. If nothing is found, no assignment is
+    # cheaper, so it is optimal.
+    values, _ = _lagrangian_multipliers(
+        members, sizes, costs, team_counts, values, best_cost, tolerance,
+        control=control)
+    reduced_costs = costs - values[members].sum(axis=1)
+    solved.clear()
+    lower_bounds.clear()
+    if search(everyone, n_4, best_cost, all_cliques)[1]:
+        best_teams = chosen_teams()
+        if control is not None:
+            control.improved(best_teams)
+    return best_teams
+
+
+def improve_teams_annealing(teams, table, steps=20000, start_temperature=1e-3,
+                            end_temperature=1e-7, conflict_penalty=1.0,
+                            seed=None, control=None):
+    """
+    Improve an assignment of students to teams with simulated annealing.
+
+    Each step picks two teams at random and either swaps a student between
+    them or, if the first team is bigger, moves a student from it to the
+    other team, so teams keep their sizes of 4 and 5. Only the two changed
+    teams are scored again (with team_evaluation), so each step takes the
+    same time no matter how many students there are. Changes that lower the
+    cost are always kept, and changes that raise it are kept with a chance
+    that shrinks as the temperature cools.
+
+    Arguments:
+        teams: a list of teams (tuples of student ids), such as the result of
+            another assignment function
+        table: the StudentTable the student ids refer to
+        steps: how many changes to try
+        start_temperature: temperature at the first step. A change that
+            raises the cost by this much is kept about 1/3 of the time.
+        end_temperature: temperature at the last step. The temperature cools
+            geometrically between the two.
+        conflict_penalty: cost added for each pair of teammates where one
+            asked not to work with the other
+        seed: optional seed for the random choices
+        control: optionally, a SolveControl checked at every step and told
+            about every new cheapest assignment
+
+    Return:
+        a list of teams (tuples of student ids) representing the cheapest
+        assignment found
+    """
+    rng = Random(seed)
+    teams = [list(team) for team in teams]
+    if len(teams) < 2:
+        return [tuple(sorted(team)) for team in teams]
+
+    def team_cost(team):
+        """
+        Squared team_evaluation of a team, plus the penalty for conflicts.
+        """
+        # team_evaluation depends on the order of the team, so score teams in
+        # the same order they are returned in
+        team = sorted(team)
+        conflicts = np.triu(
+            table.conflict_matrix[np.ix_(team, team)], 1).sum()
+        evaluation = team_evaluation([table.students[i] for i in team])
+        return evaluation**2 + conflict_penalty * conflicts
+
+    costs = [team_cost(team) for team in teams]
+    total_cost = sum(costs)
+    best_cost, best_teams = total_cost, [team[:] for team in teams]
+    cooling = (end_temperature / start_temperature) ** (1 / max(steps - 1, 1))
+    temperature = start_temperature
+
+    for _ in range(steps):
+        if control is not None:
+            control.check()
+        a, b = rng.sample(range(len(teams)), 2)
+        team_a, team_b = teams[a], teams[b]
+        i = rng.randrange(len(team_a))
+        if len(team_a) > len(team_b) and rng.random() < 0.5:
+            # Move student i from team a to team b
+            new_a = team_a[:i] + team_a[i + 1:]
+            new_b = team_b + [team_a[i]]
+        else:
+            # Swap student i of team a with student j of team b
+            j = rng.randrange(len(team_b))
+            new_a = team_a[:i] + [team_b[j]] + team_a[i + 1:]
+            new_b = team_b[:j] + [team_a[i]] + team_b[j + 1:]
+
+        new_cost_a, new_cost_b = team_cost(new_a), team_cost(new_b)
+        change = new_cost_a + new_cost_b - costs[a] - costs[b]
+        if change <= 0 or rng.random() < exp(-change / temperature):
+            teams[a], teams[b] = new_a, new_b
+            costs[a], costs[b] = new_cost_a, new_cost_b
+            total_cost += change
+            if total_cost < best_cost:
+                best_cost, best_teams = total_cost, [team[:] for team in teams]
+                if control is not None:
+                    control.improved(
+                        [tuple(sorted(team)) for team in best_teams],
+                        best_cost)
+        temperature *= cooling
+
+    return [tuple(sorted(team)) for team in best_teams]
@@ -0,0 +1,264 @@
+"""
+Times each stage of making teams (finding cliques, scoring them and assigning
+teams) on the sample graphs in /data and on synthetic classes of students, and
+saves the results to a JSON file. Two results files can be compared to find
+stages that got slower or used more memory.
+
+Usage:
+    python benchmark.py run results.json
+    python benchmark.py compare old_results.json new_results.json
+
+Each stage is timed several times and the fastest time is kept, then run once
+more with tracemalloc to measure its peak memory use. Throughput is the
+number of items (cliques found, teams scored or teams assigned) per second.
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from itertools import islice
+import joblib
+import numpy as np
+from assignments import assign_teams_greedy, assign_teams_joint_greedy
+from clique_finding import (
+    count_independent_sets, iter_independent_sets, iter_k_cliques)
+from clique_store import CliqueSet
+from data_loader import create_conflict_graph, load_student_data
+from helpers import num_size_teams, violates_anti_prefs
+from scoring import team_compatibility_batch, team_evaluation_batch
+from student import StudentTable
+from synthetic_data import generate_survey
+
+
+# Sample graphs in /data to benchmark
+SAMPLE_SUFFIXES = ["A20", "A24", "A28"]
+# Sizes of synthetic classes to benchmark
+SYNTHETIC_SIZES = [20, 50, 100, 200]
+# The most cliques of each size to find for a synthetic class. Bigger classes
+# have far too many cliques to find them all.
+MAX_CLIQUES = 200000
+
+
+def synthetic_students(num_students, seed=0):
+    """
+    Makes a list of Students from a synthetic survey (see synthetic_data.py).
+    They share a StudentTable, with ids matching their positions in the list.
+    """
+    survey = generate_survey(num_students, seed=seed)
+    return load_student_data(io.StringIO(survey.to_csv(index=False)))
+
+
+def sample_cliques(table, k, num_cliques, seed=0):
+    """
+    Picks up to num_cliques different random k-cliques (sets of students
+    without anti-preferences between them) from a class of students.
+
+    Returns an array with one sorted row of student ids per clique.
+    """
+    rng = np.random.default_rng(seed)
+    # Draw twice as many sets as needed, since some will be thrown out
+    cliques = np.sort(
+        rng.integers(0, len(table), size=(2 * num_cliques, k)), axis=1)
+    # Throw out sets with a student twice or with anti-preferences
+    cliques = cliques[(np.diff(cliques, axis=1) > 0).all(axis=1)]
+    cliques = cliques[~violates_anti_prefs(cliques, table)]
+    return np.unique(cliques, axis=0)[:num_cliques]
+
+
+def _measure(function, repeats):
+    """
+    Runs a function repeats times and once more under tracemalloc.
+
+    Returns a tuple of (the function's last result, fastest time in seconds,
+    peak memory in bytes).
+    """
+    best_time = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best_time, peak_bytes
+
+
+def benchmark_cohort(name, student_graph, conflict_graph, max_cliques=None,
+                     repeats=3):
+    """
+    Times every stage for one class of students.
+
+    Arguments:
+        name: a name for the class in the results
+        student_graph: the class's graph of compatible students, or None to
+            skip timing iter_k_cliques (for classes too big to build one)
+        conflict_graph: the class's graph of anti-preferences
+        max_cliques: the most cliques of each size to find, or None for all.
+            If there are more cliques than this, a random sample of this
+            many is scored instead, and assignment isn't timed.
+        repeats: how many times to time each stage
+
+    Return:
+        a list of dictionaries with one result per stage
+    """
+    students = list(conflict_graph.nodes)
+    table = StudentTable.of_students(students)
+    results = []
+
+    def record(stage, items, seconds, peak_bytes):
+        results.append({
+            "cohort": name,
+            "stage": stage,
+            "students": len(students),
+            "items": int(items),
+            "seconds": seconds,
+            "peak_bytes": peak_bytes,
+            "per_second": items / seconds if seconds > 0 else None,
+        })
+
+    cliques = {}
+    all_found = True
+    for k in [4, 5]:
+        if student_graph is not None and max_cliques is None:
+            found, seconds, peak = _measure(
+                lambda: list(iter_k_cliques(student_graph, k)), repeats)
+            record("iter_k_cliques_%i" % k, len(found), seconds, peak)
+
+        found, seconds, peak = _measure(
+            lambda: np.array(list(islice(
+                iter_independent_sets(conflict_graph, k), max_cliques)),
+                dtype=np.intp).reshape(-1, k), repeats)
+        record("iter_independent_sets_%i" % k, len(found), seconds, peak)
+
+        count, seconds, peak = _measure(
+            lambda: count_independent_sets(conflict_graph, k), repeats)
+        record("count_independent_sets_%i" % k, count, seconds, peak)
+
+        cliques[k] = found
+        if len(found) < count:
+            all_found = False
+            cliques[k] = sample_cliques(table, k, max_cliques)
+
+        compat, seconds, peak = _measure(
+            lambda: team_compatibility_batch(cliques[k], table), repeats)
+        record("team_compatibility_batch_%i" % k, len(compat), seconds, peak)
+
+        _, seconds, peak = _measure(
+            lambda: team_evaluation_batch(cliques[k], table), repeats)
+        record("team_evaluation_batch_%i" % k, len(compat), seconds, peak)
+
+        order = np.argsort(-compat, kind="stable")
+        cliques[k] = CliqueSet(cliques[k][order], compat[order],
+                               num_students=len(students))
+
+    # A sample of cliques almost never holds a way to split up every
+    # student, so assignment is only timed when every clique was found
+    if all_found:
+        num_5, num_4 = num_size_teams(len(students))
+        teams, seconds, peak = _measure(
+            lambda: assign_teams_greedy(cliques[4], cliques[5], num_4, num_5),
+            repeats)
+        record("assign_teams_greedy", len(teams), seconds, peak)
+
+        teams, seconds, peak = _measure(
+            lambda: assign_teams_joint_greedy(
+                cliques[4], cliques[5], len(students)), repeats)
+        record("assign_teams_joint_greedy", len(teams), seconds, peak)
+
+    return results
+
+
+def run(filename, sizes=SYNTHETIC_SIZES, repeats=3):
+    """
+    Benchmarks the sample graphs and synthetic classes of the given sizes,
+    and saves the results to a JSON file.
+    """
+    results = []
+    for suffix in SAMPLE_SUFFIXES:
+        student_graph = joblib.load("data/student_graph_" + suffix)
+        conflict_graph = create_conflict_graph(list(student_graph.nodes))
+        print("Benchmarking %s..." % suffix)
+        results += benchmark_cohort(suffix, student_graph, conflict_graph,
+                                    repeats=repeats)
+
+    for size in sizes:
+        conflict_graph = create_conflict_graph(synthetic_students(size))
+        print("Benchmarking %i synthetic students..." % size)
+        results += benchmark_cohort("synthetic%i" % size, None, conflict_graph,
+                                    MAX_CLIQUES, repeats)
+
+    for result in results:
+        print("%-12s %-30s %9i items %9.4fs %8.1f MB" % (
+            result["cohort"], result["stage"], result["items"],
+            result["seconds"], result["peak_bytes"] / 2**20))
+
+    with open(filename, "w") as results_file:
+        json.dump({
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "results": results,
+        }, results_file, indent=1)
+    print("Results saved in", filename)
+
+
+def compare(old_filename, new_filename, threshold=0.2):
+    """
+    Compares two results files and prints every stage whose time or peak
+    memory grew by more than threshold (a fraction of the old value).
+
+    Returns the number of regressions found.
+    """
+    with open(old_filename) as old_file:
+        old_results = json.load(old_file)["results"]
+    with open(new_filename) as new_file:
+        new_results = json.load(new_file)["results"]
+    old_by_stage = {(r["cohort"], r["stage"]): r for r in old_results}
+
+    regressions = 0
+    for new in new_results:
+        old = old_by_stage.get((new["cohort"], new["stage"]))
+        if old is None:
+            continue
+        for measure in ["seconds", "peak_bytes"]:
+            if old[measure] > 0 and \
+                    new[measure] > old[measure] * (1 + threshold):
+                regressions += 1
+                print("REGRESSION %s %s %s: %.4g -> %.4g (%+.0f%%)" % (
+                    new["cohort"], new["stage"], measure, old[measure],
+                    new[measure], 100 * (new[measure] / old[measure] - 1)))
+    print("%i regressions found" % regressions)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("results", help="JSON file to save results to")
+    run_parser.add_argument("--sizes", type=int, nargs="*",
+                            default=SYNTHETIC_SIZES,
+                            help="sizes of synthetic classes to benchmark")
+    run_parser.add_argument("--repeats", type=int, default=3,
+                            help="how many times to time each stage")
+    compare_parser = commands.add_parser(
+        "compare", help="compare two results files")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.2,
+        help="fraction a measurement can grow by before it is flagged")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.results, args.sizes, args.repeats)
+    else:
+        # Exit with an error if anything got worse, so scripts can check
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
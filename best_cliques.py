@@ -0,0 +1,224 @@
+"""
+Finds the cliques with the highest compatibility scores first, without
+finding every clique.
+
+The greedy assignment algorithms mostly use the best-scoring cliques, but
+scoring and sorting every clique takes time and memory that grow very fast
+with the size of the class. iter_best_cliques instead grows teams one student
+at a time from a priority queue of partial teams. Each partial team is
+queued with an upper bound on the team_compatibility score of any team it
+can grow into, found from upper bounds on each part of the score (partner
+preferences, skill sufficiency, skill distribution, topics and commitment
+variance). A full team is only produced once no partial team could grow
+into a better one, so teams come out in order of score, highest first.
+"""
+import heapq
+import numpy as np
+from math import perm
+from clique_store import CliqueSet
+from scoring import team_compatibility_batch
+
+
+# Added to every upper bound so that rounding errors can't make a bound
+# smaller than the score it bounds
+_BOUND_SLACK = 1e-9
+
+
+def _after(reduce, values, empty):
+    """
+    Combines the rows of values after each row with a ufunc like np.add or
+    np.maximum, so row i of the result combines rows i + 1, i + 2, ... of
+    values. The last row, with nothing after it, is filled with empty.
+    """
+    combined = reduce.accumulate(values[::-1], axis=0)[::-1]
+    return np.concatenate(
+        [combined[1:], np.full((1,) + values.shape[1:], empty)])
+
+
+class _ScoreBounds:
+    """
+    The columns of a StudentTable used to bound team_compatibility scores.
+    """
+    def __init__(self, table, k):
+        self.k = k
+        self.commitment = table.commitment.astype(float)
+        # Combined ratings in each area skill sufficiency looks at
+        self.skills = np.stack([table.mgmt, table.elec, table.prog,
+                                table.mech], axis=1).astype(float)
+        self.strongly_skilled = (self.skills >= 8).any(axis=1)
+        self.topic_matrix = table.topic_matrix.astype(np.int64)
+        self.pref_matrix = table.pref_matrix.astype(np.int64)
+
+    def child_bounds(self, team, candidates):
+        """
+        Finds upper bounds on the scores of the teams of k students that can
+        be made by adding candidates[i] and then some of candidates[i + 1:]
+        to a partial team, for each i. Both are arrays of student ids.
+
+        Every candidate after candidates[i] is counted as a possible
+        teammate for it, even if it conflicts with candidates[i], which can
+        only make the bound higher.
+
+        Return:
+            an array with the bound for each i, or -inf where there aren't
+            enough candidates left to fill the team
+        """
+        k = self.k
+        # Students still to be added after candidates[i]
+        num_added = k - len(team) - 1
+        num_left = len(candidates) - 1 - np.arange(len(candidates))
+
+        # Commitment variance is smallest when every added student has the
+        # commitment closest to the team's mean that a candidate could have
+        commitment = self.commitment[candidates]
+        team_sum = self.commitment[team].sum() + commitment
+        team_squares = (self.commitment[team]**2).sum() + commitment**2
+        closest = np.clip(
+            team_sum / (len(team) + 1),
+            _after(np.minimum, commitment, np.inf),
+            _after(np.maximum, commitment, -np.inf))
+        closest = np.where(num_left > 0, closest, 0)
+        commitment_variance = np.maximum(0, (
+            team_squares + num_added * closest**2) / k -
+            ((team_sum + num_added * closest) / k)**2)
+        scaled_commitment = (4 - commitment_variance) / 4
+
+        # The best student in each area is at best the best of the team and
+        # every candidate
+        skills = self.skills[candidates]
+        best_skills = np.maximum(
+            np.maximum(skills, _after(np.maximum, skills, 0)),
+            self.skills[team].max(axis=0, initial=0))
+        skill_defncy = (np.maximum(0, 8 - best_skills)**2).sum(axis=1) / 144
+        skill_sufficiency = 1 - skill_defncy
+
+        # At most num_added of the later candidates who are strongly skilled
+        # join
+        strong = self.strongly_skilled[candidates].astype(np.int64)
+        skill_distribution = (
+            self.strongly_skilled[team].sum() + strong +
+            np.minimum(num_added, _after(np.add, strong, 0))) / k
+
+        # Each topic gains at most one vote per added student, and the votes
+        # can't be spread over fewer topics than the team already votes for
+        topics = self.topic_matrix[candidates]
+        team_votes = self.topic_matrix[team].sum(axis=0) + topics
+        best_votes = team_votes + np.minimum(
+            num_added, _after(np.add, topics, 0))
+        if best_votes.shape[1] > 2:
+            best_votes = np.partition(best_votes, -2, axis=1)
+        top_2_topic_votes = best_votes[:, -2:].sum(axis=1)
+        scaled_topics = top_2_topic_votes / (
+            k * np.maximum(2, np.count_nonzero(team_votes, axis=1)))
+
+        # Preferences met within the team, with candidates[i] added
+        prefs = self.pref_matrix
+        own_prefs = prefs[candidates, candidates]
+        prefs_with_team = (prefs[np.ix_(candidates, team)].sum(axis=1) +
+                           prefs[np.ix_(team, candidates)].sum(axis=0))
+        met_partner_prefs = (prefs[np.ix_(team, team)].sum() +
+                             prefs_with_team + own_prefs)
+        if num_added:
+            # Each later candidate added meets at most their preferences with
+            # the team, with candidates[i], with themselves, and with
+            # num_added - 1 other candidates
+            between = prefs[np.ix_(candidates, candidates)]
+            gains = (prefs_with_team + own_prefs + np.minimum(
+                num_added - 1, between.sum(axis=1) - own_prefs))
+            gains = (gains[None, :] + between + between.T).astype(float)
+            # Only candidates after i can be added after candidates[i]
+            gains[np.tril_indices(len(candidates))] = -np.inf
+            if len(candidates) > num_added:
+                gains = np.partition(gains, -num_added, axis=1)
+            met_partner_prefs = met_partner_prefs + \
+                gains[:, -num_added:].sum(axis=1)
+        scaled_preference = met_partner_prefs / perm(k, 2)
+
+        bounds = (
+            3 * scaled_commitment +
+            3 * skill_sufficiency +
+            3 * skill_distribution +
+            2 * scaled_topics +
+            5 * scaled_preference
+        ) + _BOUND_SLACK
+        return np.where(num_left >= num_added, bounds, -np.inf)
+
+
+def iter_best_cliques(table, k):
+    """
+    Generator that finds the k-cliques of a class of students (sets of k
+    students with no anti-preference between any two of them) in order of
+    team_compatibility score, highest first. Only as many partial teams are
+    looked at as it takes to be sure of the next clique, so the best few
+    cliques can be found without finding every clique.
+
+    Arguments:
+        table: the StudentTable of the class, with a row for each student
+        k: the number of students in each clique, at least 2
+
+    Yields:
+        tuples of (sorted tuple of student ids, team_compatibility score)
+    """
+    if k < 2:
+        raise ValueError("Teams need at least 2 students to be scored, not %i"
+                         % k)
+    bounds_finder = _ScoreBounds(table, k)
+    conflicts = table.conflict_matrix
+    # Students who dislike themselves can't be on any team
+    allowed = ~conflicts.diagonal()
+    ids = np.arange(len(table))
+
+    # Queue of (-score or -upper bound, number, team, candidates), where
+    # candidates is None once the team is full. The number breaks ties in
+    # the order teams were queued. The candidates of a partial team can
+    # still include students who conflict with its newest member, since
+    # they are only filtered out once the team is taken off the queue.
+    queue = [(-np.inf, 0, (), ids[allowed])]
+    num_queued = 1
+
+    # Teams only grow with students ranked above all their members, so each
+    # team is only found once
+    while queue:
+        negative_score, _, team, candidates = heapq.heappop(queue)
+        if candidates is None:
+            yield team, -negative_score
+            continue
+        if team:
+            candidates = candidates[~conflicts[team[-1], candidates]]
+
+        if len(team) == k - 1:
+            # Score every full team this partial team can become at once
+            full_teams = np.column_stack([
+                np.tile(team, (len(candidates), 1)), candidates])
+            scores = team_compatibility_batch(full_teams, table).tolist()
+            children = zip(scores, map(tuple, full_teams.tolist()),
+                           [None] * len(scores))
+        else:
+            bounds = bounds_finder.child_bounds(
+                np.array(team, dtype=np.intp), candidates)
+            children = (
+                (bound, team + (student,), candidates[i + 1:])
+                for i, (bound, student) in enumerate(
+                    zip(bounds.tolist(), candidates.tolist()))
+                if bound > -np.inf)
+
+        for score, child, child_candidates in children:
+            heapq.heappush(queue, (-score, num_queued, child, child_candidates))
+            num_queued += 1
+
+
+def best_clique_set(table, k, num_cliques):
+    """
+    Returns a CliqueSet of the num_cliques k-cliques with the highest
+    compatibility scores (or every clique, if there are fewer), sorted with
+    the highest first like the CliqueSets the assignment algorithms take.
+    """
+    members = []
+    compat = []
+    for team, score in iter_best_cliques(table, k):
+        if len(members) == num_cliques:
+            break
+        members.append(team)
+        compat.append(score)
+    return CliqueSet(np.array(members, dtype=np.intp).reshape(-1, k),
+                     np.array(compat), len(table))
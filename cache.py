@@ -0,0 +1,136 @@
+"""
+Caches generated data (student graphs, cliques and clique scores) on disk,
+keyed by a hash of everything the data was generated from.
+
+A cached artifact is reused only if its inputs are exactly the same: the
+survey rows of the students it was made from, any other settings (like the
+clique size k), and scoring.SCORING_VERSION for scores. Changing the survey,
+the sample or the scoring code gives a new key, so stale data is never
+reused. Callers can leave out inputs an artifact doesn't depend on: the
+cliques made by data_loader, for example, are keyed only by the students'
+names and anti-preferences. When the cache grows past its size limit, the
+artifacts used least recently are deleted.
+"""
+import hashlib
+import os
+import joblib
+import numpy as np
+from student import Student, StudentTable
+
+
+def _update_hash(digest, value):
+    """
+    Adds a value to a hashlib object, in a way that keeps different values
+    (and different nestings of lists) from hashing the same.
+    """
+    if isinstance(value, Student):
+        # A student is hashed by their survey answers
+        value = ("Student", value.name, value.pronouns,
+                 sorted(value.topics), sorted(value.preferences),
+                 sorted(value.anti_prefs),
+                 [getattr(value, field) for field in StudentTable.INPUT_FIELDS])
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(b"array%s%s:" % (value.dtype.str.encode(),
+                                       str(value.shape).encode()))
+        digest.update(value.tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"list%i:" % len(value))
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        text = repr(value).encode()
+        digest.update(b"%s%i:" % (type(value).__name__.encode(), len(text)))
+        digest.update(text)
+
+
+def artifact_key(kind, inputs):
+    """
+    Returns the sha256 hex digest of an artifact's kind (such as "graph")
+    and a list of its inputs. Inputs can be Student objects, NumPy arrays,
+    strings, numbers, or lists and tuples of those.
+    """
+    digest = hashlib.sha256()
+    _update_hash(digest, [kind, list(inputs)])
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    A directory of cached artifacts, each in a file named by its kind and
+    key. NumPy arrays are saved as .npy files and anything else with joblib.
+
+    Counts how many artifacts were found in the cache (hits) and how many
+    had to be built (misses).
+    """
+    def __init__(self, directory="data/cache", max_bytes=2**30):
+        """
+        Arguments:
+            directory: the folder to keep artifacts in, created if needed
+            max_bytes: the most disk space the artifacts can take up before
+                the least recently used ones are deleted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, key):
+        """
+        Returns the path of an artifact's file, or None if it isn't cached.
+        """
+        for extension in (".npy", ".pkl"):
+            path = os.path.join(self.directory, kind + "_" + key + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get_or_build(self, kind, inputs, build):
+        """
+        Returns the cached artifact of the given kind made from the given
+        inputs, or calls build() to make it and caches the result.
+        """
+        key = artifact_key(kind, inputs)
+        path = self._path(kind, key)
+        if path is not None:
+            self.hits += 1
+            # Mark the artifact as recently used
+            os.utime(path)
+            if path.endswith(".npy"):
+                return np.load(path)
+            return joblib.load(path)
+
+        self.misses += 1
+        artifact = build()
+        path = os.path.join(self.directory, kind + "_" + key)
+        if isinstance(artifact, np.ndarray):
+            np.save(path + ".npy", artifact)
+        else:
+            joblib.dump(artifact, path + ".pkl")
+        self.evict()
+        return artifact
+
+    def evict(self):
+        """
+        Deletes the least recently used artifacts until the cache fits in
+        max_bytes, always keeping the most recently used one.
+        """
+        paths = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)]
+        paths.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in paths)
+        while total > self.max_bytes and len(paths) > 1:
+            path = paths.pop(0)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def report(self):
+        """
+        Returns a line describing how the cache has been used.
+        """
+        names = os.listdir(self.directory)
+        size = sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in names)
+        return "Cache: %i hits, %i misses, %i artifacts using %.1f MB" % (
+            self.hits, self.misses, len(names), size / 2**20)
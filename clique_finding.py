@@ -1,57 +1,714 @@
+"""
+Algorithms for finding the cliques of a student graph, which are the
+possible teams.
+
+Student graphs connect every pair of students without an anti-preference
+between them, so they are almost complete. The same teams can be found much
+faster from the cohort's conflict graph, which only has an edge for each
+anti-preference: a team is a clique of the student graph exactly when it is
+an independent set of the conflict graph (no two members share an edge).
+
+The independent set searches work on conflict masks (see conflict_masks),
+one bitmask of conflicts per node. iter_constrained_sets also limits how
+many members of some groups of nodes a set can have, which is how
+constraints.TeamConstraints finds teams.
+"""
 import networkx as nx
-from itertools import combinations
-from helpers import violates_anti_prefs
+from itertools import combinations, islice
+from math import comb
+
+
+def _ordered_neighborhoods(graph):
+    """
+    Ranks the nodes of a graph from lowest to highest degree and finds the
+    higher-ranked neighbours of each node.
+
+    Arguments:
+        graph: a networkx Graph object
+
+    Return:
+        a tuple of (list of nodes in rank order, list of bitmasks where bit j
+        of entry i is set if the node ranked j is a neighbour of the node
+        ranked i and j > i)
+    """
+    # Rank low-degree nodes first so that every node only has to look "up" at
+    # a small set of neighbours (this is what keeps each clique from being
+    # found more than once)
+    ranked_nodes = sorted(graph.nodes, key=graph.degree)
+    rank = {node: i for i, node in enumerate(ranked_nodes)}
+
+    higher_neighbors = []
+    for i, node in enumerate(ranked_nodes):
+        mask = 0
+        for neighbor in graph.neighbors(node):
+            j = rank[neighbor]
+            if j > i:
+                mask |= 1 << j
+        higher_neighbors.append(mask)
+
+    return ranked_nodes, higher_neighbors
+
+
+def _extend_cliques(clique, candidates, k, higher_neighbors):
+    """
+    Yields every k-clique that extends a partial clique using only the
+    candidate nodes, which must all be ranked above the partial clique and be
+    adjacent to every node in it.
+
+    Cliques are tuples of node ranks in increasing order.
+    """
+    # Not enough candidates left to fill the clique, so prune this branch
+    if candidates.bit_count() < k - len(clique):
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+
+        if len(clique) + 1 == k:
+            yield clique + (j,)
+        else:
+            # Only nodes ranked above j that are also adjacent to j can be
+            # added after it
+            yield from _extend_cliques(
+                clique + (j,), candidates & higher_neighbors[j], k,
+                higher_neighbors)
+
+
+def iter_k_cliques(graph, k):
+    """
+    Generator that finds cliques of size-k in a graph one at a time
+
+    Nodes are ranked by degree and each clique is only ever extended by
+    common neighbours ranked above all of its current members, so every
+    k-clique is produced exactly once.
+
+    Arguments:
+        graph: a networkx Graph object
+        k: an integer representing the size of the cliques to find
+
+    Yields:
+        sorted tuples of integers, where each integer is the index of a node
+        in list(graph.nodes)
+    """
+    # can't have a k-clique in a k-1 graph
+    if k > graph.number_of_nodes() or k < 1:
+        return
+
+    ranked_nodes, higher_neighbors = _ordered_neighborhoods(graph)
+    # Translate node ranks back into positions in the graph's node list
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    rank_to_index = [index[node] for node in ranked_nodes]
+
+    if k == 1:
+        for i in range(len(rank_to_index)):
+            yield (i,)
+        return
+
+    # Every clique is found starting from its lowest-ranked node
+    for i, candidates in enumerate(higher_neighbors):
+        for ranks in _extend_cliques((i,), candidates, k, higher_neighbors):
+            yield tuple(sorted(rank_to_index[j] for j in ranks))
+
+
+def _extend_cliques_sizes(clique, candidates, sizes, next_size,
+                          higher_neighbors):
+    """
+    Like _extend_cliques, but yields every clique extending a partial clique
+    whose size is in sizes (a set), so the cliques of one size are found on
+    the way to the cliques of the next. next_size[i] is the smallest size
+    bigger than i, or None if there are none.
+    """
+    size = next_size[len(clique)]
+    # Not enough candidates left to reach the next size, so prune this branch
+    if candidates.bit_count() < size - len(clique):
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+
+        new_clique = clique + (j,)
+        if len(new_clique) in sizes:
+            yield new_clique
+        if next_size[len(new_clique)] is not None:
+            # The common neighbours of the new clique are shared by every
+            # size it grows to
+            yield from _extend_cliques_sizes(
+                new_clique, candidates & higher_neighbors[j], sizes,
+                next_size, higher_neighbors)
+
+
+def iter_cliques(graph, sizes):
+    """
+    Generator that finds the cliques of every given size in a graph at once,
+    like calling iter_k_cliques for each size but only looking at each
+    smaller clique once. Each clique of the smallest size is extended into
+    the bigger ones as soon as it is found.
+
+    Arguments:
+        graph: a networkx Graph object
+        sizes: an iterable of the sizes of the cliques to find
+
+    Yields:
+        sorted tuples of integers of any of the sizes, where each integer is
+        the index of a node in list(graph.nodes)
+    """
+    sizes = tuple(sorted(size for size in set(sizes) if size >= 1))
+    if not sizes:
+        return
+
+    ranked_nodes, higher_neighbors = _ordered_neighborhoods(graph)
+    # Translate node ranks back into positions in the graph's node list
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    rank_to_index = [index[node] for node in ranked_nodes]
+
+    next_size = [min((size for size in sizes if size > length), default=None)
+                 for length in range(sizes[-1] + 1)]
+    sizes = set(sizes)
+
+    # Every clique is found starting from its lowest-ranked node
+    for i, candidates in enumerate(higher_neighbors):
+        if 1 in sizes:
+            yield (rank_to_index[i],)
+        if next_size[1] is None:
+            continue
+        for ranks in _extend_cliques_sizes((i,), candidates, sizes,
+                                           next_size, higher_neighbors):
+            yield tuple(sorted(rank_to_index[j] for j in ranks))
+
+
+def enumerate_cliques(graph, sizes=(4, 5)):
+    """
+    Finds the cliques of every given size in a graph in one pass (see
+    iter_cliques).
+
+    Arguments:
+        graph: a networkx Graph object
+        sizes: an iterable of the sizes of the cliques to find
+
+    Return:
+        a dictionary of {size: list of the cliques of that size, as sorted
+        tuples of indices into list(graph.nodes)}
+    """
+    # sizes is read twice, so a generator has to be copied first
+    sizes = tuple(sizes)
+    cliques = {size: [] for size in sizes}
+    for clique in iter_cliques(graph, sizes):
+        cliques[len(clique)].append(clique)
+    return cliques
+
+
+def clique_indices(graph, cliques):
+    """
+    Converts cliques stored as networkx Graph objects (like the ones returned
+    by find_k_clique) into the sorted index tuples used by iter_k_cliques.
+
+    Arguments:
+        graph: the networkx Graph object the cliques were found in
+        cliques: a list of networkx Graph objects representing cliques
+
+    Return:
+        a list of sorted tuples of indices into list(graph.nodes)
+    """
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    return [tuple(sorted(index[node] for node in clique.nodes))
+            for clique in cliques]
 
 
 def find_k_clique(graph, k):
     """
     Algorithm to find cliques of size-k in a graph
 
+    Builds a subgraph for every clique found by iter_k_cliques, so prefer
+    iter_k_cliques when only the members of each clique are needed.
+
     Arguments:
         graph: a networkx Graph object
         k: an integer representing the size of the cliques to find
-    
+
     Return:
         a list of networkx Graph objects representing cliques
     """
-    # can't have a k-clique in a k-1 graph
-    if k > graph.number_of_nodes():
-        return []
-
     # this might technically be correct but is it useful? only for error handling
     if k == 1:
         return list(graph.nodes)
 
-    # if we've gotten to this point we have k >= 2
-    two_cliques = [graph.subgraph(edge) for edge in graph.edges]
+    nodes = list(graph.nodes)
+    # pull out the subgraph containing all the nodes in each clique
+    return [graph.subgraph([nodes[i] for i in clique]).copy()
+            for clique in iter_k_cliques(graph, k)]
 
-    if k == 2:
-        return two_cliques
 
-    count = 2
-    cliques = two_cliques
-    next_k_cliques = []
-    clique_nodes = set()
+def conflict_masks(conflict_graph):
+    """
+    Finds the conflicts of each node of a conflict graph as bitmasks.
 
-    while count < k:
-        # enumerate all the possible edge combinations
-        for graph1, graph2 in combinations(cliques, 2):
+    Return:
+        a list of bitmasks where bit j of entry i is set if the nodes at
+        positions i and j of list(conflict_graph.nodes) share an edge. A node
+        with an edge to itself has its own bit set.
+    """
+    index = {node: i for i, node in enumerate(conflict_graph.nodes)}
+    conflicts = [0] * len(index)
+    for node1, node2 in conflict_graph.edges:
+        i, j = index[node1], index[node2]
+        conflicts[i] |= 1 << j
+        conflicts[j] |= 1 << i
+    return conflicts
 
-            # find our candidate edge
-            candidate_edge = (graph1.nodes | graph2.nodes) - (graph1.nodes & graph2.nodes)
 
-            if len(candidate_edge) == 2 and graph.has_edge(*candidate_edge) and candidate_edge not in next_k_cliques:
-                nodes = tuple(graph1.nodes | graph2.nodes)
+def _count_independent(candidates, k, conflicts, counts):
+    """
+    Counts the independent sets of size k among the candidate nodes (a
+    bitmask), remembering counts already found in the dictionary counts.
 
-                if nodes not in clique_nodes:
-                    # pull out the subgraph containing all the nodes in this clique and add it to the list of cliques
-                    clique = graph.subgraph(nodes).copy()
-                    next_k_cliques.append(clique)
-                    # add the nodes to the set of clique nodes so we can easily eliminate duplicates
-                    clique_nodes.add(nodes)
-        count += 1
-        cliques = next_k_cliques
-        next_k_cliques = []
+    Uses I(G, k) = I(G - v, k) + I(G - N[v], k - 1) for a node v with a
+    conflict, which splits the sets into those without v and those with it.
+    Once no candidates conflict, every k-subset of them is independent.
+    """
+    if k == 0:
+        return 1
+    if candidates.bit_count() < k:
+        return 0
+    key = (candidates, k)
+    if key not in counts:
+        remaining = candidates
+        while remaining:
+            lowest = remaining & -remaining
+            remaining ^= lowest
+            v = lowest.bit_length() - 1
+            if conflicts[v] & candidates:
+                break
+        else:
+            counts[key] = comb(candidates.bit_count(), k)
+            return counts[key]
+        without_v = candidates & ~lowest
+        counts[key] = (
+            _count_independent(without_v, k, conflicts, counts) +
+            _count_independent(without_v & ~conflicts[v], k - 1, conflicts,
+                               counts))
+    return counts[key]
 
-    return cliques
 
+def _extend_independent(chosen, candidates, k, conflicts):
+    """
+    Yields every independent set of size k that extends the chosen nodes
+    (a tuple of positions) with candidate nodes ranked above them that
+    conflict with none of them.
+    """
+    if len(chosen) == k:
+        yield chosen
+        return
+    # Not enough candidates left to fill the set, so prune this branch
+    if candidates.bit_count() < k - len(chosen):
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+        yield from _extend_independent(
+            chosen + (j,), candidates & ~conflicts[j], k, conflicts)
+
+
+def _skip_independent(chosen, candidates, k, conflicts, skip, counts):
+    """
+    Like _extend_independent, but leaves out the first skip sets it would
+    yield. Branches with no more sets than are left to skip are counted with
+    _count_independent (remembering counts in the dictionary counts) rather
+    than walked.
+    """
+    if skip == 0:
+        yield from _extend_independent(chosen, candidates, k, conflicts)
+        return
+    # The only set here is the chosen nodes, which is skipped
+    if len(chosen) == k:
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+        new_candidates = candidates & ~conflicts[j]
+        if skip:
+            num_sets = _count_independent(new_candidates, k - len(chosen) - 1,
+                                          conflicts, counts)
+            if num_sets <= skip:
+                skip -= num_sets
+                continue
+        yield from _skip_independent(chosen + (j,), new_candidates, k,
+                                     conflicts, skip, counts)
+        skip = 0
+
+
+def _split_nodes(conflicts):
+    """
+    Splits the positions of the nodes with the given conflict masks (see
+    conflict_masks) into those with no conflicts and a bitmask of those
+    with conflicts (leaving out nodes that conflict with themselves, which
+    can't be on any team).
+
+    Return:
+        a tuple of (list of positions of nodes with no conflicts, bitmask of
+        the others)
+    """
+    free = []
+    conflicted = 0
+    for i, mask in enumerate(conflicts):
+        if mask == 0:
+            free.append(i)
+        elif not mask >> i & 1:
+            conflicted |= 1 << i
+    return free, conflicted
+
+
+def count_independent_sets(conflict_graph, k):
+    """
+    Counts the k-subsets of the nodes of a conflict graph with no conflict
+    between any two of them, which is the number of k-cliques in the student
+    graph with the same students.
+
+    Every independent set is some independent set of the nodes that have
+    conflicts, plus any subset of the nodes without conflicts, so only the
+    nodes with conflicts need to be looked at one by one.
+    """
+    conflicts = conflict_masks(conflict_graph)
+    free, conflicted = _split_nodes(conflicts)
+    counts = {}
+    return sum(
+        _count_independent(conflicted, j, conflicts, counts) *
+        comb(len(free), k - j)
+        for j in range(k + 1))
+
+
+def iter_independent_sets(conflict_graph, k, start=0, stop=None):
+    """
+    Generator that finds the independent sets of size-k in a conflict graph,
+    which are the k-cliques of the student graph with the same students.
+
+    Sets are numbered by the independent set of nodes with conflicts they
+    contain, then by the position of their other nodes in the lexicographic
+    order of subsets of the nodes without conflicts. Only sets numbered from
+    start up to (not including) stop are produced, so a list of sets can be
+    split into slices that are found separately. Sets before start are
+    counted rather than produced: the subsets of the nodes without conflicts
+    with binomial coefficients, and the independent sets of the nodes with
+    conflicts with _count_independent, a whole branch of the search at a
+    time.
+
+    Arguments:
+        conflict_graph: a networkx Graph object with an edge between each
+            pair of students where one has an anti-preference for the other
+        k: an integer representing the size of the sets to find
+        start, stop: the numbers of the first set to produce and the set to
+            stop before (or None for no limit)
+
+    Yields:
+        sorted tuples of integers, where each integer is the index of a node
+        in list(conflict_graph.nodes)
+    """
+    return _iter_independent(conflict_masks(conflict_graph), k, start, stop)
+
+
+def _iter_independent(conflicts, k, start=0, stop=None):
+    """
+    Yields the independent sets of iter_independent_sets, given the conflict
+    masks from conflict_masks.
+    """
+    free, conflicted = _split_nodes(conflicts)
+    position = 0
+    counts = {}
+    for j in range(k + 1):
+        group_size = comb(len(free), k - j)
+        if group_size == 0:
+            continue
+        if stop is not None and position >= stop:
+            return
+        # Count the groups that end before start instead of finding them
+        skip = max(start - position, 0) // group_size
+        num_groups = _count_independent(conflicted, j, conflicts, counts) \
+            if skip else 0
+        if skip and skip >= num_groups:
+            position += num_groups * group_size
+            continue
+        position += skip * group_size
+        for chosen in _skip_independent((), conflicted, j, conflicts, skip,
+                                        counts):
+            if stop is not None and position >= stop:
+                return
+            if position + group_size > start:
+                # Skip to start, and stop at stop, within this group
+                first = max(start - position, 0)
+                last = group_size if stop is None \
+                    else min(stop - position, group_size)
+                for others in islice(combinations(free, k - j), first, last):
+                    yield tuple(sorted(chosen + others))
+            position += group_size
+
+
+def _extend_independent_sizes(chosen, candidates, smallest, largest,
+                              conflicts):
+    """
+    Like _extend_independent, but yields the chosen nodes and every
+    independent set extending them with a size from smallest to largest.
+    """
+    if len(chosen) >= smallest:
+        yield chosen
+    if len(chosen) == largest:
+        return
+    # Not enough candidates left to reach the smallest size, so prune this
+    # branch
+    if len(chosen) + candidates.bit_count() < smallest:
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+        yield from _extend_independent_sizes(
+            chosen + (j,), candidates & ~conflicts[j], smallest, largest,
+            conflicts)
+
+
+def iter_sized_independent_sets(conflict_graph, sizes):
+    """
+    Generator that finds the independent sets of every given size in a
+    conflict graph at once, like calling iter_independent_sets for each size.
+
+    Like iter_independent_sets, the nodes are split into those with and
+    without conflicts, but the independent sets of the nodes with conflicts
+    are only found once, in one pass, and each is combined with the subsets
+    of the nodes without conflicts that make it up to each size.
+
+    Arguments:
+        conflict_graph: a networkx Graph whose edges are conflicts
+        sizes: an iterable of the sizes of the sets to find
+
+    Yields:
+        sorted tuples of integers of any of the sizes, where each integer is
+        the index of a node in list(conflict_graph.nodes)
+    """
+    sizes = sorted(size for size in set(sizes) if size >= 1)
+    if not sizes:
+        return
+    conflicts = conflict_masks(conflict_graph)
+    free, conflicted = _split_nodes(conflicts)
+
+    # Only sets of nodes with conflicts that some number of free nodes can
+    # make up to a size are needed
+    smallest = max(0, sizes[0] - len(free))
+    for chosen in _extend_independent_sizes((), conflicted, smallest,
+                                            sizes[-1], conflicts):
+        for size in sizes:
+            if 0 <= size - len(chosen) <= len(free):
+                for others in combinations(free, size - len(chosen)):
+                    yield tuple(sorted(chosen + others))
+
+
+def _self_conflicts(conflicts):
+    """
+    Returns a bitmask of the nodes that conflict with themselves, given the
+    conflict masks from conflict_masks.
+    """
+    blocked = 0
+    for i, mask in enumerate(conflicts):
+        blocked |= mask & (1 << i)
+    return blocked
+
+
+def _rooted_candidates(conflicts, root, blocked):
+    """
+    Returns a bitmask of the nodes that can be on a team whose lowest-ranked
+    member is root: the nodes ranked above it that it doesn't conflict with,
+    leaving out the blocked nodes (see _self_conflicts). Nodes are ranked by
+    their positions.
+    """
+    higher = ((1 << len(conflicts)) - 1) & ~((1 << (root + 1)) - 1)
+    return higher & ~conflicts[root] & ~blocked
+
+
+def estimate_rooted_counts(conflicts, k):
+    """
+    Estimates how many independent sets of size-k have each node as their
+    lowest-ranked member, as the number of ways to pick k - 1 of its
+    candidates (see _rooted_candidates). This is exact when none of the
+    candidates conflict with each other, and too high otherwise.
+
+    Arguments:
+        conflicts: a conflict graph, or its conflict masks (see
+            conflict_masks), like TeamConstraints.conflicts
+        k: the size of the independent sets
+
+    Return:
+        a list with the estimate for each node, by position
+    """
+    if isinstance(conflicts, nx.Graph):
+        conflicts = conflict_masks(conflicts)
+    blocked = _self_conflicts(conflicts)
+    return [0 if blocked >> root & 1 else comb(
+                _rooted_candidates(conflicts, root, blocked).bit_count(), k - 1)
+            for root in range(len(conflicts))]
+
+
+def _iter_rooted(conflicts, k, roots):
+    """
+    Yields the independent sets of size-k whose lowest-ranked member is one
+    of the roots, given the conflict masks from conflict_masks.
+
+    Like iter_independent_sets, the candidates of each root are split into
+    those that conflict with another candidate and those that don't, and
+    every independent set of the first kind is combined with every subset
+    of the second.
+    """
+    blocked = _self_conflicts(conflicts)
+    for root in roots:
+        if blocked >> root & 1:
+            # A student who conflicts with themselves can't be on a team
+            continue
+        candidates = _rooted_candidates(conflicts, root, blocked)
+        free = []
+        conflicted = 0
+        remaining = candidates
+        while remaining:
+            lowest = remaining & -remaining
+            remaining ^= lowest
+            j = lowest.bit_length() - 1
+            if conflicts[j] & candidates:
+                conflicted |= lowest
+            else:
+                free.append(j)
+        for j in range(k):
+            if comb(len(free), k - 1 - j) == 0:
+                continue
+            for chosen in _extend_independent((root,), conflicted, j + 1,
+                                              conflicts):
+                for others in combinations(free, k - 1 - j):
+                    yield tuple(sorted(chosen + others))
+
+
+def iter_rooted_independent_sets(conflict_graph, k, roots):
+    """
+    Generator that finds the independent sets of size-k in a conflict graph
+    whose lowest member (by position in list(conflict_graph.nodes)) is one
+    of the given roots. Every independent set has exactly one lowest member,
+    so splitting the positions between several calls finds every set
+    exactly once.
+
+    Yields:
+        sorted tuples of integers, where each integer is the index of a node
+        in list(conflict_graph.nodes)
+    """
+    if k < 1:
+        return
+    yield from _iter_rooted(conflict_masks(conflict_graph), k, roots)
+
+
+def _add_to_groups(node, candidates, counts, conflicts, groups):
+    """
+    Returns the candidates and group counts of a partial set after a node
+    joins it (see iter_constrained_sets).
+    """
+    candidates &= ~conflicts[node]
+    new_counts = []
+    for (mask, _, at_most), count in zip(groups, counts):
+        count += mask >> node & 1
+        if at_most is not None and count >= at_most:
+            # The group is full, so no more of it can join
+            candidates &= ~mask
+        new_counts.append(count)
+    return candidates, new_counts
+
+
+def _extend_constrained(chosen, candidates, k, counts, conflicts, groups):
+    """
+    Yields every set of k nodes that meets the constraints and extends the
+    chosen nodes (a tuple of positions in increasing order) with candidates
+    (a bitmask of nodes ranked above them that conflict with none of them
+    and can join without going over any group's maximum). counts is the
+    number of chosen nodes in each group.
+    """
+    num_needed = k - len(chosen)
+    if candidates.bit_count() < num_needed:
+        return
+    # Give up on the set if it can't reach some group's minimum
+    for (mask, at_least, _), count in zip(groups, counts):
+        if count + min(num_needed, (candidates & mask).bit_count()) < \
+                at_least:
+            return
+    if num_needed == 0:
+        yield chosen
+        return
+
+    while candidates:
+        # Take the lowest-ranked candidate off the candidate set
+        lowest = candidates & -candidates
+        candidates ^= lowest
+        j = lowest.bit_length() - 1
+        new_candidates, new_counts = _add_to_groups(j, candidates, counts,
+                                                    conflicts, groups)
+        yield from _extend_constrained(chosen + (j,), new_candidates, k,
+                                       new_counts, conflicts, groups)
+
+
+def iter_constrained_sets(conflicts, k, groups=(), roots=None):
+    """
+    Generator that finds the independent sets of size-k of a conflict graph
+    that also have a number of nodes from each of some groups, like the
+    teams allowed by a constraints.TeamConstraints.
+
+    Sets are grown one node at a time from their lowest-ranked member, and a
+    partial set is dropped as soon as it can't meet every group's limits.
+    With no groups, this is iter_independent_sets (or, with roots,
+    iter_rooted_independent_sets).
+
+    Arguments:
+        conflicts: a conflict graph, or its conflict masks (see
+            conflict_masks). A node that conflicts with itself is never in a
+            set.
+        k: the size of the sets to find
+        groups: a list of (bitmask of nodes, fewest in a set, most in a set
+            or None for no limit) tuples
+        roots: optionally, the positions of the nodes to find sets from.
+            Only the sets whose lowest-ranked member is one of the roots are
+            found.
+
+    Yields:
+        sorted tuples of node positions
+    """
+    if isinstance(conflicts, nx.Graph):
+        conflicts = conflict_masks(conflicts)
+    if k < 1:
+        return
+    if not groups:
+        # With only conflicts, the faster independent set search works
+        if roots is None:
+            yield from _iter_independent(conflicts, k)
+        else:
+            yield from _iter_rooted(conflicts, k, roots)
+        return
+    if roots is None:
+        roots = range(len(conflicts))
+
+    # Nodes that conflict with themselves, or that are in a group no set
+    # can have any of, can't be in a set
+    blocked = _self_conflicts(conflicts)
+    for mask, _, at_most in groups:
+        if at_most == 0:
+            blocked |= mask
+    for root in roots:
+        if blocked >> root & 1:
+            continue
+        candidates = _rooted_candidates(conflicts, root, blocked)
+        candidates, counts = _add_to_groups(root, candidates,
+                                            [0] * len(groups), conflicts,
+                                            groups)
+        yield from _extend_constrained((root,), candidates, k, counts,
+                                       conflicts, groups)
@@ -1,7 +1,25 @@
 import networkx as nx
-from itertools import combinations
 
-from helpers import violates_anti_prefs
+from constraints import TeamConstraints
+
+
+def iter_k_cliques(graph, k):
+    """
+    Generator that finds every combination of k students in a graph without
+    any anti-preferences between them. Combinations are built up one student
+    at a time, and never extended once two of their students conflict (see
+    constraints.py)
+
+    Arguments:
+        graph: a networkx Graph object
+        k: an integer representing the size of the cliques to find
+
+    Yields:
+        sorted tuples of integers, where each integer is the index of a node
+        in list(graph.nodes)
+    """
+    constraints = TeamConstraints.from_students(list(graph.nodes))
+    yield from constraints.iter_teams(k)
 
 
 def find_k_clique(graph, k):
@@ -15,11 +33,10 @@ def find_k_clique(graph, k):
     Return:
         a list of networkx Graph objects representing cliques
     """
-    cliques = []
-    combos = combinations(graph.nodes, k)
+    nodes = list(graph.nodes)
 
-    for combo in combos:
-        if not violates_anti_prefs(combo):
-            clique = graph.subgraph(combo).copy()
-            cliques.append(clique)
+    cliques = []
+    for combo in iter_k_cliques(graph, k):
+        clique = graph.subgraph([nodes[i] for i in combo]).copy()
+        cliques.append(clique)
     return cliques
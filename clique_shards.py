@@ -0,0 +1,201 @@
+"""
+Finds the k-cliques of a class of students with several worker processes at
+once, each saving its own shard of the cliques.
+
+Every clique is found from its lowest member (by position in the list of
+students), so the students are split between the workers as roots and each
+worker only finds the cliques rooted at its own students. Roots near the
+start of the list root far more cliques than roots near the end, so rather
+than giving each worker the same number of roots, the roots are shared out
+by their estimated number of cliques (see
+clique_finding.estimate_rooted_counts). A manifest lists the shards, and
+clique_store.load_cliques reads them back as one array.
+
+If only the best cliques for each student are wanted, find_top_cliques has
+each worker score its cliques as it finds them and keep only its best ones
+(see clique_stream.py), so the full list of cliques is never saved.
+
+Teams can also be limited by more constraints than anti-preferences (see
+constraints.py), which each worker checks as it finds its cliques.
+"""
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import numpy as np
+from clique_finding import estimate_rooted_counts
+from clique_store import (
+    clique_dtype, remove_saved, save_shard_manifest, shard_filename)
+from clique_stream import TopCliques, iter_chunks, keep_top_cliques
+from constraints import TeamConstraints
+from helpers import mp_context
+
+
+def balance_roots(estimates, num_shards):
+    """
+    Splits roots between shards so that each shard's total estimated number
+    of cliques is about the same, by giving each root (biggest estimate
+    first) to the shard with the smallest total so far.
+
+    Arguments:
+        estimates: the estimated number of cliques rooted at each position
+        num_shards: the number of shards to split the roots between
+
+    Return:
+        a list with the sorted list of roots of each shard
+    """
+    shards = [[] for _ in range(num_shards)]
+    # Heap of (total estimate, shard number), so the lightest shard is first
+    totals = [(0, shard) for shard in range(num_shards)]
+    for root in sorted(range(len(estimates)), key=lambda i: -estimates[i]):
+        total, shard = heapq.heappop(totals)
+        shards[shard].append(root)
+        heapq.heappush(totals, (total + estimates[root], shard))
+    return [sorted(roots) for roots in shards]
+
+
+def _find_shard(constraints, k, roots, filename):
+    """
+    Finds the cliques rooted at the given positions and saves them to a
+    shard file.
+
+    Return:
+        a tuple of (number of cliques found, seconds spent)
+    """
+    start_time = time.perf_counter()
+    cliques = np.fromiter(
+        chain.from_iterable(constraints.iter_teams(k, roots)),
+        dtype=clique_dtype(constraints.num_students)).reshape(-1, k)
+    np.save(filename, cliques)
+    return len(cliques), time.perf_counter() - start_time
+
+
+def _find_top_shard(constraints, k, roots, table, per_student):
+    """
+    Finds the cliques rooted at the given positions, keeping only the best
+    per_student cliques of each student.
+
+    Return:
+        a tuple of (TopCliques holding the cliques kept, seconds spent)
+    """
+    start_time = time.perf_counter()
+    top = keep_top_cliques(iter_chunks(constraints.iter_teams(k, roots), k),
+                           k, table, per_student)
+    return top, time.perf_counter() - start_time
+
+
+def _split_roots(conflict_graph, k, num_workers, constraints):
+    """
+    Shares the students of a conflict graph out between workers as roots
+    (see balance_roots).
+
+    Return:
+        a tuple of (number of workers, the constraints every clique has to
+        meet, estimated number of cliques rooted at each position, list of
+        each worker's roots)
+    """
+    if k < 1:
+        raise ValueError("Cliques must have at least 1 student, not %i" % k)
+    num_workers = num_workers or os.cpu_count() or 1
+    if constraints is None:
+        constraints = TeamConstraints.from_conflict_graph(conflict_graph)
+    # Estimates only count the pairs constraints keep apart, so are too high
+    # for roots whose candidates are cut down by the other constraints
+    estimates = estimate_rooted_counts(constraints.conflicts, k)
+    return (num_workers, constraints, estimates,
+            balance_roots(estimates, num_workers))
+
+
+def save_clique_shards(filename, conflict_graph, k, num_workers=None,
+                       constraints=None):
+    """
+    Finds every k-clique of the students in a conflict graph (see
+    data_loader.create_conflict_graph) across a pool of processes, saving
+    one shard per process and a manifest tying them together.
+
+    Arguments:
+        filename: the file name to save to, without an extension, like for
+            clique_store.save_cliques
+        conflict_graph: a networkx Graph of the students with an edge for each
+            anti-preference
+        k: the size of the cliques to find
+        num_workers: the number of worker processes and shards. Defaults to
+            one per CPU.
+        constraints: optionally, the TeamConstraints every clique has to
+            meet, which replace the anti-preferences of the conflict graph.
+            Defaults to TeamConstraints.from_conflict_graph(conflict_graph).
+
+    Return:
+        the manifest's list of shards, each a dictionary with its number of
+        cliques, number of roots, estimated number of cliques and seconds
+        spent
+    """
+    students = list(conflict_graph.nodes)
+    num_workers, constraints, estimates, shard_roots = _split_roots(
+        conflict_graph, k, num_workers, constraints)
+
+    # Delete cliques saved before, so no old shard is left behind
+    remove_saved(filename)
+
+    with ProcessPoolExecutor(num_workers, mp_context()) as executor:
+        futures = [executor.submit(_find_shard, constraints, k, roots,
+                                   shard_filename(filename, shard))
+                   for shard, roots in enumerate(shard_roots)]
+        shards = []
+        for roots, future in zip(shard_roots, futures):
+            num_cliques, seconds = future.result()
+            shards.append({
+                "num_cliques": num_cliques,
+                "num_roots": len(roots),
+                "estimate": sum(estimates[root] for root in roots),
+                "seconds": seconds,
+            })
+
+    save_shard_manifest(filename, k, shards, students)
+    return shards
+
+
+def find_top_cliques(conflict_graph, k, table, per_student, num_workers=None,
+                     constraints=None):
+    """
+    Finds the best per_student k-cliques of each student in a conflict graph
+    across a pool of processes, like save_clique_shards but keeping only the
+    best cliques. Each worker scores its cliques a chunk at a time as it
+    finds them and keeps its own best ones, and the cliques the workers keep
+    are then merged, so the full list of cliques is never held in memory or
+    saved.
+
+    Arguments:
+        conflict_graph, k, num_workers, constraints: as for
+            save_clique_shards
+        table: the StudentTable the positions of the students in the graph
+            refer to, used to score the cliques
+        per_student: how many of the best cliques to keep for each student
+
+    Return:
+        a tuple of (TopCliques holding the cliques kept, list with a
+        dictionary for each worker holding its number of cliques found and
+        kept, number of roots, estimated number of cliques and seconds
+        spent)
+    """
+    num_workers, constraints, estimates, shard_roots = _split_roots(
+        conflict_graph, k, num_workers, constraints)
+
+    top = TopCliques(k, per_student)
+    with ProcessPoolExecutor(num_workers, mp_context()) as executor:
+        futures = [executor.submit(_find_top_shard, constraints, k, roots,
+                                   table, per_student)
+                   for roots in shard_roots]
+        shards = []
+        for roots, future in zip(shard_roots, futures):
+            shard_top, seconds = future.result()
+            top.merge(shard_top)
+            shards.append({
+                "num_cliques": shard_top.num_seen,
+                "num_kept": len(shard_top.members),
+                "num_roots": len(roots),
+                "estimate": sum(estimates[root] for root in roots),
+                "seconds": seconds,
+            })
+    return top, shards
@@ -0,0 +1,447 @@
+"""
+Saves and loads cliques in a compact binary format.
+
+A clique file is a .npy array with one row per clique, holding the indices of
+its members in a roster of students. The roster is saved next to it as a
+.roster text file with one student name per line. Clique files are opened as
+read-only memory maps, so loading them takes the same time no matter how many
+cliques they hold, and processes that open the same file share its memory.
+
+Cliques found by several processes at once (see clique_shards.py) are saved
+as one .npy shard per process instead, tied together by a .manifest JSON
+file listing the shards. load_cliques reads either kind of file the same way:
+the first time several shards are loaded, they are copied a chunk at a time
+into one .joined.npy file next to them, which is memory mapped like a single
+clique file.
+
+CliqueSet holds cliques in memory for assignment algorithms, along with their
+compatibility scores, bitmasks of their members and an index of which cliques
+each student is in. LiveCliques uses that index to walk through a CliqueSet
+while skipping cliques that overlap teams already chosen.
+
+When run as a main program, converts clique files saved by older versions of
+data_loader.py (joblib pickles of lists of networkx graphs) to this format.
+"""
+import json
+import os
+import joblib
+import numpy as np
+from functools import cached_property
+from clique_finding import clique_indices
+from helpers import clique_masks
+
+
+def clique_dtype(num_students):
+    """
+    Returns the smallest unsigned integer type that can index every student in
+    a roster of the given size.
+    """
+    if num_students <= 2**8:
+        return np.uint8
+    if num_students <= 2**16:
+        return np.uint16
+    return np.uint32
+
+
+def _save_roster(filename, roster):
+    """
+    Saves the names of a list of Student objects or names to
+    filename.roster, one per line.
+    """
+    names = [getattr(student, "name", student) for student in roster]
+    with open(filename + ".roster", "w") as roster_file:
+        roster_file.write("".join(name + "\n" for name in names))
+    return names
+
+
+def remove_saved(filename):
+    """
+    Deletes the clique files saved under a file name, whether a single
+    .npy file or a manifest and its shards, so that stale files are never
+    loaded instead of new ones.
+    """
+    if os.path.exists(filename + ".manifest"):
+        for path in _shard_paths(filename):
+            if os.path.exists(path):
+                os.remove(path)
+        os.remove(filename + ".manifest")
+    for path in [filename + ".npy", filename + ".joined.npy"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def shard_filename(filename, shard):
+    """
+    Returns the name of one shard file of a sharded clique file.
+    """
+    return "%s.shard%i.npy" % (filename, shard)
+
+
+def save_shard_manifest(filename, k, shards, roster):
+    """
+    Saves the manifest and roster of a clique file whose cliques are split
+    into shards. The shard files must already be saved with the names given
+    by shard_filename, and any single .npy clique file with the same name is
+    deleted.
+
+    Arguments:
+        filename: the file name to save to, without an extension
+        k: the number of students in each clique
+        shards: a list with a dictionary describing each shard, holding at
+            least its number of cliques as "num_cliques"
+        roster: a list of Student objects or student names, in index order
+    """
+    for path in [filename + ".npy", filename + ".joined.npy"]:
+        if os.path.exists(path):
+            os.remove(path)
+    names = _save_roster(filename, roster)
+    manifest = {
+        "k": k,
+        "num_students": len(names),
+        "num_cliques": sum(shard["num_cliques"] for shard in shards),
+        # Shards are listed relative to the manifest, so the files can be
+        # moved together
+        "shards": [dict(shard, file=os.path.basename(
+            shard_filename(filename, i))) for i, shard in enumerate(shards)],
+    }
+    with open(filename + ".manifest", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+
+def load_manifest(filename):
+    """
+    Returns the manifest of a sharded clique file as a dictionary, or None
+    if the cliques are saved in a single file.
+    """
+    try:
+        with open(filename + ".manifest") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def _shard_paths(filename):
+    """
+    Returns the paths of the shard files listed in a clique file's manifest.
+    """
+    directory = os.path.dirname(filename)
+    return [os.path.join(directory, shard["file"])
+            for shard in load_manifest(filename)["shards"]]
+
+
+def save_cliques(filename, cliques, roster, k=None):
+    """
+    Saves cliques and the roster their indices refer to.
+
+    The cliques are always saved with one row per clique, so a file with no
+    cliques still has shape (0, k). Raises a ValueError if there are no
+    cliques and k isn't given, since the shape can't be told from an empty
+    list.
+
+    Arguments:
+        filename: the file name to save to, without an extension. The cliques
+            are saved in filename.npy and the roster in filename.roster
+        cliques: an array (or list of tuples) with one row of student indices
+            per clique
+        roster: a list of Student objects or student names, in index order
+        k: the number of students in each clique. Defaults to the length of
+            the rows of cliques.
+    """
+    cliques = np.asarray(cliques)
+    if k is None:
+        if cliques.ndim != 2:
+            raise ValueError("The clique size k is needed to save %s" %
+                             ("an empty clique list" if cliques.size == 0
+                              else "cliques that aren't in rows"))
+        k = cliques.shape[1]
+    remove_saved(filename)
+    names = _save_roster(filename, roster)
+    cliques = cliques.astype(clique_dtype(len(names))).reshape(-1, k)
+    np.save(filename + ".npy", cliques)
+
+
+def load_roster(filename):
+    """
+    Returns the list of student names saved with a clique file.
+    """
+    with open(filename + ".roster") as roster_file:
+        return roster_file.read().splitlines()
+
+
+def load_cliques(filename, students=None):
+    """
+    Opens a clique file as a read-only memory map.
+
+    If the cliques were saved as shards, they are joined in the order the
+    manifest lists them (unless there is only one shard). The joined cliques
+    are saved to filename.joined.npy the first time and memory mapped from
+    there, so they are never all held in memory at once.
+
+    Arguments:
+        filename: the file name the cliques were saved to, without an
+            extension
+        students: optionally, the list of Student objects the cliques will be
+            used with. If given, raises a ValueError if their names do not
+            match the saved roster.
+
+    Return:
+        a tuple of (array with one row of student indices per clique, list of
+        student names in index order)
+    """
+    roster = load_roster(filename)
+    if students is not None and [s.name for s in students] != roster:
+        raise ValueError(
+            "Students do not match the roster saved with %s" % filename)
+
+    manifest = load_manifest(filename)
+    if manifest is None:
+        return np.load(filename + ".npy", mmap_mode="r"), roster
+
+    paths = _shard_paths(filename)
+    if len(paths) == 1:
+        return np.load(paths[0], mmap_mode="r"), roster
+    if manifest["num_cliques"] == 0:
+        # An empty array can't be memory mapped
+        return np.zeros((0, manifest["k"]),
+                        dtype=clique_dtype(len(roster))), roster
+    joined_filename = filename + ".joined.npy"
+    if not os.path.exists(joined_filename):
+        _join_shards(paths, joined_filename, manifest["k"],
+                     clique_dtype(len(roster)))
+    return np.load(joined_filename, mmap_mode="r"), roster
+
+
+def _join_shards(paths, joined_filename, k, dtype, chunk_size=100000):
+    """
+    Copies the cliques of several shard files into one clique file, a chunk
+    at a time. The file is written under another name first and then
+    renamed, so a file that was only partly written is never loaded.
+    """
+    shards = [np.load(path, mmap_mode="r") for path in paths]
+    temp_filename = joined_filename + ".part"
+    joined = np.lib.format.open_memmap(
+        temp_filename, mode="w+", dtype=dtype,
+        shape=(sum(len(shard) for shard in shards), k))
+    position = 0
+    for shard in shards:
+        for start in range(0, len(shard), chunk_size):
+            chunk = shard[start:start + chunk_size]
+            joined[position:position + len(chunk)] = chunk
+            position += len(chunk)
+    joined.flush()
+    del joined
+    os.replace(temp_filename, joined_filename)
+
+
+def iter_clique_chunks(filename, chunk_size=100000):
+    """
+    Yields the cliques saved in a clique file (a single file or shards) as
+    arrays of at most chunk_size rows, read from memory maps so that only
+    one chunk is in memory at a time.
+    """
+    manifest = load_manifest(filename)
+    if manifest is None:
+        paths = [filename + ".npy"]
+    else:
+        paths = _shard_paths(filename)
+    for path in paths:
+        cliques = np.load(path, mmap_mode="r")
+        for start in range(0, len(cliques), chunk_size):
+            yield np.array(cliques[start:start + chunk_size])
+
+
+class CliqueSet:
+    """
+    A list of cliques of the same size, stored as an array with one row of
+    student ids per clique. Also stores each clique's compatibility score and
+    a bitmask of its members (see helpers.clique_masks), so that checking
+    cliques for overlaps doesn't need to look at individual students.
+
+    Behaves like a list of teams: indexing with an integer gives a tuple of
+    student ids, and slicing gives another CliqueSet that shares its arrays
+    rather than copying them.
+
+    The index of which cliques each student is in (see postings) is built
+    the first time it is used.
+    """
+    def __init__(self, members, compat=None, num_students=None, masks=None):
+        """
+        Arguments:
+            members: an array (or list of tuples) with one row of student ids
+                per clique
+            compat: optionally, an array with the compatibility score of each
+                clique
+            num_students: the number of students the ids can refer to.
+                Defaults to one more than the highest id in members.
+            masks: optionally, the clique bitmasks, if they have already
+                been computed
+        """
+        members = np.asarray(members, dtype=np.intp)
+        if members.ndim != 2:
+            members = members.reshape(len(members), -1)
+        self.members = members
+        self.compat = None if compat is None else np.asarray(compat)
+        if num_students is None:
+            num_students = int(self.members.max()) + 1 if members.size else 1
+        self.num_students = num_students
+        if masks is None:
+            masks = clique_masks(self.members, num_students)
+        self.masks = masks
+
+    @classmethod
+    def from_cliques(cls, cliques):
+        """
+        Returns cliques as a CliqueSet: a CliqueSet is returned as it is, and
+        a list of teams of student ids is converted to one.
+        """
+        if isinstance(cliques, cls):
+            return cliques
+        return cls(list(cliques))
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return map(tuple, self.members.tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return tuple(self.members[index].tolist())
+
+        # Build a CliqueSet out of the selected rows without recomputing
+        # anything
+        subset = CliqueSet.__new__(CliqueSet)
+        subset.members = self.members[index]
+        subset.compat = None if self.compat is None else self.compat[index]
+        subset.num_students = self.num_students
+        subset.masks = self.masks[index]
+        return subset
+
+    @cached_property
+    def postings(self):
+        """
+        Index from each student id to the cliques that student is in, as a
+        tuple of (starts, clique_ids). The positions of the cliques that
+        student s is in are clique_ids[starts[s]:starts[s + 1]], in
+        increasing order.
+        """
+        students = self.members.ravel()
+        # Sorting every member of every clique by student id groups each
+        # student's cliques together, still in clique order
+        clique_size = self.members.shape[1]
+        clique_ids = np.argsort(students, kind="stable") // clique_size
+        counts = np.bincount(students, minlength=self.num_students)
+        starts = np.concatenate([[0], np.cumsum(counts)])
+        return starts, clique_ids
+
+    def reordered(self, order):
+        """
+        Returns a CliqueSet with the same cliques in a new order, where order
+        lists every clique position exactly once. Unlike indexing with order,
+        this reuses the index of which cliques each student is in rather than
+        building it again from the members.
+        """
+        subset = self[order]
+        starts, clique_ids = self.postings
+        # Find where each clique ended up, and renumber the index to match
+        new_positions = np.empty(len(order), dtype=np.int64)
+        new_positions[order] = np.arange(len(order))
+        # Put each student's cliques back in increasing order. Adding the
+        # student id times the number of cliques keeps each student's
+        # cliques together, so one sort of the whole index does it.
+        students = np.repeat(np.arange(len(starts) - 1, dtype=np.int64),
+                             np.diff(starts))
+        keys = np.sort(students * len(order) + new_positions[clique_ids])
+        subset.postings = (starts,
+                           (keys % max(len(order), 1)).astype(clique_ids.dtype))
+        return subset
+
+    def cliques_containing(self, student_ids):
+        """
+        Returns an array of the positions of every clique that contains any
+        of the given students (with repeats if a clique contains more than
+        one of them).
+        """
+        starts, clique_ids = self.postings
+        return np.concatenate([np.zeros(0, dtype=clique_ids.dtype)] + [
+            clique_ids[starts[s]:starts[s + 1]] for s in student_ids])
+
+
+class LiveCliques:
+    """
+    Walks through a CliqueSet in order, skipping dead cliques: ones that
+    contain a student who has already been assigned to a team.
+
+    Assigning a team only marks the cliques its students are in as dead
+    (found through CliqueSet.postings), and a cursor remembers how far
+    through the CliqueSet the walk has got, so no clique is checked twice.
+    """
+    # How many cliques to check at once when skipping dead cliques
+    BLOCK_SIZE = 256
+
+    def __init__(self, cliques):
+        self.cliques = cliques
+        self.dead = np.zeros(len(cliques), dtype=bool)
+        self.cursor = 0
+
+    def copy(self, start_at=0):
+        """
+        Returns a copy with the same dead cliques and its cursor at start_at.
+        """
+        live = LiveCliques.__new__(LiveCliques)
+        live.cliques = self.cliques
+        live.dead = self.dead.copy()
+        live.cursor = start_at
+        return live
+
+    def assign(self, team):
+        """
+        Marks every clique that contains a student on the team as dead.
+        """
+        self.dead[self.cliques.cliques_containing(team)] = True
+
+    def next_live(self):
+        """
+        Moves the cursor to the next clique that isn't dead and returns its
+        position, or returns None if there are no live cliques left.
+        """
+        while self.cursor < len(self.dead):
+            block = self.dead[self.cursor:self.cursor + self.BLOCK_SIZE]
+            if not block.all():
+                self.cursor += int(block.argmin())
+                return self.cursor
+            self.cursor += len(block)
+        return None
+
+
+def convert_pickled_cliques(pickle_filename, student_graph, k,
+                            filename=None):
+    """
+    Converts a joblib pickle of a list of networkx graph k-cliques into a
+    clique file, with indices referring to list(student_graph.nodes).
+
+    Saves to pickle_filename (plus extensions) unless another file name is
+    given, and returns the number of cliques converted.
+    """
+    cliques = clique_indices(student_graph, joblib.load(pickle_filename))
+    save_cliques(filename or pickle_filename, cliques,
+                 list(student_graph.nodes), k)
+    return len(cliques)
+
+
+if __name__ == "__main__":
+    # Ask for suffix to choose which graph and clique pickles to convert
+    sample_suffix = input(
+        "Enter suffix for graph and cliques filenames (i.e., 'A20'): ")
+    student_graph = joblib.load("data/student_graph_" + sample_suffix)
+
+    for k in [4, 5]:
+        k_cliques_filename = "data/%i_cliques_%s" % (k, sample_suffix)
+        try:
+            num_cliques = convert_pickled_cliques(
+                k_cliques_filename, student_graph, k)
+        except FileNotFoundError:
+            print("File '%s' not found, skipping." % k_cliques_filename)
+            continue
+        print("%i %i-cliques converted and saved in %s.npy" %
+              (num_cliques, k, k_cliques_filename))
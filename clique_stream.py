@@ -0,0 +1,159 @@
+"""
+Scores cliques as they are found, a chunk at a time, and keeps only the best
+few cliques that contain each student.
+
+There are millions of possible teams of 5 in a class of 60 students, but the
+assignment algorithms only ever look at the best-scoring ones. TopCliques
+keeps the best per_student cliques (by team_compatibility) for every student,
+so it never holds more than per_student times the number of students
+cliques, however many are found. A clique is only dropped once every one of
+its members is in per_student better (or equally good) cliques, and
+TopCliques reports how many cliques were dropped and the best score of any
+of them.
+"""
+import numpy as np
+from itertools import chain, islice
+from scoring import team_compatibility_batch
+
+
+class TopCliques:
+    """
+    The best per_student cliques of one size for each student, out of all
+    the cliques added so far.
+
+    Attributes:
+        members: an array with one row of student ids per clique kept, in
+            the order they were added
+        compat: an array with the compatibility score of each clique kept
+        num_seen: the number of cliques added
+        max_dropped_compat: the best score of any clique dropped, or -inf if
+            none have been. Every dropped clique scored at most this, and no
+            higher than the worst kept clique of any of its members.
+    """
+    def __init__(self, k, per_student):
+        self.per_student = per_student
+        self.members = np.zeros((0, k), dtype=np.intp)
+        self.compat = np.zeros(0)
+        self.num_seen = 0
+        self.max_dropped_compat = -np.inf
+
+    @property
+    def num_dropped(self):
+        return self.num_seen - len(self.members)
+
+    def add(self, members, compat):
+        """
+        Adds a chunk of cliques (an array with one row of student ids per
+        clique) and their compatibility scores, dropping every clique that
+        is no longer among the best per_student of any of its members.
+        """
+        members = np.asarray(members, dtype=np.intp)
+        self.num_seen += len(members)
+        members = np.concatenate([self.members, members])
+        compat = np.concatenate([self.compat, compat])
+
+        # List every (student, clique) pair, sorted by student and then with
+        # each student's best cliques first. Ties go to the clique added
+        # first.
+        k = members.shape[1]
+        students = members.ravel()
+        clique_ids = np.repeat(np.arange(len(members)), k)
+        order = np.lexsort((clique_ids, -compat[clique_ids], students))
+        students = students[order]
+        # How many better cliques each student is in than each of theirs
+        group_starts = np.flatnonzero(
+            np.r_[True, students[1:] != students[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(students)])
+        ranks = np.arange(len(students)) - np.repeat(group_starts, group_sizes)
+
+        keep = np.zeros(len(members), dtype=bool)
+        keep[clique_ids[order[ranks < self.per_student]]] = True
+        if not keep.all():
+            self.max_dropped_compat = max(self.max_dropped_compat,
+                                          float(compat[~keep].max()))
+        self.members = members[keep]
+        self.compat = compat[keep]
+
+    def merge(self, other):
+        """
+        Adds the cliques kept by another TopCliques, which saw different
+        cliques than this one. A clique the other dropped isn't among the
+        best per_student of any of its members out of those cliques alone,
+        so it wouldn't have been kept here either. The result is the same
+        as adding every clique either one saw here, apart from which of two
+        equally good cliques is kept.
+        """
+        num_seen = self.num_seen + other.num_seen
+        self.add(other.members, other.compat)
+        self.num_seen = num_seen
+        self.max_dropped_compat = max(self.max_dropped_compat,
+                                      other.max_dropped_compat)
+
+    def report(self):
+        """
+        Returns a line describing how many cliques were kept and dropped.
+        """
+        line = "Kept %i of %i %i-cliques (best %i per student), dropped %i" % (
+            len(self.members), self.num_seen, self.members.shape[1],
+            self.per_student, self.num_dropped)
+        if self.num_dropped:
+            line += " scoring at most %.4g" % self.max_dropped_compat
+        return line
+
+
+def iter_chunks(cliques, k, chunk_size=100000):
+    """
+    Groups an iterable of cliques (tuples of student ids, like the ones
+    yielded by clique_finding.iter_independent_sets) into arrays of at most
+    chunk_size rows.
+    """
+    cliques = iter(cliques)
+    while True:
+        chunk = np.fromiter(
+            chain.from_iterable(islice(cliques, chunk_size)),
+            dtype=np.intp).reshape(-1, k)
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def iter_sized_chunks(cliques, sizes, chunk_size=100000):
+    """
+    Groups an iterable of cliques of several sizes (like the ones yielded by
+    clique_finding.iter_sized_independent_sets) into arrays of at most
+    chunk_size cliques of the same size.
+
+    Yields:
+        tuples of (size, array with one row of student ids per clique)
+    """
+    buffers = {size: [] for size in sizes}
+    for clique in cliques:
+        buffer = buffers[len(clique)]
+        buffer.append(clique)
+        if len(buffer) == chunk_size:
+            yield len(clique), np.array(buffer, dtype=np.intp)
+            buffer.clear()
+    for size, buffer in buffers.items():
+        if buffer:
+            yield size, np.array(buffer, dtype=np.intp)
+
+
+def keep_top_cliques(chunks, k, table, per_student):
+    """
+    Scores chunks of cliques with team_compatibility_batch and keeps the best
+    per_student cliques for each student.
+
+    Arguments:
+        chunks: an iterable of arrays with one row of student ids per clique,
+            like the ones from iter_chunks or clique_store.iter_clique_chunks
+        k: the number of students in each clique
+        table: the StudentTable the student ids refer to
+        per_student: how many of the best cliques to keep for each student
+
+    Return:
+        a TopCliques holding the cliques kept
+    """
+    top = TopCliques(k, per_student)
+    for chunk in chunks:
+        top.add(chunk, team_compatibility_batch(chunk, table))
+    return top
@@ -0,0 +1,184 @@
+"""
+Hard constraints on which students can be on a team together, checked while
+teams are found rather than by filtering them afterwards.
+
+TeamConstraints supports two kinds of constraint, both kept as bitmasks of
+students:
+
+- Pairs of students who can't be on the same team, like anti-preferences.
+  A limit on how far apart a rating (like commitment) can be within a team
+  is the same thing, since it rules out every pair of students whose ratings
+  are too far apart.
+- Groups of students a team must have a number of, like "at least one
+  student with a management rating of 8 or more" or "at least two students
+  who voted for a topic".
+
+Teams are found by clique_finding.iter_constrained_sets, which grows them
+one student at a time and drops a partial team as soon as it can't meet
+every constraint: candidates who conflict with a member are removed, and if
+too few candidates are left in some group for the team to reach its minimum,
+or the team is already at a group's maximum, the rest of that branch is
+never looked at.
+"""
+import numpy as np
+from clique_finding import conflict_masks, iter_constrained_sets
+
+
+def _as_mask(students):
+    """
+    Converts a boolean array (one entry per student) or a list of student
+    ids into a bitmask of student ids.
+    """
+    students = np.asarray(students)
+    if students.dtype == bool:
+        students = np.flatnonzero(students)
+    mask = 0
+    for student in students.tolist():
+        mask |= 1 << student
+    return mask
+
+
+class TeamConstraints:
+    """
+    Constraints every team of a class of students has to meet.
+
+    Attributes:
+        num_students: the number of students in the class
+        conflicts: a list of bitmasks where bit j of entry i is set if
+            students i and j can't be on the same team. A student whose own
+            bit is set can't be on any team.
+        groups: a list of (bitmask of students, fewest on a team, most on a
+            team) tuples
+    """
+    def __init__(self, num_students):
+        self.num_students = num_students
+        self.conflicts = [0] * num_students
+        self.groups = []
+
+    @classmethod
+    def from_conflict_graph(cls, conflict_graph):
+        """
+        Creates constraints that keep students with an anti-preference
+        between them apart, from a conflict graph like the ones made by
+        data_loader.create_conflict_graph.
+        """
+        constraints = cls(conflict_graph.number_of_nodes())
+        constraints.conflicts = conflict_masks(conflict_graph)
+        return constraints
+
+    @classmethod
+    def from_students(cls, students):
+        """
+        Creates constraints that keep students with an anti-preference
+        between them apart, from a list of Student objects. Student ids are
+        positions in the list, and a student who lists their own name as an
+        anti-preference can't be on any team.
+        """
+        constraints = cls(len(students))
+        ids_by_name = {}
+        for student_id, student in enumerate(students):
+            ids_by_name.setdefault(student.name, []).append(student_id)
+        for student_id, student in enumerate(students):
+            for name in student.anti_prefs:
+                for other in ids_by_name.get(name, []):
+                    constraints.conflicts[student_id] |= 1 << other
+                    constraints.conflicts[other] |= 1 << student_id
+        return constraints
+
+    @classmethod
+    def from_table(cls, table):
+        """
+        Creates constraints that keep students with an anti-preference
+        between them apart, from a StudentTable.
+        """
+        constraints = cls(len(table))
+        constraints.forbid_pairs(table.conflict_matrix)
+        return constraints
+
+    def __repr__(self):
+        # Used to tell constraints apart when caching cliques found with them
+        return "TeamConstraints(%i, conflicts=%r, groups=%r)" % (
+            self.num_students, self.conflicts, self.groups)
+
+    def renumbered(self, order):
+        """
+        Returns the same constraints with the students in a new order, where
+        student i of the new constraints is student order[i] of these.
+        """
+        new_ids = [0] * self.num_students
+        for new_id, old_id in enumerate(order):
+            new_ids[old_id] = new_id
+
+        def convert(mask):
+            new_mask = 0
+            while mask:
+                lowest = mask & -mask
+                mask ^= lowest
+                new_mask |= 1 << new_ids[lowest.bit_length() - 1]
+            return new_mask
+
+        constraints = TeamConstraints(self.num_students)
+        constraints.conflicts = [convert(self.conflicts[old_id])
+                                 for old_id in order]
+        constraints.groups = [(convert(mask), at_least, at_most)
+                              for mask, at_least, at_most in self.groups]
+        return constraints
+
+    def forbid_pairs(self, matrix):
+        """
+        Keeps apart every pair of students i and j where matrix[i, j] (or
+        matrix[j, i]) is True.
+        """
+        matrix = np.asarray(matrix, dtype=bool)
+        matrix = matrix | matrix.T
+        for i in range(self.num_students):
+            self.conflicts[i] |= _as_mask(matrix[i])
+
+    def max_spread(self, values, spread):
+        """
+        Only allows teams where the largest and smallest of values (one per
+        student, like StudentTable.commitment) differ by at most spread.
+        """
+        values = np.asarray(values)
+        self.forbid_pairs(np.abs(values[:, None] - values[None, :]) > spread)
+
+    def require(self, students, at_least=1, at_most=None):
+        """
+        Only allows teams with at least at_least and at most at_most (or any
+        number, if None) of the given students, which are a boolean array
+        with an entry per student or a list of student ids.
+
+        For example, require(table.mgmt >= 8) asks for a student with a
+        management rating of at least 8 on every team.
+        """
+        self.groups.append((_as_mask(students), at_least, at_most))
+
+    def allows(self, team):
+        """
+        Returns True if a team (a list of student ids) meets every constraint.
+        """
+        members = _as_mask(list(team))
+        for student in team:
+            if self.conflicts[student] & members:
+                return False
+        for mask, at_least, at_most in self.groups:
+            count = (members & mask).bit_count()
+            if count < at_least or (at_most is not None and count > at_most):
+                return False
+        return True
+
+    def iter_teams(self, k, roots=None):
+        """
+        Generator that finds every team of k students that meets the
+        constraints (see clique_finding.iter_constrained_sets).
+
+        Arguments:
+            k: the number of students on each team
+            roots: optionally, the student ids to find teams from. Only the
+                teams whose lowest student id is one of the roots are found,
+                so that the work can be split up like in clique_shards.py.
+
+        Yields:
+            sorted tuples of student ids
+        """
+        return iter_constrained_sets(self.conflicts, k, self.groups, roots)
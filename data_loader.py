@@ -5,99 +5,195 @@ objects.
 When run as a main program, saves graph and clique data created from a sample
 of the loaded data.
 """
+import hashlib
 import itertools as it
+import os
 import joblib
 import networkx as nx
+import numpy as np
 import pandas as pd
 import random
-from clique_finding import find_k_clique
-from helpers import violates_anti_prefs
-from student import Student
+from cache import ArtifactCache
+from clique_finding import iter_sized_independent_sets
+from clique_shards import find_top_cliques, save_clique_shards
+from clique_store import save_cliques
+from clique_stream import TopCliques, iter_sized_chunks
+from constraints import TeamConstraints
+from scoring import SCORING_VERSION, team_compatibility_batch
+from student import Student, StudentTable
 
 
-def load_student_data(filename):
+# Samples with more students than this find their cliques in parallel
+SHARD_MIN_STUDENTS = 100
+
+# Survey columns holding each student's ratings, and the StudentTable field
+# each one is stored in
+RATING_COLUMNS = {
+    "IntLeadership": "intr_mgmt",
+    "ExpLeadership": "exp_mgmt",
+    "IntElecProto": "intr_elec",
+    "ExpElecProto": "exp_elec",
+    "IntProg": "intr_prog",
+    "ExpProg": "exp_prog",
+    "IntMechCAD": "intr_cad",
+    "ExpMechCAD": "exp_cad",
+    "IntMechFab": "intr_fab",
+    "ExpMechFab": "exp_fab",
+}
+
+
+def split_column(column):
+    """
+    Splits a survey column of ";"-separated entries (such as names or
+    topics) into one row per entry, stripped of whitespace. Empty cells have
+    no entries.
+
+    Returns a Series of entries, indexed by the row each entry came from.
+    """
+    entries = column.dropna().astype(str).str.split(";").explode()
+    entries = entries.str.strip()
+    return entries[entries != ""]
+
+
+def _entry_sets(entries, num_rows):
+    """
+    Returns a list with the set of entries (from split_column) of each row.
+    """
+    sets = [set() for _ in range(num_rows)]
+    for row, entry in zip(entries.index.tolist(), entries.tolist()):
+        sets[row].add(entry)
+    return sets
+
+
+def _name_matrix(entries, names):
+    """
+    Builds a boolean matrix where entry [i, j] is True if the name of the
+    student in row j is one of the entries (from split_column) of row i,
+    like StudentTable._name_matrix.
+    """
+    pairs = pd.DataFrame({"row": entries.index.to_numpy(),
+                          "name": entries.to_numpy()})
+    # Find every row with each name, in case names are repeated
+    rows_by_name = pd.DataFrame({"name": names,
+                                 "other_row": np.arange(len(names))})
+    pairs = pairs.merge(rows_by_name, on="name")
+
+    matrix = np.zeros((len(names), len(names)), dtype=bool)
+    matrix[pairs["row"].to_numpy(), pairs["other_row"].to_numpy()] = True
+    return matrix
+
+
+def load_student_data(filename, chunk_size=None):
     """
     Loads student responses from a survey results file and returns a list of
     Student objects representing each student's data.
+
+    The students' ratings are stored in one StudentTable, where each
+    student's id is their row in the survey file. The table's preference
+    and topic matrices are built straight from the survey columns, rather
+    than from the students one at a time.
+
+    If chunk_size is given, the file is read that many rows at a time, so
+    the whole file is never held in one DataFrame.
+
+    Commitment scores aren't in the survey, so they are made up, but from a
+    seed taken from the survey rows: loading the same survey gives the same
+    students every time, which keeps their cache keys (see cache.py) the same.
     """
-    # Read csv data into dataframe
-    data = pd.read_csv(filename)
-    # Create empty list to store students
-    students = []
-    # Count # of students as # of rows in dataframe
-    # Header row is not counted by default.
-    num_students = len(data)
+    # Read csv data in chunks, or all at once
+    if chunk_size is None:
+        chunks = [pd.read_csv(filename)]
+    else:
+        chunks = pd.read_csv(filename, chunksize=chunk_size)
+
+    ratings = {field: [] for field in RATING_COLUMNS.values()}
+    names = []
+    pronouns = []
+    split_columns = {"Prefs": [], "AntiPrefs": [], "ProjTopics": []}
+    num_students = 0
+    # Hash of every row, which doesn't depend on how the file is split into
+    # chunks
+    rows_digest = hashlib.sha256()
+    for chunk in chunks:
+        rows_digest.update(pd.util.hash_pandas_object(
+            chunk, index=False).to_numpy().tobytes())
+        # Number rows from the start of the file
+        chunk.index = pd.RangeIndex(num_students, num_students + len(chunk))
+        num_students += len(chunk)
+
+        for column, field in RATING_COLUMNS.items():
+            ratings[field].append(chunk[column].to_numpy())
+        names.extend(chunk["Student"].tolist())
+        pronouns.extend(chunk["Pronouns"].tolist())
+        # Names and topics are separated by ";" with whitespace around them
+        for column in split_columns:
+            split_columns[column].append(split_column(chunk[column]))
+
+    # Create a table to hold the ratings of every student
+    table = StudentTable(num_students)
+    for field, columns in ratings.items():
+        if columns:
+            getattr(table, field)[:] = np.concatenate(columns)
 
     # Create a random list of commitment scores for students from 1-5, weighted
     # so that extreme scores are less common (but 5s are more common than 1s,
     # because Oliners love biting off more than they can chew.)
     # This data is theoretically collected in the survey, but was not included
-    # in the anonymized data we obtained.
-    commitments = random.choices(
+    # in the anonymized data we obtained. The scores are seeded by the survey
+    # rows, so the same survey always gets the same scores.
+    rng = random.Random(rows_digest.hexdigest())
+    table.commitment[:] = rng.choices(
         range(1, 6), weights=[1, 3, 4, 3, 1.5], k=num_students)
+    table.compute_derived()
 
-    # Each row represents a student
-    for idx, row in data.iterrows():
-        # Get data from AntiPrefs column
-        anti_prefs_data = row["AntiPrefs"]
-        # If anti preferences column is not empty:
-        if str(anti_prefs_data) != "nan":
-            # Make a set of the names, split by ";" and stripped of whitespace
-            anti_prefs = set(
-                [anti_pref.strip()
-                 for anti_pref in str(anti_prefs_data).split(";")]
-            )
-        # If the column is empty, set it as an empty set
-        else:
-            anti_prefs = set()
-
-        # Get data from Prefs column
-        prefs_data = row["Prefs"]
-        # If preferences column is not empty:
-        if str(prefs_data) != "nan":
-            # Make a set of the names, split by ";" and stripped of whitespace
-            preferences = set([pref.strip()
-                              for pref in str(prefs_data).split(";")])
-        # If the column is empty, set it as an empty set
-        else:
-            preferences = set()
-
-        # Get data from ProjTopics column
-        topics_data = row["ProjTopics"]
-        # If project topics column is not empty:
-        if str(topics_data) != "nan":
-            # Make a set of the topics, split by ";" and stripped of whitespace
-            topics = set([intr.strip()
-                         for intr in str(topics_data).split(";")])
-        # If the column is empty, set it as an empty set
-        else:
-            topics = set()
-
-        # Create Student object with all the data collected above
-        s = Student(
-            name=row["Student"],
-            pronouns=row["Pronouns"],
-            commitment=commitments[idx],
-            topics=topics,
-            preferences=preferences,
-            anti_prefs=anti_prefs,
-            intr_mgmt=row["IntLeadership"],
-            exp_mgmt=row["ExpLeadership"],
-            intr_elec=row["IntElecProto"],
-            exp_elec=row["ExpElecProto"],
-            intr_prog=row["IntProg"],
-            exp_prog=row["ExpProg"],
-            intr_cad=row["IntMechCAD"],
-            exp_cad=row["ExpMechCAD"],
-            intr_fab=row["IntMechFab"],
-            exp_fab=row["ExpMechFab"],
-        )
-        # Add student to output list
-        students.append(s)
+    entries = {column: pd.concat(parts) if parts else pd.Series(dtype=object)
+               for column, parts in split_columns.items()}
+    preferences = _entry_sets(entries["Prefs"], num_students)
+    anti_prefs = _entry_sets(entries["AntiPrefs"], num_students)
+    topics = _entry_sets(entries["ProjTopics"], num_students)
+
+    # Create a Student object for each row, viewing its row of the table
+    students = [
+        Student.from_table_row(
+            table, idx, names[idx], pronouns[idx], topics=topics[idx],
+            preferences=preferences[idx], anti_prefs=anti_prefs[idx])
+        for idx in range(num_students)
+    ]
+
+    # Fill in the table's matrices from the split columns
+    table.pref_matrix = _name_matrix(entries["Prefs"], names).astype(np.int8)
+    table.anti_pref_matrix = _name_matrix(entries["AntiPrefs"], names)
+    topic_names = sorted(set(entries["ProjTopics"]))
+    topic_ids = pd.Series(np.arange(len(topic_names)), index=topic_names)
+    table.topic_names = topic_names
+    table.topic_matrix = np.zeros((num_students, len(topic_names)), dtype=bool)
+    table.topic_matrix[entries["ProjTopics"].index.to_numpy(),
+                       topic_ids[entries["ProjTopics"]].to_numpy()] = True
 
     return students
 
 
+def save_preference_matrices(students, filename):
+    """
+    Saves the partner preference and anti-preference matrices of a list of
+    students, which must share a StudentTable with ids matching their
+    positions in the list (see StudentTable.from_students).
+
+    The file holds the students' names plus an int8 preference matrix, a
+    boolean anti-preference matrix, and their symmetrized forms (mutual
+    preferences and conflicts in either direction), all indexed by student id.
+    """
+    table = students[0].table
+    np.savez(
+        filename,
+        names=np.array([student.name for student in students]),
+        pref_matrix=table.pref_matrix,
+        anti_pref_matrix=table.anti_pref_matrix,
+        mutual_pref_matrix=table.mutual_pref_matrix,
+        conflict_matrix=table.conflict_matrix,
+    )
+
+
 def create_student_graph(students):
     """
     Given a list of Student objects, creates a graph connecting all students
@@ -122,33 +218,231 @@ def create_student_graph(students):
     return student_graph
 
 
-def create_save_k_cliques(k, student_graph, suffix):
+def create_conflict_graph(students):
     """
-    Generate all k-cliques from a student graph and save the list of cliques.
+    Given a list of Student objects, creates a graph connecting only the
+    students that have a silver bullet between them. This is the complement
+    of the graph made by create_student_graph, but only takes time for each
+    student and each anti-preference, rather than for every pair of students.
 
-    Ensures that no clique puts students together where one of them listed the
+    A student who lists themselves as an anti-preference gets an edge to
+    themselves, since they can't be put on any team.
+
+    Arguments:
+        a list containing Student objects
+
+    Returns:
+        a networkx Graph object where the nodes are Student objects (in the
+        same order as the list) and the edges are anti-preferences
+    """
+    conflict_graph = nx.Graph()
+    conflict_graph.add_nodes_from(students)
+
+    # Look students up by name, since that is how anti-preferences refer to
+    # them
+    students_by_name = {}
+    for student in students:
+        students_by_name.setdefault(student.name, []).append(student)
+    for student in students:
+        for name in student.anti_prefs:
+            for other in students_by_name.get(name, []):
+                conflict_graph.add_edge(student, other)
+
+    return conflict_graph
+
+
+def _canonical_order(students):
+    """
+    Returns the positions of a list of students sorted by name and then by
+    anti-preferences, so the same students listed in any order give the
+    same order.
+    """
+    return np.array(
+        sorted(range(len(students)), key=lambda i: (
+            students[i].name, sorted(students[i].anti_prefs))),
+        dtype=np.intp)
+
+
+def _renumber(cliques, new_ids):
+    """
+    Returns an array of cliques with each student id i replaced by
+    new_ids[i], keeping the ids in each clique sorted.
+    """
+    return np.sort(np.asarray(new_ids, dtype=np.intp)[cliques], axis=1)
+
+
+def create_save_k_cliques(k, conflict_graph, suffix, cache=None,
+                          num_workers=None, keep_per_student=None,
+                          constraints=None):
+    """
+    Generate all k-cliques of the student graph from its conflict graph (see
+    create_conflict_graph) and save them with clique_store.save_cliques, as
+    an array with one row per clique holding the indices of its members in
+    list(conflict_graph.nodes).
+
+    The cliques are the sets of k students with no conflict between any two
+    of them, so no clique puts students together where one of them listed the
     other as an anti-preference.
 
     Suffix will be a character or string that should correspond to the data
     table from which the input graph of students was generated, plus a number
     indicating the number of students sampled from the data table to create the
     graph.
+
+    If an ArtifactCache is given, cliques already found for the same students
+    are loaded from it instead of being found again. Which cliques are
+    valid only depends on the students' names and anti-preferences (and any
+    constraints), so the cliques are cached by those alone, with the
+    students sorted by name. The same students sampled in another order (or
+    with other ratings) reuse the same cliques.
+
+    If num_workers is given, the cliques are instead found by that many
+    processes at once and saved as shards with clique_shards.save_clique_shards,
+    without using the cache (the shards are already saved cliques, and
+    clique_store.load_cliques reads them like any other clique file).
+
+    If keep_per_student is given, the cliques are scored in chunks as they
+    are found, and only the best keep_per_student cliques for each student
+    are saved (see clique_stream.py), so the full list of cliques is never
+    held in memory or saved. With num_workers, each process keeps its own
+    best cliques (see clique_shards.find_top_cliques) and only those are
+    saved, as one file.
+
+    If a TeamConstraints is given (see constraints.py), only the cliques that
+    meet it are found. Its constraints replace the anti-preferences of the
+    conflict graph, so it should be made with
+    TeamConstraints.from_conflict_graph before adding more.
     """
+    if num_workers is None:
+        create_save_cliques([k], conflict_graph, suffix, cache,
+                            keep_per_student=keep_per_student,
+                            constraints=constraints)
+        return
+
     # Create file name to store k-cliques data
     k_cliques_filename = "data/%i_cliques_%s" % (k, suffix)
-    # Compute all possible k-cliques
-    print("Generating %i-cliques..." % k)
-    k_cliques = find_k_clique(student_graph, k)
-    print("%i %i-cliques found." % (len(k_cliques), k))
+    # Cliques are indices into the graph's list of students
+    students = list(conflict_graph.nodes)
 
-    # Do not save any cliques that put anti-preferences together
-    # They shouldn't make it this far, but checking can save a lot of time
-    k_cliques = [team for team in k_cliques if not violates_anti_prefs(team)]
-    print("%i valid %i-cliques found." % (len(k_cliques), k))
+    print("Generating %i-cliques with %i processes..." % (k, num_workers))
+    if keep_per_student is None:
+        shards = save_clique_shards(k_cliques_filename, conflict_graph, k,
+                                    num_workers, constraints)
+        print("%i valid %i-cliques found." %
+              (sum(shard["num_cliques"] for shard in shards), k))
+        print("%i-cliques saved in %i shards listed in %s.manifest" %
+              (k, len(shards), k_cliques_filename))
+        return
+    # Each process scores its cliques as it finds them and only sends back
+    # the ones it keeps. Scores look students up by their position in the
+    # graph.
+    table = StudentTable.of_students(students)
+    top, _ = find_top_cliques(conflict_graph, k, table, keep_per_student,
+                              num_workers, constraints)
+    print("%i valid %i-cliques found." % (top.num_seen, k))
+    print(top.report())
+    save_cliques(k_cliques_filename, top.members, students, k)
+    print("%i-cliques saved in %s.npy" % (k, k_cliques_filename))
 
-    # Save list of k-cliques in file determined above
-    joblib.dump(k_cliques, k_cliques_filename)
-    print("%i-cliques saved in %s" % (k, k_cliques_filename))
+
+def create_save_cliques(sizes, conflict_graph, suffix, cache=None,
+                        num_workers=None, keep_per_student=None,
+                        constraints=None):
+    """
+    Like create_save_k_cliques, but generates and saves the cliques of every
+    size in sizes, like 4 and 5. The cliques of all the sizes are found in
+    one pass (see clique_finding.iter_sized_independent_sets), rather than
+    finding the smaller teams again on the way to each bigger size.
+
+    Cliques found with constraints or by several processes are still found
+    one size at a time.
+    """
+    sizes = sorted(set(sizes))
+    if num_workers is not None:
+        for k in sizes:
+            create_save_k_cliques(k, conflict_graph, suffix, cache,
+                                  num_workers, keep_per_student, constraints)
+        return
+
+    # Cliques are indices into the graph's list of students
+    students = list(conflict_graph.nodes)
+    if keep_per_student is not None:
+        # Scores look students up by their position in the graph
+        table = StudentTable.of_students(students)
+
+    def find_cliques():
+        # Only sets of students without anti-preferences between them (and
+        # that meet any other constraints) are found, so every clique is
+        # valid
+        print("Generating %s-cliques..." % "/".join(map(str, sizes)))
+        if constraints is None:
+            valid_cliques = iter_sized_independent_sets(conflict_graph, sizes)
+        else:
+            # How many of a group a team needs depends on its size, so each
+            # size is found separately
+            valid_cliques = it.chain.from_iterable(
+                constraints.iter_teams(k) for k in sizes)
+        chunks = iter_sized_chunks(valid_cliques, sizes)
+
+        if keep_per_student is not None:
+            tops = {k: TopCliques(k, keep_per_student) for k in sizes}
+            for k, chunk in chunks:
+                tops[k].add(chunk, team_compatibility_batch(chunk, table))
+            for k in sizes:
+                print(tops[k].report())
+            return {k: tops[k].members for k in sizes}
+
+        # Gather the chunks of each size into one array, so no clique is
+        # stored as its own object for long
+        found = {k: [np.zeros((0, k), dtype=np.intp)] for k in sizes}
+        for k, chunk in chunks:
+            found[k].append(chunk)
+        return {k: np.concatenate(found[k]) for k in sizes}
+
+    # Every size is found the first time one isn't in the cache. Finding the
+    # bigger cliques finds the smaller ones on the way, so this costs little
+    # more than finding just the missing size.
+    found = {}
+
+    def find_size(k):
+        if not found:
+            found.update(find_cliques())
+        return found[k]
+
+    # Cache the cliques as ids in the students' order by name, and put them
+    # back in the graph's order when they are loaded
+    order = _canonical_order(students)
+    canonical_ids = np.empty_like(order)
+    canonical_ids[order] = np.arange(len(order))
+    # Which cliques are found depends on the constraints, which refer to
+    # students by id too
+    canonical_constraints = [] if constraints is None \
+        else [constraints.renumbered(order)]
+
+    for k in sizes:
+        if cache is None:
+            k_cliques = find_size(k)
+        else:
+            if keep_per_student is None:
+                # Only anti-preferences decide which cliques are valid
+                kind = "cliques"
+                inputs = [[(students[i].name, sorted(students[i].anti_prefs))
+                           for i in order], k]
+            else:
+                # Which cliques are kept depends on how they are scored
+                kind = "top_cliques"
+                inputs = [[students[i] for i in order], k, keep_per_student,
+                          SCORING_VERSION]
+            k_cliques = _renumber(cache.get_or_build(
+                kind, inputs + canonical_constraints,
+                lambda: _renumber(find_size(k), canonical_ids)), order)
+        print("%i valid %i-cliques found." % (len(k_cliques), k))
+
+        # Save array of k-cliques and the roster it indexes into in files
+        # named by the size and suffix
+        k_cliques_filename = "data/%i_cliques_%s" % (k, suffix)
+        save_cliques(k_cliques_filename, k_cliques, students, k)
+        print("%i-cliques saved in %s.npy" % (k, k_cliques_filename))
 
 
 if __name__ == "__main__":
@@ -170,13 +464,26 @@ if __name__ == "__main__":
     # Ask for number of students to include in the sample
     num_students = int(input("Enter a number of students: "))
 
-    # Create a random sample of students of the size specified
-    students_sample = random.sample(students, num_students)
+    # Create a random sample of students of the size specified, sorted by
+    # name so that the same students always get the same ids (and reuse the
+    # same graph from the cache)
+    students_sample = sorted(random.sample(students, num_students),
+                             key=lambda student: student.name)
+    # Give the sampled students a table of their own, so their ids match
+    # their positions in the graph. This moves them out of the table of every
+    # student in the file.
+    sample_table = StudentTable.from_students(students_sample)
+
+    # Graphs and cliques made from the same students before are reused from
+    # the cache
+    cache = ArtifactCache()
 
     # Create the graph from the previously-loaded students, using Student
     # objects as vertices and making an edge between each pair of students that
     # do not have an anti-preference between them
-    sample_student_graph = create_student_graph(students_sample)
+    sample_student_graph = cache.get_or_build(
+        "student_graph", [students_sample],
+        lambda: create_student_graph(students_sample))
 
     # Create a suffix to represent the data from this batch of students, using
     # the suffix associated with the chosed survey data and the number of
@@ -190,7 +497,43 @@ if __name__ == "__main__":
     joblib.dump(sample_student_graph, graph_filename)
     print("Saving", graph_filename)
 
+    # Save preference matrices for the sample alongside the graph
+    preferences_filename = "data/preferences_" + sample_suffix + ".npz"
+    save_preference_matrices(students_sample, preferences_filename)
+    print("Saving", preferences_filename)
+
     # Create and save k-cliques for k=[4, 5] to represent the possible teams
-    # that can be formed from this graph
-    create_save_k_cliques(4, sample_student_graph, sample_suffix)
-    create_save_k_cliques(5, sample_student_graph, sample_suffix)
+    # that can be formed from this graph. They are found from the much
+    # smaller graph of anti-preferences between the same students, with both
+    # sizes found in one pass.
+    # Big samples have too many cliques for one process, so they are split
+    # between one process per CPU
+    sample_conflict_graph = create_conflict_graph(students_sample)
+    num_workers = os.cpu_count() if num_students > SHARD_MIN_STUDENTS else None
+    # Optionally only keep the best cliques for each student, for samples
+    # with too many cliques to save them all
+    keep_per_student = input(
+        "Enter how many of the best cliques to keep per student "
+        "(leave blank to keep all): ")
+    keep_per_student = int(keep_per_student) if keep_per_student else None
+
+    # Optionally only allow teams with a strong manager and students of
+    # similar commitment, checked while the cliques are found
+    min_managers = input(
+        "Enter how many students with a management rating of 8 or more each "
+        "team needs (leave blank for any): ")
+    max_spread = input(
+        "Enter the largest difference in commitment allowed within a team "
+        "(leave blank for any): ")
+    constraints = None
+    if min_managers or max_spread:
+        constraints = TeamConstraints.from_conflict_graph(
+            sample_conflict_graph)
+        if min_managers:
+            constraints.require(sample_table.mgmt >= 8, int(min_managers))
+        if max_spread:
+            constraints.max_spread(sample_table.commitment, int(max_spread))
+
+    create_save_cliques([4, 5], sample_conflict_graph, sample_suffix, cache,
+                        num_workers, keep_per_student, constraints)
+    print(cache.report())
@@ -1,33 +1,77 @@
 import itertools
+import multiprocessing
+import numpy as np
 
 
-def num_size_teams(num_students):
+def _split_into_teams(num_students, sizes):
     """
-    Takes in a number of students and calculate how many 4 and 5 person teams
-    they should be on.
+    Finds how many teams of each size (a list sorted largest first) to split
+    students into, putting as many as possible on the largest teams, then as
+    many as possible on the next largest, and so on.
 
-    Returns a tuple of (5-person teams, 4-person teams).
+    Returns a list with the number of teams of each size, or None if the
+    students can't be split into teams of those sizes.
     """
-    # Count how many teams will be missing 1 person compared to a 5-person team
-    teams_of_4 = - num_students % 5
+    if len(sizes) == 1:
+        if num_students % sizes[0]:
+            return None
+        return [num_students // sizes[0]]
 
-    # If there are not enough students to make that many 4-person teams, it
-    # won't be possbile to evenly put people on 4 and 5 person teams
-    if num_students // 4 < teams_of_4:
-        return 0, 0
+    # Try the most teams of the largest size first
+    for count in range(num_students // sizes[0], -1, -1):
+        rest = _split_into_teams(num_students - count * sizes[0], sizes[1:])
+        if rest is not None:
+            return [count] + rest
+    return None
 
-    # Calculate number of 5-person teams based on how many are left after making
-    # 4-person teamsn
-    teams_of_5 = (num_students - 4 * teams_of_4) // 5
 
-    return teams_of_5, teams_of_4
+def num_size_teams(num_students, sizes=(4, 5)):
+    """
+    Takes in a number of students and calculate how many teams of each size
+    they should be on. By default teams have 4 or 5 people, but any set of
+    team sizes (like 3 and 4, or 5 and 6) can be given.
+
+    As many students as possible are put on the largest teams, which for
+    sizes 4 and 5 means there are as few 4-person teams as possible.
+
+    Returns a tuple with the number of teams of each size, largest size
+    first, so (5-person teams, 4-person teams) by default. Every number is 0
+    if the students can't be split evenly into teams of those sizes.
+    """
+    sizes = sorted(set(sizes), reverse=True)
+    if not sizes:
+        raise ValueError("At least one team size is needed")
+    if sizes[-1] < 1:
+        raise ValueError("Teams need at least 1 student, not %i" % sizes[-1])
+
+    counts = _split_into_teams(num_students, sizes)
+    if counts is None:
+        return (0,) * len(sizes)
+    return tuple(counts)
 
 
-def violates_anti_prefs(team):
+def _team_submatrix(matrix, team):
+    """
+    Picks out the entries of a student-by-student matrix for every ordered
+    pair of students on a team (or on each team in an array of teams) given
+    as student ids.
+    """
+    team = np.asarray(team, dtype=np.intp)
+    return matrix[team[..., :, None], team[..., None, :]]
+
+
+def violates_anti_prefs(team, table=None):
     """
     Checks if there is an anti-preference for any student in a list from any 
     other student in the list.
+
+    If a StudentTable is given, the team is instead a list of student ids in
+    that table (or an array with one row of ids per team, which gives an
+    array of results).
     """
+    if table is not None:
+        return _team_submatrix(table.conflict_matrix, team).any(axis=(-2, -1))
+
     all_anti_prefs = set()
     # Loop through all team members and add their anti-preferences to a set
     for student in team:
@@ -40,7 +84,7 @@ def violates_anti_prefs(team):
     return False
 
 
-def list_met_partner_prefs(team):
+def list_met_partner_prefs(team, table=None):
     """
     Counts the number of instances where a student on a team had requested to
     work with another student on that team.
@@ -53,7 +97,18 @@ def list_met_partner_prefs(team):
     and Carol, that gets a 2.
 
     If Alice, Bob and Carol all mutually rquested each other, that gets a 6.
+
+    If a StudentTable is given, the team is instead a list of student ids in
+    that table.
     """
+    if table is not None:
+        team = np.asarray(team, dtype=np.intp)
+        team_prefs = _team_submatrix(table.pref_matrix, team)
+        # Students preferring themselves don't count as a pair
+        np.fill_diagonal(team_prefs, 0)
+        return [(table.students[team[a]], table.students[team[b]])
+                for a, b in zip(*np.nonzero(team_prefs))]
+
     # This will store the ordered pairs of met preferences between teammates
     met_partner_prefs = []
 
@@ -72,7 +127,7 @@ def list_met_partner_prefs(team):
     return met_partner_prefs
 
 
-def count_met_partner_prefs(team):
+def count_met_partner_prefs(team, table=None):
     """
     Counts the number of instances where a student on a team had requested to
     work with another student on that team.
@@ -85,7 +140,15 @@ def count_met_partner_prefs(team):
     and Carol, that gets a 2.
 
     If Alice, Bob and Carol all mutually rquested each other, that gets a 6.
+
+    If a StudentTable is given, the team is instead a list of student ids in
+    that table (or an array with one row of ids per team, which gives an
+    array of results).
     """
+    if table is not None:
+        return _team_submatrix(table.pref_matrix, team).sum(
+            axis=(-2, -1), dtype=np.int64)
+
     # Create a dictionary where the keys are each student in the team members'
     # preference lists, and the values are the number of students on the team
     # who listed the key student as a preference
@@ -111,7 +174,7 @@ def count_met_partner_prefs(team):
     return num_met_partner_prefs
 
 
-def count_mutual_partner_prefs(team):
+def count_mutual_partner_prefs(team, table=None):
     """
     Counts the number of instances where two students on a team both requested
     to work with each other.
@@ -121,7 +184,18 @@ def count_mutual_partner_prefs(team):
     If Alice and Bob both requested each other, that gets a 1.
 
     If Alice, Bob and Carol all mutually rquested each other, that gets a 3.
+
+    If a StudentTable is given, the team is instead a list of student ids in
+    that table (or an array with one row of ids per team, which gives an
+    array of results).
     """
+    if table is not None:
+        team_mutual = _team_submatrix(table.mutual_pref_matrix, team)
+        # Each mutual pair appears twice in the symmetric matrix, and students
+        # preferring themselves don't count
+        return (team_mutual.sum(axis=(-2, -1)) -
+                np.trace(team_mutual, axis1=-2, axis2=-1)) // 2
+
     # This will count the number of mutual preferences that are satisfied
     # within the team
     mutual_partner_prefs = 0
@@ -331,7 +405,78 @@ def sorted_topic_votes(team):
 def overlaps(nodes1, nodes2):
     """
     Returns True if the two sets of nodes share at least 1 common node, False if not.
+
+    Also works on integer bitmasks of student ids (see team_mask).
+    """
+    # If the intersection of the node-sets is non-empty (or non-zero, for
+    # bitmasks), the node-sets overlap
+    return bool(nodes1 & nodes2)
+
+
+def team_mask(team):
+    """
+    Returns an integer bitmask of a team given as student ids, where bit i is
+    set if the student with id i is on the team.
+    """
+    mask = 0
+    for student_id in team:
+        mask |= 1 << int(student_id)
+    return mask
+
+
+def clique_masks(cliques, num_students):
+    """
+    Computes the bitmask of every clique in an array with one row of student
+    ids per clique.
+
+    Returns an array of unsigned 64-bit words with one row per clique, where
+    bit i of word w is set if the student with id 64*w + i is in the clique.
+    """
+    cliques = np.asarray(cliques, dtype=np.int64)
+    if cliques.ndim != 2:
+        cliques = cliques.reshape(len(cliques), -1)
+    num_words = max(1, -(-num_students // 64))
+    masks = np.zeros((len(cliques), num_words), dtype=np.uint64)
+    rows = np.arange(len(cliques))
+    # Each clique has at most one student per column, so every (row, word)
+    # in a column is set at most once
+    for column in cliques.T:
+        masks[rows, column // 64] |= (
+            np.uint64(1) << (column % 64).astype(np.uint64))
+    return masks
+
+
+def pack_mask(mask, num_words):
+    """
+    Splits an integer bitmask into an array of unsigned 64-bit words, like a
+    row of clique_masks.
+    """
+    return np.array([(mask >> (64 * w)) & (2**64 - 1)
+                     for w in range(num_words)], dtype=np.uint64)
+
+
+def masks_overlap(masks, mask):
+    """
+    Checks an array of clique masks (from clique_masks) against one integer
+    bitmask of students all at once.
+
+    Returns an array that is True for each clique that shares at least 1
+    student with the mask.
+    """
+    packed = pack_mask(mask, masks.shape[1])
+    return (masks & packed).any(axis=1)
+
+
+def mp_context():
+    """
+    Returns the multiprocessing context to start pools of worker processes
+    with, like the ones in clique_shards.py and multistart.py.
+
+    Workers are forked where the platform allows it, so they start with the
+    parent's memory and don't run the calling script again. Elsewhere the
+    platform's default start method is used, so the calling script must
+    guard its top-level code with if __name__ == "__main__".
     """
-    # If cardinality of intersection of the node-sets is > 0, the node-sets
-    # overlap
-    return bool(len((nodes1 & nodes2)))
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
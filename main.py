@@ -12,12 +12,18 @@ Generates possible teams from saved student data.
   created.
 """
 import joblib
+import numpy as np
 from assignments import (
-    assign_teams_greedy, assign_teams_random, assign_teams_rec)
+    assign_teams_joint_greedy, assign_teams_random, improve_teams_annealing)
 from helpers import list_met_partner_prefs, num_size_teams, sorted_topics
-from clique_finding import find_k_clique
+from multistart import multistart_greedy
+from solver import Cohort, solve
+from cache import ArtifactCache
+from clique_store import CliqueSet, load_cliques
+from student import StudentTable
 from scoring import (
-    assignment_cost, team_compatibility, team_evaluation)
+    SCORING_VERSION, assignment_cost, team_compatibility,
+    team_compatibility_batch, team_evaluation)
 
 
 sample_suffix = input(
@@ -29,6 +35,10 @@ try:
     # Try to load file specified by suffix
     student_graph = joblib.load(student_graph_filename)
     print("%i students loaded" % len(student_graph.nodes))
+    # Cliques refer to students by their position in this list
+    students = list(student_graph.nodes)
+    # Store the students' ratings in one table, with ids matching positions
+    table = StudentTable.from_students(students)
 except FileNotFoundError:
     # Print instructions and quit if file not found
     print("File '%s' not found. Please run data_loader.py to generate student graphs." %
@@ -38,57 +48,70 @@ except FileNotFoundError:
 # Load all 4-cliques
 four_cliques_filename = "data/4_cliques_" + sample_suffix
 try:
-    # Try to load file specified by suffix
-    four_cliques = joblib.load(four_cliques_filename)
+    # Try to open file specified by suffix, checking that its cliques refer to
+    # the students in the graph
+    four_cliques, _ = load_cliques(four_cliques_filename, students)
     print("%i 4-cliques loaded" % len(four_cliques))
 except FileNotFoundError:
     # Print instructions and quit if file not found
-    print("File '%s' not found. Please run data_loader.py to generate student graphs and cliques." %
+    print("File '%s.npy' not found. Please run data_loader.py to generate student graphs and cliques, or clique_store.py to convert older clique files." %
           four_cliques_filename)
     exit()
 
 # Load all 5-cliques
 five_cliques_filename = "data/5_cliques_" + sample_suffix
 try:
-    # Try to load file specified by suffix
-    five_cliques = joblib.load(five_cliques_filename)
+    # Try to open file specified by suffix, checking that its cliques refer to
+    # the students in the graph
+    five_cliques, _ = load_cliques(five_cliques_filename, students)
     print("%i 5-cliques loaded" % len(five_cliques))
 except FileNotFoundError:
     # Print instructions and quit if file not found
-    print("File '%s' not found. Please run data_loader.py to generate student graphs and cliques." %
+    print("File '%s.npy' not found. Please run data_loader.py to generate student graphs and cliques, or clique_store.py to convert older clique files." %
           five_cliques_filename)
     exit()
 
+
+def team_members(team):
+    """
+    Returns the list of Student objects for a team of student indices.
+    """
+    return [students[i] for i in team]
+
+
 # This will re-assign compatibility scores, which are not saved with the clique
-# data. This is a relatively fast operation, and if the compatibility function
-# is being updated, doing this in main every time, rather than making it
-# optional, makes it easier to ensure you're not using old compatibility scores.
-
-# Find team compatability of each 4-clique
-for team in four_cliques:
-    # Compute team compatibility and store as a property of the graph
-    team.graph['compat'] = team_compatibility(team.nodes)
-
-# Find team compatability of each 5-clique
-for team in five_cliques:
-    # Compute team compatibility and store as a property of the graph
-    team.graph['compat'] = team_compatibility(team.nodes)
-
-# Filter out any 4-cliques with negative compatibility
-four_cliques = [team for team in four_cliques if team.graph['compat'] > 0]
+# data. Scores are cached on disk, keyed by the students, the cliques and
+# scoring.SCORING_VERSION, so they are only computed again if one of those
+# changes. If the compatibility function is being updated, increase
+# SCORING_VERSION to make sure you're not using old compatibility scores.
+cache = ArtifactCache()
+
+# Find team compatability of every 4-clique at once, then keep only those with
+# positive compatibility, sorted by highest compatibility score
+four_compat = cache.get_or_build(
+    "compat", [students, four_cliques, SCORING_VERSION],
+    lambda: team_compatibility_batch(four_cliques, table))
+order = np.argsort(-four_compat, kind="stable")
+order = order[four_compat[order] > 0]
+four_cliques = CliqueSet(
+    four_cliques[order], four_compat[order], num_students=len(students))
 print("%i four-cliques loaded." % len(four_cliques))
-# Filter out any 5-cliques with negative compatibility
-five_cliques = [team for team in five_cliques if team.graph['compat'] > 0]
-print("%i five-cliques loaded." % len(five_cliques))
 
-# sort the cliques by highest compatibility scores
-four_cliques.sort(key=lambda team: team.graph['compat'], reverse=True)
-five_cliques.sort(key=lambda team: team.graph['compat'], reverse=True)
+# Do the same for every 5-clique
+five_compat = cache.get_or_build(
+    "compat", [students, five_cliques, SCORING_VERSION],
+    lambda: team_compatibility_batch(five_cliques, table))
+order = np.argsort(-five_compat, kind="stable")
+order = order[five_compat[order] > 0]
+five_cliques = CliqueSet(
+    five_cliques[order], five_compat[order], num_students=len(students))
+print("%i five-cliques loaded." % len(five_cliques))
 
 print("All cliques loaded and sorted.")
+print(cache.report())
 
 # Figure out how many groups of 4 and 5 to create
-num_students = len(student_graph.nodes)
+num_students = len(students)
 num_5teams, num_4teams = num_size_teams(num_students)
 print("Students: %i; 4-teams: %i; 5-teams: %i" %
       (num_students, num_4teams, num_5teams))
@@ -97,13 +120,15 @@ print("Students: %i; 4-teams: %i; 5-teams: %i" %
 print("Running random assignments...")
 rand_teams = assign_teams_random(
     four_cliques, five_cliques, num_4teams, num_5teams)
-print("Cost: (lower is better): %.3f" % assignment_cost(rand_teams))
+print("Cost: (lower is better): %.3f" %
+      assignment_cost([team_members(team) for team in rand_teams]))
 # Show more detailed info on members of each team
 for team in rand_teams:
     print("\nCompat: %.2f Eval: %.2f" %
-          (team.graph['compat'], team_evaluation(team)))
+          (team_compatibility(team_members(team)),
+           team_evaluation(team_members(team))))
     # Show skill areas for each student
-    for student in team.nodes:
+    for student in team_members(team):
         print("%s: %i/%i, %i/%i, %i/%i, %i/%i, %i/%i, %i" % (
             student.name,
             student.intr_mgmt, student.exp_mgmt,
@@ -114,38 +139,31 @@ for team in rand_teams:
             student.commitment
         ))
     # Show what topics the team had most in common
-    print(sorted_topics(team)[:3])
+    print(sorted_topics(team_members(team))[:3])
     # List any partner requests satistifed by the team
-    print(list_met_partner_prefs(team))
+    print(list_met_partner_prefs(team_members(team)))
 
 
 # Assign teams with greedy algorithm and score result
 print("\n\nRunning greedy...")
 # Greedily assign required numbers of teams of 4 and 5
-# Set "best" cost yet to a very high (bad) value
-best_greedy_teams, best_greedy_cost = None, 1000
-# Run greedy algorithm with i values from 0-9, choosing the ith-best clique as
-# the first team each time. Compare to previous results and keep track of the
-# result that minimized the cost.
-for i in range(10):
-    # Note: 4-cliques are always selected first and they affect the options for
-    # choosing 5-cliques, so don't worry about starting with the ith 5-clique.
-    greedy_teams = assign_teams_greedy(
-        four_cliques[i:], five_cliques, num_4teams, num_5teams)
-    # Compute cost for this iteration
-    cost = assignment_cost(greedy_teams)
-    # Reassign best-yet values if this result is better than previous best
-    if cost < best_greedy_cost:
-        best_greedy_cost = cost
-        best_greedy_teams = greedy_teams
+# Run greedy algorithm from 200 starting points across every CPU, skipping
+# some of the best 4- and 5-cliques and shuffling cliques with equal scores
+# each time, and keep the result that minimized the cost
+best_greedy_teams, best_greedy_cost, worker_times = multistart_greedy(
+    four_cliques, five_cliques, num_4teams, num_5teams, table)
+for pid, (num_starts, num_failed, seconds) in worker_times.items():
+    print("Worker %i: %i starts (%i failed) in %.2fs" %
+          (pid, num_starts, num_failed, seconds))
 
 # Show more detailed info on members of each team
 print("Cost: (lower is better): %.3f" % best_greedy_cost)
 for team in best_greedy_teams:
     print("\nCompat: %.2f Eval: %.2f" %
-          (team.graph['compat'], team_evaluation(team)))
+          (team_compatibility(team_members(team)),
+           team_evaluation(team_members(team))))
     # Show skill areas for each student
-    for student in team.nodes:
+    for student in team_members(team):
         print("%s: %i/%i, %i/%i, %i/%i, %i/%i, %i/%i, %i" % (
             student.name,
             student.intr_mgmt, student.exp_mgmt,
@@ -156,26 +174,56 @@ for team in best_greedy_teams:
             student.commitment
         ))
     # Show what topics the team had most in common
-    print(sorted_topics(team)[:3])
+    print(sorted_topics(team_members(team))[:3])
     # List any partner requests satistifed by the team
-    print(list_met_partner_prefs(team))
-
-
-# NOTE: Possible future work, but doesn't quite work yet
-# print("Running recursive backtracking...")
-
-# # Demote 4-cliques so 5s will be chosen first
-# for team in four_cliques:
-#     team.graph['compat'] = team.graph['compat'] - 1
-
-# # Make combination of all cliques
-# all_cliques = five_cliques + four_cliques
-# all_cliques.sort(key=lambda team: team.graph['compat'], reverse=True)
-
-# cost, teams = assign_teams_rec(
-    #     four_cliques[:10000], five_cliques[:10000], 0, [], set(), num_students, num_5teams+num_4teams)
-
-    # print("Cost: (lower is better): %.3f" % cost)
-    # for team in teams:
-    #     print(team.nodes, "\tCompat: %.2f Eval: %.2f" %
-    #           (team.graph['compat'], team_evaluation(team)))
+    print(list_met_partner_prefs(team_members(team)))
+
+
+# Greedily choose teams of 4 and 5 together, always taking the most compatible
+# clique that still leaves every other student a team to join
+print("\n\nRunning joint greedy...")
+joint_teams = assign_teams_joint_greedy(four_cliques, five_cliques, num_students)
+print("Cost: (lower is better): %.3f" %
+      assignment_cost([team_members(team) for team in joint_teams]))
+
+
+# Try to improve on the greedy result by swapping and moving students between
+# teams
+print("\n\nRunning simulated annealing on greedy result...")
+annealed_teams = improve_teams_annealing(best_greedy_teams, table)
+print("Cost: (lower is better): %.3f" %
+      assignment_cost([team_members(team) for team in annealed_teams]))
+
+
+# Find the best possible teams with the exact solver and score result, giving
+# up after 5 minutes and keeping the best teams found by then
+print("\n\nRunning exact solver...")
+exact_teams, exact_cost, finished = solve(
+    Cohort(table, four_cliques, five_cliques), "exact", time_budget=300,
+    on_progress=lambda cost, nodes, seconds: print(
+        "%.0fs: best cost %.3f, %i nodes explored" % (seconds, cost, nodes)),
+    progress_interval=10)
+if not finished:
+    print("Ran out of time, so these may not be the best possible teams.")
+# Show how far the greedy result was from the best cost found
+print("Cost: (lower is better): %.3f (greedy was %.3f higher)" %
+      (exact_cost, best_greedy_cost - exact_cost))
+for team in exact_teams:
+    print("\nCompat: %.2f Eval: %.2f" %
+          (team_compatibility(team_members(team)),
+           team_evaluation(team_members(team))))
+    # Show skill areas for each student
+    for student in team_members(team):
+        print("%s: %i/%i, %i/%i, %i/%i, %i/%i, %i/%i, %i" % (
+            student.name,
+            student.intr_mgmt, student.exp_mgmt,
+            student.intr_prog, student.exp_prog,
+            student.intr_elec, student.exp_elec,
+            student.intr_cad, student.exp_cad,
+            student.intr_fab, student.exp_fab,
+            student.commitment
+        ))
+    # Show what topics the team had most in common
+    print(sorted_topics(team_members(team))[:3])
+    # List any partner requests satistifed by the team
+    print(list_met_partner_prefs(team_members(team)))
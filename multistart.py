@@ -0,0 +1,222 @@
+"""
+Runs the greedy assignment algorithm from many different starting points at
+once, spread across a pool of worker processes.
+
+Each start skips a number of the best 4-cliques and 5-cliques before running
+assign_teams_greedy, and can shuffle the order of cliques with equal
+compatibility scores. The clique arrays are copied into shared memory once,
+and every worker reads them from there instead of being sent its own copy.
+"""
+import os
+import time
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+from random import Random
+from assignments import assign_teams_greedy
+from clique_store import CliqueSet
+from helpers import mp_context
+from scoring import assignment_cost_batch
+
+
+# Cliques each worker process reads from shared memory, and the event that
+# tells it to stop, set up by _init_worker
+_worker_cliques = None
+_worker_memory = None
+_worker_stop = None
+
+
+def _share_arrays(arrays):
+    """
+    Copies a list of arrays into one new block of shared memory.
+
+    Returns a tuple of (SharedMemory object, list of (shape, dtype, offset)
+    describing where each array is in the block).
+    """
+    layout = []
+    size = 0
+    for array in arrays:
+        # Start each array on an 8-byte boundary
+        size = -(-size // 8) * 8
+        layout.append((array.shape, array.dtype.str, size))
+        size += array.nbytes
+
+    memory = SharedMemory(create=True, size=max(size, 1))
+    for array, (shape, dtype, offset) in zip(arrays, layout):
+        np.ndarray(shape, dtype, memory.buf, offset)[...] = array
+    return memory, layout
+
+
+def _init_worker(memory_name, layout, num_students, stop):
+    """
+    Attaches a worker process to the shared clique arrays and the event
+    that tells it to stop.
+    """
+    global _worker_cliques, _worker_memory, _worker_stop
+    _worker_stop = stop
+    _worker_memory = SharedMemory(name=memory_name)
+    arrays = [np.ndarray(shape, dtype, _worker_memory.buf, offset)
+              for shape, dtype, offset in layout]
+    _worker_cliques = [
+        CliqueSet(members, compat, num_students, masks)
+        for members, compat, masks in (arrays[:3], arrays[3:])]
+
+
+def _shuffle_ties(cliques, rng):
+    """
+    Returns a copy of a CliqueSet where cliques with equal compatibility
+    scores are in a random order, keeping the highest scores first.
+    """
+    order = np.lexsort((rng.random(len(cliques)), -cliques.compat))
+    return cliques.reordered(order)
+
+
+def _run_starts(starts):
+    """
+    Runs the greedy algorithm once for each start, using the cliques shared
+    with this worker. A start fails if the greedy algorithm raises a
+    ValueError (for example if skipping cliques leaves too few to make every
+    team). If the run is stopped, the rest of the starts are skipped.
+
+    Arguments:
+        starts: a list of (n_4, n_5, 4-clique offset, 5-clique offset, tie
+            seed) tuples. If the tie seed is None, ties are not shuffled.
+
+    Return:
+        a tuple of (list of assignments, number of starts that failed, this
+        worker's process id, seconds spent)
+    """
+    start_time = time.perf_counter()
+    four_cliques, five_cliques = _worker_cliques
+    assignments = []
+    num_failed = 0
+    for n_4, n_5, four_offset, five_offset, tie_seed in starts:
+        if _worker_stop.is_set():
+            break
+        fours, fives = four_cliques, five_cliques
+        if tie_seed is not None:
+            rng = np.random.default_rng(tie_seed)
+            fours, fives = _shuffle_ties(fours, rng), _shuffle_ties(fives, rng)
+        try:
+            assignments.append(assign_teams_greedy(
+                fours, fives, n_4, n_5, four_offset, five_offset))
+        except ValueError:
+            num_failed += 1
+    return (assignments, num_failed, os.getpid(),
+            time.perf_counter() - start_time)
+
+
+def multistart_greedy(four_cliques, five_cliques, n_4, n_5, table,
+                      num_starts=200, max_offset=20, max_workers=None,
+                      seed=None, control=None):
+    """
+    Runs assign_teams_greedy from many starting points across a pool of
+    processes and keeps the cheapest result.
+
+    The first start is plain greedy. Every other start skips a random number
+    (below max_offset) of the best 4-cliques and of the best 5-cliques, and
+    shuffles the order of cliques with equal compatibility scores. Starts
+    where the greedy algorithm fails are counted and skipped, and a
+    ValueError is raised only if every start fails.
+
+    Arguments:
+        four_cliques, five_cliques: CliqueSets sorted by compatibility score,
+            highest first (or lists of tuples of student ids)
+        n_4, n_5: the numbers of teams of 4 and 5 to make
+        table: the StudentTable the student ids refer to, used to score the
+            results
+        num_starts: how many starting points to try
+        max_offset: skip fewer than this many cliques of each size
+        max_workers: the number of worker processes. Defaults to one per CPU.
+        seed: optional seed for choosing starting points
+        control: optionally, a SolveControl checked as each batch of starts
+            finishes and told about every new cheapest assignment. If it
+            stops the run, starts that haven't begun are cancelled, and
+            batches that are running stop after their current start.
+
+    Return:
+        a tuple of (best assignment as a list of teams (tuples of student
+        ids), its cost, dictionary of {worker process id: (number of starts
+        run, number of them that failed, seconds spent)})
+    """
+    four_cliques = CliqueSet.from_cliques(four_cliques)
+    five_cliques = CliqueSet.from_cliques(five_cliques)
+    num_students = max(four_cliques.num_students, five_cliques.num_students)
+    rng = Random(seed)
+
+    starts = [(n_4, n_5, 0, 0, None)]
+    for _ in range(num_starts - 1):
+        starts.append((n_4, n_5, rng.randrange(max_offset),
+                       rng.randrange(max_offset), rng.randrange(2**32)))
+
+    arrays = []
+    for cliques in (four_cliques, five_cliques):
+        compat = cliques.compat
+        if compat is None:
+            # With no scores every clique ties, so shuffling mixes them all
+            compat = np.zeros(len(cliques))
+        arrays += [cliques.members, compat, cliques.masks]
+    memory, layout = _share_arrays(arrays)
+
+    # Split the starts into a few batches per worker, so each worker gets a
+    # share of the work without one message per start
+    max_workers = max_workers or os.cpu_count() or 1
+    batch_size = max(1, len(starts) // (4 * max_workers))
+    batches = [starts[i:i + batch_size]
+               for i in range(0, len(starts), batch_size)]
+
+    best_teams, best_cost = None, np.inf
+    worker_times = {}
+    context = mp_context()
+    stop = context.Event()
+    executor = ProcessPoolExecutor(max_workers, context, _init_worker,
+                                   (memory.name, layout, num_students, stop))
+    pending = {}
+    try:
+        # Remember which batch each future runs, so that ties between
+        # results are broken the same way whichever batch finishes first
+        pending = {executor.submit(_run_starts, batch): i
+                   for i, batch in enumerate(batches)}
+        best_key = (np.inf, 0)
+        # With a control, wake up a few times a second to check whether to
+        # stop, even if no batch has finished
+        timeout = None if control is None else 0.1
+        while pending:
+            done, _ = wait(pending, timeout, FIRST_COMPLETED)
+            num_run_now = 0
+            for future in done:
+                batch_index = pending.pop(future)
+                assignments, num_failed, pid, seconds = future.result()
+                num_run_now += len(assignments) + num_failed
+                num_run, total_failed, total_seconds = worker_times.get(
+                    pid, (0, 0, 0.0))
+                worker_times[pid] = (
+                    num_run + len(assignments) + num_failed,
+                    total_failed + num_failed, total_seconds + seconds)
+                if not assignments:
+                    continue
+                # Every result has its teams of 4 first, so they can be
+                # scored together
+                costs = assignment_cost_batch(assignments, table)
+                best = int(np.argmin(costs))
+                if (costs[best], batch_index) < best_key:
+                    best_key = (costs[best], batch_index)
+                    best_teams, best_cost = assignments[best], costs[best]
+                    if control is not None:
+                        control.improved(best_teams, best_cost)
+            if control is not None:
+                # Count each start run as a node explored
+                control.check(num_run_now)
+    finally:
+        # If this was stopped, cancel the batches that haven't begun and tell
+        # the running ones to stop. Wait for them either way, since they
+        # read the shared memory until they finish.
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        memory.close()
+        memory.unlink()
+
+    if best_teams is None:
+        raise ValueError("The greedy algorithm failed from all %i starts" %
+                         len(starts))
+    return best_teams, best_cost, worker_times
@@ -0,0 +1,238 @@
+"""
+Keeps a class of students, their graph, their cliques and their teams up to
+date as students join, drop out or add anti-preferences, without running
+data_loader.py and main.py again.
+
+Student ids stay equal to positions in list(student_graph.nodes), so when a
+student drops out, every student after them moves down one id. The
+StudentTable is changed in place, one student's rows and columns at a time. Adding a
+student only looks for new cliques among that student's neighbours, and
+removing a student or an edge only deletes the cliques they were in (found
+through CliqueSet.postings). The teams are then repaired by breaking up as
+few teams as possible and regrouping their students, rather than assigning
+everyone again.
+"""
+import numpy as np
+from assignments import select_teams
+from clique_finding import iter_k_cliques
+from clique_store import CliqueSet
+from helpers import clique_masks, num_size_teams, violates_anti_prefs
+from scoring import team_compatibility_batch, team_evaluation_batch
+from student import StudentTable
+
+
+class Roster:
+    """
+    A class of students with their graph, 4- and 5-cliques (as CliqueSets
+    sorted by compatibility score, highest first) and current teams.
+    """
+    def __init__(self, student_graph, four_cliques, five_cliques, teams=None):
+        """
+        Arguments:
+            student_graph: a networkx Graph of Student objects, like the ones
+                made by data_loader.create_student_graph
+            four_cliques, five_cliques: arrays (or lists of tuples) of
+                student ids, which are positions in list(student_graph.nodes)
+            teams: optionally, the current teams as tuples of student ids. If
+                not given, every student is assigned a team.
+        """
+        self.graph = student_graph
+        self.students = list(student_graph.nodes)
+        self.table = StudentTable.from_students(self.students)
+        self.cliques = {}
+        for size, cliques in ((4, four_cliques), (5, five_cliques)):
+            cliques = np.asarray(cliques, dtype=np.intp).reshape(-1, size)
+            self.cliques[size] = self._sorted_cliques(
+                cliques, team_compatibility_batch(cliques, self.table))
+
+        if teams is None:
+            self.teams = []
+            self._repair(list(range(len(self.students))))
+        else:
+            self.teams = [tuple(team) for team in teams]
+
+    def _sorted_cliques(self, members, compat, masks=None):
+        """
+        Returns a CliqueSet of the given cliques, sorted by compatibility
+        score with the highest first.
+        """
+        order = np.argsort(-compat, kind="stable")
+        if masks is not None:
+            masks = masks[order]
+        return CliqueSet(members[order], compat[order], len(self.students),
+                         masks)
+
+    def _student_id(self, student):
+        """
+        Returns the id of a Student object or student name.
+        """
+        name = getattr(student, "name", student)
+        for student_id, other in enumerate(self.students):
+            if other.name == name:
+                return student_id
+        raise ValueError("%s is not on the roster" % name)
+
+    def _delete_cliques(self, size, positions):
+        """
+        Removes the cliques at the given positions from one CliqueSet.
+        """
+        keep = np.ones(len(self.cliques[size]), dtype=bool)
+        keep[positions] = False
+        self.cliques[size] = self.cliques[size][keep]
+
+    def add_student(self, student):
+        """
+        Adds a Student to the roster, finds the cliques they are in and puts
+        them on a team. Their id is the next unused one.
+        """
+        new_id = len(self.students)
+        neighbors = [other for other in self.students
+                     if not student.dislikes(other) and
+                     not other.dislikes(student)]
+        self.graph.add_node(student)
+        self.graph.add_edges_from((student, other) for other in neighbors)
+        self.students.append(student)
+        self.table.add_student(student)
+
+        # Every new clique is the new student plus a smaller clique of their
+        # neighbours
+        neighbor_graph = self.graph.subgraph(neighbors)
+        neighbor_ids = np.array(
+            [other.id for other in neighbor_graph.nodes] + [new_id],
+            dtype=np.intp)
+        for size, cliques in self.cliques.items():
+            new_cliques = np.fromiter(
+                (i for clique in iter_k_cliques(neighbor_graph, size - 1)
+                 for i in clique + (-1,)),
+                dtype=np.intp).reshape(-1, size)
+            new_cliques = np.sort(neighbor_ids[new_cliques], axis=1)
+            new_cliques = new_cliques[
+                ~violates_anti_prefs(new_cliques, self.table)]
+
+            # Old cliques keep their masks, with room for the new student
+            num_words = max(1, -(-len(self.students) // 64))
+            masks = np.zeros((len(cliques), num_words), dtype=np.uint64)
+            masks[:, :cliques.masks.shape[1]] = cliques.masks
+            self.cliques[size] = self._sorted_cliques(
+                np.concatenate([cliques.members, new_cliques]),
+                np.concatenate([cliques.compat, team_compatibility_batch(
+                    new_cliques, self.table)]),
+                np.concatenate([
+                    masks, clique_masks(new_cliques, len(self.students))]))
+
+        self._repair([new_id])
+
+    def remove_student(self, student):
+        """
+        Removes a student (a Student object or name) from the roster, deletes
+        the cliques they were in and finds new teams for their teammates.
+        """
+        old_id = self._student_id(student)
+        self.graph.remove_node(self.students[old_id])
+        del self.students[old_id]
+        self.table.remove_student(old_id)
+
+        for size, cliques in self.cliques.items():
+            self._delete_cliques(size, cliques.cliques_containing([old_id]))
+            # Everyone after the removed student moves down one id
+            cliques = self.cliques[size]
+            members = cliques.members - (cliques.members > old_id)
+            self.cliques[size] = CliqueSet(
+                members, cliques.compat, len(self.students))
+
+        # A team of 5 that loses a student is still a team of 4, but a team of
+        # 4 that loses one has to be broken up
+        freed = []
+        teams = []
+        for team in self.teams:
+            team = tuple(i - (i > old_id) for i in team if i != old_id)
+            if len(team) < 4:
+                freed.extend(team)
+            else:
+                teams.append(team)
+        self.teams = teams
+        self._repair(freed)
+
+    def add_anti_pref(self, student, other_name):
+        """
+        Records that a student (a Student object or name) asked not to work
+        with the student named other_name. If the other student is on the
+        roster, deletes every clique with both of them, and splits them up
+        if they are on the same team.
+        """
+        student_id = self._student_id(student)
+        self.students[student_id].anti_prefs.add(other_name)
+        # Only this student's rows of the table's matrices change
+        self.table.update_student(student_id)
+        try:
+            other_id = self._student_id(other_name)
+        except ValueError:
+            return
+        if self.graph.has_edge(self.students[student_id],
+                               self.students[other_id]):
+            self.graph.remove_edge(self.students[student_id],
+                                   self.students[other_id])
+
+        for size, cliques in self.cliques.items():
+            containing = cliques.cliques_containing([student_id])
+            both = (cliques.members[containing] == other_id).any(axis=1)
+            self._delete_cliques(size, containing[both])
+
+        freed = []
+        for team in self.teams:
+            if student_id in team and other_id in team:
+                self.teams.remove(team)
+                freed.extend(team)
+                break
+        self._repair(freed)
+
+    def _repair(self, freed):
+        """
+        Puts every student in freed (a list of ids of students with no team)
+        on a team, keeping as many of the current teams as possible.
+
+        Teams are broken up, worst (by squared team_evaluation) first, while
+        the numbers of teams of each size that are kept don't fit
+        helpers.num_size_teams, or the freed students can't be split into
+        teams with the cliques available. Raises a ValueError if even
+        breaking up every team doesn't work.
+        """
+        num_5, num_4 = num_size_teams(len(self.students))
+        if self.students and num_4 + num_5 == 0:
+            raise ValueError("%i students can't be split into teams of 4 and "
+                             "5" % len(self.students))
+        freed = list(freed)
+        teams = sorted(self.teams, key=len)
+        costs = np.zeros(len(teams))
+        for size in (4, 5):
+            positions = [i for i, team in enumerate(teams) if len(team) == size]
+            if positions:
+                costs[positions] = team_evaluation_batch(
+                    np.array([teams[i] for i in positions]), self.table)**2
+        # Kept teams, with the worst last
+        kept = [teams[i] for i in np.argsort(costs, kind="stable")]
+
+        while True:
+            needed = {4: num_4, 5: num_5}
+            for team in kept:
+                needed[len(team)] -= 1
+            if min(needed.values()) < 0:
+                # Too many teams of one size are kept, so break one up
+                size = min(needed, key=needed.get)
+            else:
+                try:
+                    new_teams = select_teams(
+                        self.cliques,
+                        {size: cliques.compat
+                         for size, cliques in self.cliques.items()},
+                        needed, freed)
+                    break
+                except ValueError:
+                    if not kept:
+                        raise
+                    size = None
+            worst = max(i for i, team in enumerate(kept)
+                        if size is None or len(team) == size)
+            freed.extend(kept.pop(worst))
+
+        self.teams = sorted(kept + new_teams, key=len)
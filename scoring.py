@@ -14,6 +14,11 @@ from helpers import (
 )
 
 
+# Increase this whenever a scoring function changes, so that scores cached by
+# cache.ArtifactCache are computed again
+SCORING_VERSION = 1
+
+
 def assignment_cost(teams):
     """
     Calculate the overall cost (badness) of a selection of teams.
@@ -156,3 +161,181 @@ def team_compatibility(team):
         2 * scaled_topics +
         5 * scaled_preference
     )
+
+
+def team_compatibility_batch(cliques, table):
+    """
+    Computes team_compatibility for many teams of the same size at once.
+
+    Takes an array with one row of student ids per team, where the ids are
+    rows of the given StudentTable.
+
+    Returns an array with the score of each team, equal to what
+    team_compatibility returns for that team.
+    """
+    cliques = np.asarray(cliques, dtype=np.intp)
+    team_size = cliques.shape[1]
+
+    # Teams where any student has an anti-preference for a teammate get 0
+    violates = violates_anti_prefs(cliques, table)
+
+    # Variance is lower -> better
+    commitment_variance = np.var(table.commitment[cliques], axis=1)
+
+    # Count votes for each topic on each team
+    topic_votes = table.topic_matrix[cliques].sum(axis=1)
+    # How many topics (max 2) the considered votes are distributed over
+    num_topics_considered = np.maximum(
+        2, np.count_nonzero(topic_votes, axis=1))
+    # How many votes did the best (up to) 2 topics get (Higher -> better)
+    num_topics = topic_votes.shape[1]
+    if num_topics > 2:
+        topic_votes = np.partition(topic_votes, num_topics - 2, axis=1)
+    top_2_topic_votes = topic_votes[:, -2:].sum(axis=1)
+
+    # Calculate how many partner preferences were met (Higher -> better)
+    met_partner_prefs = count_met_partner_prefs(cliques, table)
+
+    # Calculate skill deficiency the same way as skill_deficiency, from the
+    # best student on each team in each area
+    deficient_mgmt = np.maximum(0, 8 - table.mgmt[cliques].max(axis=1))**2
+    deficient_elec = np.maximum(0, 8 - table.elec[cliques].max(axis=1))**2
+    deficient_prog = np.maximum(0, 8 - table.prog[cliques].max(axis=1))**2
+    deficient_mech = np.maximum(0, 8 - table.mech[cliques].max(axis=1))**2
+    skill_defncy = (
+        deficient_mgmt + deficient_elec + deficient_prog + deficient_mech
+    ) / 144
+
+    # Calculate what fraction of students on each team are "good" (interest +
+    # experience >= 8) in some skill area, like percent_strongly_skilled
+    strongly_skilled = (
+        (table.mgmt >= 8) | (table.elec >= 8) |
+        (table.prog >= 8) | (table.mech >= 8)
+    )
+    skill_distribution = strongly_skilled[cliques].sum(axis=1) / team_size
+
+    # Normalize all values to be 0 (worst possible) -> 1 (best possible), in
+    # the same way as team_compatibility
+    scaled_commitment = (4 - commitment_variance) / 4
+    scaled_topics = top_2_topic_votes / (team_size * num_topics_considered)
+    scaled_preference = met_partner_prefs / perm(team_size, 2)
+    skill_sufficiency = 1 - skill_defncy
+
+    scores = (
+        3 * scaled_commitment +
+        3 * skill_sufficiency +
+        3 * skill_distribution +
+        2 * scaled_topics +
+        5 * scaled_preference
+    )
+    return np.where(violates, 0, scores)
+
+
+def _filler_weights(team_size):
+    """
+    Returns a matrix where row i counts how many times the student at each
+    position of a team appears in the test team that team_evaluation builds
+    while checking position i for a filler student.
+    """
+    weights = np.zeros((team_size, team_size), dtype=np.int64)
+    positions = np.arange(team_size)
+    for i in range(team_size):
+        # team_evaluation builds each test team as team[:i-1] + team[i+1:]
+        np.add.at(weights[i], positions[:i-1], 1)
+        np.add.at(weights[i], positions[i+1:], 1)
+    return weights
+
+
+def team_evaluation_batch(teams, table):
+    """
+    Computes team_evaluation for many teams of the same size at once.
+
+    Takes an array with one row of student ids per team, where the ids are
+    rows of the given StudentTable.
+
+    Returns an array with the cost of each team, equal to what
+    team_evaluation returns for that team.
+    """
+    teams = np.asarray(teams, dtype=np.intp)
+    team_size = teams.shape[1]
+
+    # Preferences between every ordered pair of positions on each team
+    team_prefs = table.pref_matrix[teams[:, :, None], teams[:, None, :]]
+    team_prefs = team_prefs.astype(np.int64)
+    # Figure out how many preferences were met between ALL students on the
+    # team
+    full_team_cohesion = team_prefs.sum(axis=(1, 2))
+
+    # Count met partner prefs within each test team, by weighting every pair
+    # of positions by how many times both students are in the test team,
+    # instead of recounting preferences from scratch
+    weights = _filler_weights(team_size)
+    test_team_cohesion = np.einsum(
+        "ia,tab,ib->ti", weights, team_prefs, weights)
+    # Determine if the rest of the team is clique-ish: 75% of the possible
+    # ordered pairs of the other teammates are met partner preferences
+    test_team_sizes = weights.sum(axis=1)
+    clique_ish = test_team_cohesion >= (
+        np.array([perm(size, 2) for size in test_team_sizes]) * .75)
+    # The student was probably a filler if including them didn't add any met
+    # partner preferences
+    filler_students = np.count_nonzero(
+        clique_ish & (test_team_cohesion == full_team_cohesion[:, None]),
+        axis=1)
+    # This is only really a bad thing if it happens to exaclty one student.
+    odd_person_out = (filler_students == 1).astype(np.int64)
+
+    # Find deficiencies in technical areas, both in experience and in
+    # interest, in the same way as exp_deficiency and intr_deficiency
+    exp_defncy = (
+        np.maximum(0, 4 - table.exp_elec[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.exp_prog[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.exp_fab[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.exp_cad[teams].max(axis=1))**2
+    ) / 36
+    intr_defncy = (
+        np.maximum(0, 4 - table.intr_elec[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.intr_prog[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.intr_fab[teams].max(axis=1))**2 +
+        np.maximum(0, 4 - table.intr_cad[teams].max(axis=1))**2
+    ) / 36
+    # Calculate how deficient the best PM score is, if 8 is considered
+    # sufficient
+    pm_defncy = np.maximum(0, 8 - table.mgmt[teams].max(axis=1)) / 8
+
+    return (
+        4 * odd_person_out ** 2 +
+        3 * pm_defncy ** 2 +
+        2 * exp_defncy ** 2 +
+        2 * intr_defncy ** 2
+    )
+
+
+def assignment_cost_batch(assignments, table):
+    """
+    Computes assignment_cost for many candidate assignments at once.
+
+    Takes a list of candidate assignments, where each assignment is a list of
+    teams and each team is a list of student ids (rows of the given
+    StudentTable). Every assignment must have teams of the same sizes in the
+    same order, such as the 4-person teams followed by the 5-person teams.
+
+    Returns an array with the cost of each assignment.
+    """
+    team_sizes = [len(team) for team in assignments[0]]
+    # Evaluate the teams at each position of every assignment, with one batch
+    # per team size
+    evaluations = np.zeros((len(assignments), len(team_sizes)))
+    for size in set(team_sizes):
+        positions = [i for i, s in enumerate(team_sizes) if s == size]
+        teams = np.array([[assignment[i] for i in positions]
+                          for assignment in assignments])
+        evaluations[:, positions] = team_evaluation_batch(
+            teams.reshape(-1, size), table).reshape(len(assignments), -1)
+
+    # Add up squared errors team by team, in the same order as
+    # assignment_cost
+    costs = np.zeros(len(assignments))
+    for i in range(len(team_sizes)):
+        costs += evaluations[:, i]**2
+    return costs
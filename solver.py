@@ -0,0 +1,231 @@
+"""
+One interface for running any of the assignment methods with a time limit.
+
+solve() runs a method on a Cohort (a class of students and their cliques)
+and returns the best assignment it found. Given a time budget, it stops the
+method when the budget runs out, and it can also be stopped early from
+another thread by setting a threading.Event. While it runs, it can report
+the cost of the best assignment so far and how much work has been done.
+
+Methods are stopped through a SolveControl passed to them as control. They
+call its check() method as they work, which raises SolveStopped when it is
+time to stop, and pass each better assignment they find to improved().
+"""
+import threading
+import time
+import numpy as np
+from assignments import (
+    assign_teams_exact, assign_teams_greedy, assign_teams_joint_greedy,
+    assign_teams_random, improve_teams_annealing)
+from helpers import num_size_teams
+from multistart import multistart_greedy
+from scoring import assignment_cost_batch
+
+
+class SolveStopped(Exception):
+    """
+    Raised by SolveControl.check() when the time budget has run out or the
+    solve has been cancelled.
+    """
+
+
+class SolveControl:
+    """
+    Tracks the time budget, cancellation and best assignment of one solve.
+
+    Assignment functions call check() regularly, counting each call as a
+    node explored (or a given number of nodes). Every progress_interval
+    seconds, check() calls on_progress(best cost, nodes explored, seconds
+    spent).
+    """
+    def __init__(self, table, time_budget=None, on_progress=None, cancel=None,
+                 progress_interval=1.0):
+        """
+        Arguments:
+            table: the StudentTable the student ids refer to, used to score
+                assignments
+            time_budget: seconds to run for, or None to run until finished
+            on_progress: optional function called with (best cost, nodes
+                explored, seconds spent) every progress_interval seconds
+            cancel: optional threading.Event. Setting it stops the solve.
+            progress_interval: seconds between calls to on_progress
+        """
+        self.table = table
+        self.start_time = time.monotonic()
+        self.deadline = None if time_budget is None \
+            else self.start_time + time_budget
+        self.on_progress = on_progress
+        self.cancel = cancel if cancel is not None else threading.Event()
+        self.progress_interval = progress_interval
+        self.next_progress = self.start_time + progress_interval
+
+        self.nodes = 0
+        self.best_teams = None
+        self.best_cost = np.inf
+
+    def check(self, nodes=1):
+        """
+        Counts nodes explored, reports progress if it is due, and raises
+        SolveStopped if the solve should stop.
+        """
+        self.nodes += nodes
+        now = time.monotonic()
+        if self.on_progress is not None and now >= self.next_progress:
+            self.next_progress = now + self.progress_interval
+            self.report()
+        if self.cancel.is_set() or (
+                self.deadline is not None and now >= self.deadline):
+            raise SolveStopped()
+
+    def improved(self, teams, cost=None):
+        """
+        Keeps an assignment (a list of teams of student ids) if it is cheaper
+        than the best one so far. If its cost isn't given, it is scored with
+        assignment_cost.
+        """
+        # Put teams of 4 first, like the assignment functions do
+        teams = sorted(teams, key=len)
+        if cost is None:
+            cost = assignment_cost_batch([teams], self.table)[0]
+        if cost < self.best_cost:
+            self.best_teams, self.best_cost = teams, float(cost)
+
+    def report(self):
+        """
+        Calls on_progress with the current best cost and amount of work done.
+        """
+        if self.on_progress is not None:
+            self.on_progress(self.best_cost, self.nodes,
+                             time.monotonic() - self.start_time)
+
+
+class Cohort:
+    """
+    A class of students to split into teams: their StudentTable and the
+    CliqueSets of possible teams of 4 and 5, sorted by compatibility score
+    with the highest first.
+    """
+    def __init__(self, table, four_cliques, five_cliques):
+        self.table = table
+        self.four_cliques = four_cliques
+        self.five_cliques = five_cliques
+        self.num_students = len(table)
+        self.num_5teams, self.num_4teams = num_size_teams(self.num_students)
+
+
+def _solve_random(cohort, control):
+    assign_teams_random(cohort.four_cliques, cohort.five_cliques,
+                        cohort.num_4teams, cohort.num_5teams, control)
+
+
+def _solve_greedy(cohort, control):
+    assign_teams_greedy(cohort.four_cliques, cohort.five_cliques,
+                        cohort.num_4teams, cohort.num_5teams, control=control)
+
+
+def _solve_joint_greedy(cohort, control):
+    assign_teams_joint_greedy(cohort.four_cliques, cohort.five_cliques,
+                              cohort.num_students, control)
+
+
+def _solve_multistart(cohort, control):
+    multistart_greedy(cohort.four_cliques, cohort.five_cliques,
+                      cohort.num_4teams, cohort.num_5teams, cohort.table,
+                      control=control)
+
+
+def _best_heuristic(cohort, control):
+    """
+    Runs the greedy and joint greedy algorithms and returns the cheaper of
+    their assignments (control keeps whichever is cheaper), or None if
+    neither found one.
+
+    Both choose cliques by compatibility score, which doesn't always follow
+    cost: a team whose students asked for each other scores highly, but if
+    one of them was asked for by nobody, scoring.team_evaluation counts them
+    as an odd person out and the team costs at least 4. Either algorithm can
+    choose such a team first, and neither is always better than the other.
+    """
+    for assign in [_solve_greedy, _solve_joint_greedy]:
+        try:
+            assign(cohort, control)
+        except ValueError:
+            pass
+    return control.best_teams
+
+
+def _solve_annealing(cohort, control):
+    # Start from the best greedy result, so there is a good assignment to
+    # fall back on straight away
+    teams = _best_heuristic(cohort, control)
+    if teams is None:
+        raise ValueError("The greedy algorithms found no assignment to "
+                         "improve")
+    improve_teams_annealing(teams, cohort.table, control=control)
+
+
+def _solve_exact(cohort, control):
+    # Find a good assignment first, to have something to return if the
+    # exact solver runs out of time and so that it only has to look for
+    # cheaper ones. If the greedy algorithms find nothing, the exact solver
+    # looks for a first assignment itself.
+    teams = _best_heuristic(cohort, control)
+    if teams is not None:
+        improve_teams_annealing(teams, cohort.table, control=control)
+    assign_teams_exact(cohort.four_cliques, cohort.five_cliques,
+                       cohort.num_4teams, cohort.num_5teams, cohort.table,
+                       control, initial_teams=control.best_teams)
+
+
+# Each method runs an assignment function with a SolveControl, which keeps
+# the best assignment found
+METHODS = {
+    "random": _solve_random,
+    "greedy": _solve_greedy,
+    "joint_greedy": _solve_joint_greedy,
+    "multistart": _solve_multistart,
+    "annealing": _solve_annealing,
+    "exact": _solve_exact,
+}
+
+
+def solve(cohort, method="exact", time_budget=None, on_progress=None,
+          cancel=None, progress_interval=1.0):
+    """
+    Splits a cohort of students into teams with one of the assignment
+    methods, stopping early if the time budget runs out or cancel is set.
+
+    Arguments:
+        cohort: the Cohort to split into teams
+        method: the name of a method in METHODS
+        time_budget: seconds to run for, or None to run until the method
+            finishes
+        on_progress: optional function called with (best cost, nodes
+            explored, seconds spent) every progress_interval seconds, and
+            once more at the end
+        cancel: optional threading.Event. Setting it (for example from
+            another thread) stops the solve, the same as running out of time.
+        progress_interval: seconds between calls to on_progress
+
+    Return:
+        a tuple of (best assignment found as a list of teams (tuples of
+        student ids), or None if none was found in time, its cost, True if
+        the method finished or False if it was stopped early)
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method '%s', expected one of %s" %
+                         (method, ", ".join(METHODS)))
+    control = SolveControl(cohort.table, time_budget, on_progress, cancel,
+                           progress_interval)
+    try:
+        METHODS[method](cohort, control)
+        finished = True
+    except SolveStopped:
+        finished = False
+    control.report()
+
+    # Score the best assignment the same way whichever method found it
+    best_cost = control.best_cost
+    if control.best_teams is not None:
+        best_cost = assignment_cost_batch([control.best_teams], cohort.table)[0]
+    return control.best_teams, best_cost, finished
@@ -1,48 +1,412 @@
+import numpy as np
+from functools import cached_property
+
+
+class StudentTable:
+    """
+    Stores the skill, experience and commitment data for a group of students
+    as one NumPy column per field, so the data for many students can be
+    looked up and compared at once. Each student has a dense integer id, which
+    is their row in every column.
+
+    Topic votes and partner preferences are also available as matrices
+    indexed by student id. These are built from the students the first time
+    they are used. After a student's preferences or topics change, call
+    update_student to update the matrices that have been built.
+
+    Students can be added and removed one at a time with add_student and
+    remove_student, which only work out the matrix rows and columns of the
+    student that changed, rather than building a new table.
+
+    A Student belongs to one table at a time. from_students moves the
+    students it is given into the new table, changing their table and id,
+    so any table they were in before no longer describes them. Use
+    of_students to get the students' table without moving them if they are
+    already in one together.
+    """
+    # Fields that come directly from the survey data
+    INPUT_FIELDS = (
+        "commitment",
+        "intr_mgmt", "exp_mgmt",
+        "intr_elec", "exp_elec",
+        "intr_prog", "exp_prog",
+        "intr_cad", "exp_cad",
+        "intr_fab", "exp_fab",
+    )
+    # Combined ratings calculated from the survey data
+    DERIVED_FIELDS = (
+        "mgmt", "elec", "prog", "cad", "fab",
+        "intr_mech", "exp_mech", "mech",
+    )
+    FIELDS = INPUT_FIELDS + DERIVED_FIELDS
+    # The mechanical ratings are averages, so they need a float column
+    FLOAT_FIELDS = ("intr_mech", "exp_mech", "mech")
+    # Matrices indexed by student id on both sides, and the Student
+    # attribute each of the first two is built from
+    NAME_MATRICES = {"pref_matrix": "preferences",
+                     "anti_pref_matrix": "anti_prefs"}
+    PAIR_MATRICES = ("pref_matrix", "anti_pref_matrix", "mutual_pref_matrix",
+                     "conflict_matrix")
+
+    def __init__(self, num_students):
+        for field in self.FIELDS:
+            dtype = np.float64 if field in self.FLOAT_FIELDS else np.int64
+            setattr(self, field, np.zeros(num_students, dtype=dtype))
+        # The Student object for each id
+        self.students = [None] * num_students
+
+    def __len__(self):
+        return len(self.commitment)
+
+    @classmethod
+    def from_students(cls, students):
+        """
+        Creates a table holding the data of a list of Student objects, and
+        makes each student a view of its row in the new table. A student's id
+        becomes their position in the list.
+
+        This changes the students passed in: their table and id are set to
+        the new table and their position, and ids from any table they were
+        in before no longer refer to them.
+        """
+        table = cls(len(students))
+        for student_id, student in enumerate(students):
+            for field in cls.FIELDS:
+                getattr(table, field)[student_id] = getattr(student, field)
+            student.table = table
+            student.id = student_id
+            table.students[student_id] = student
+        return table
+
+    @classmethod
+    def of_students(cls, students):
+        """
+        Returns the table a list of Student objects share, if each student's
+        id is their position in the list, so the students are left as they
+        are. Otherwise moves them into a new table with from_students.
+        """
+        if students:
+            table = students[0].table
+            if len(table) == len(students) and all(
+                    student.table is table and student.id == student_id
+                    for student_id, student in enumerate(students)):
+                return table
+        return cls.from_students(students)
+
+    def set_row(self, student_id, **values):
+        """
+        Sets survey data fields for one student and recalculates their
+        combined ratings.
+        """
+        for field, value in values.items():
+            getattr(self, field)[student_id] = value
+        self.compute_derived(student_id)
+
+    def add_student(self, student):
+        """
+        Adds a Student to the end of the table and moves them into it, like
+        from_students does, giving them the next id. Any matrices that have
+        been built get a row and column for the new student.
+
+        Return:
+            the new student's id
+        """
+        student_id = len(self)
+        # Copy the student's ratings before they are moved into this table
+        for field in self.FIELDS:
+            setattr(self, field, np.append(getattr(self, field),
+                                           getattr(student, field)))
+        student.table = self
+        student.id = student_id
+        self.students.append(student)
+
+        for name in self.PAIR_MATRICES:
+            if name in self.__dict__:
+                self.__dict__[name] = np.pad(self.__dict__[name],
+                                             ((0, 1), (0, 1)))
+        if "topic_matrix" in self.__dict__:
+            self.topic_matrix = np.pad(self.topic_matrix, ((0, 1), (0, 0)))
+        self.update_student(student_id)
+        return student_id
+
+    def remove_student(self, student_id):
+        """
+        Removes the student with the given id from the table, moving them
+        into a table of their own. Every student after them moves down one
+        id, and their rows and columns are deleted from any matrices that
+        have been built.
+
+        Topics only the removed student voted for stay in topic_names, with
+        no votes.
+        """
+        StudentTable.from_students([self.students[student_id]])
+        del self.students[student_id]
+        for student in self.students[student_id:]:
+            student.id -= 1
+        for field in self.FIELDS:
+            setattr(self, field, np.delete(getattr(self, field), student_id))
+
+        for name in self.PAIR_MATRICES:
+            if name in self.__dict__:
+                self.__dict__[name] = np.delete(np.delete(
+                    self.__dict__[name], student_id, axis=0), student_id,
+                    axis=1)
+        if "topic_matrix" in self.__dict__:
+            self.topic_matrix = np.delete(self.topic_matrix, student_id,
+                                          axis=0)
+
+    def update_student(self, student_id):
+        """
+        Updates the matrices that have been built after the preferences,
+        anti-preferences or topics of the student with the given id change.
+        Only that student's rows and columns are worked out again.
+        """
+        student = self.students[student_id]
+        for name, attribute in self.NAME_MATRICES.items():
+            if name in self.__dict__:
+                matrix = self.__dict__[name]
+                # Who this student named, and who named this student
+                matrix[student_id, :] = [other.name in getattr(student,
+                                                               attribute)
+                                         for other in self.students]
+                matrix[:, student_id] = [student.name in getattr(other,
+                                                                 attribute)
+                                         for other in self.students]
+
+        if "mutual_pref_matrix" in self.__dict__:
+            prefs = self.pref_matrix.astype(bool)
+            mutual = prefs[student_id, :] & prefs[:, student_id]
+            self.mutual_pref_matrix[student_id, :] = mutual
+            self.mutual_pref_matrix[:, student_id] = mutual
+        if "conflict_matrix" in self.__dict__:
+            anti_prefs = self.anti_pref_matrix
+            conflicts = anti_prefs[student_id, :] | anti_prefs[:, student_id]
+            self.conflict_matrix[student_id, :] = conflicts
+            self.conflict_matrix[:, student_id] = conflicts
+
+        if "topic_names" in self.__dict__:
+            if not student.topics <= set(self.topic_names):
+                # A new topic needs a new column, so build the topics again
+                # the next time they are used
+                self.__dict__.pop("topic_matrix", None)
+                del self.__dict__["topic_names"]
+            elif "topic_matrix" in self.__dict__:
+                self.topic_matrix[student_id, :] = [
+                    topic in student.topics for topic in self.topic_names]
+
+    def compute_derived(self, student_ids=slice(None)):
+        """
+        Calculates the combined ratings from the survey data fields, for the
+        given student ids (or every student if none are given).
+        """
+        # For each skill area, create a combined rating of interest and
+        # experience, from 2-10
+        self.mgmt[student_ids] = \
+            self.intr_mgmt[student_ids] + self.exp_mgmt[student_ids]
+        self.elec[student_ids] = \
+            self.intr_elec[student_ids] + self.exp_elec[student_ids]
+        self.prog[student_ids] = \
+            self.intr_prog[student_ids] + self.exp_elec[student_ids]
+        self.cad[student_ids] = \
+            self.intr_cad[student_ids] + self.exp_cad[student_ids]
+        self.fab[student_ids] = \
+            self.intr_fab[student_ids] + self.exp_fab[student_ids]
+
+        # Create a mechanical skill area as the average of CAD and fabrication
+        self.intr_mech[student_ids] = \
+            (self.intr_cad[student_ids] + self.intr_fab[student_ids]) / 2
+        self.exp_mech[student_ids] = \
+            (self.exp_cad[student_ids] + self.exp_fab[student_ids]) / 2
+        self.mech[student_ids] = \
+            self.intr_mech[student_ids] + self.exp_mech[student_ids]
+
+    def _name_matrix(self, attribute):
+        """
+        Returns a boolean matrix where entry [i, j] is True if the name of the
+        student with id j is in the given set attribute of the student with
+        id i.
+        """
+        ids_by_name = {}
+        for student_id, student in enumerate(self.students):
+            ids_by_name.setdefault(student.name, []).append(student_id)
+
+        matrix = np.zeros((len(self), len(self)), dtype=bool)
+        for student_id, student in enumerate(self.students):
+            for name in getattr(student, attribute):
+                matrix[student_id, ids_by_name.get(name, [])] = True
+        return matrix
+
+    @cached_property
+    def pref_matrix(self):
+        """
+        Matrix where entry [i, j] is 1 if student i requested to work with
+        student j, and 0 otherwise.
+        """
+        return self._name_matrix("preferences").astype(np.int8)
+
+    @cached_property
+    def anti_pref_matrix(self):
+        """
+        Matrix where entry [i, j] is True if student i requested not to work
+        with student j.
+        """
+        return self._name_matrix("anti_prefs")
+
+    @cached_property
+    def mutual_pref_matrix(self):
+        """
+        Symmetric matrix where entry [i, j] is True if students i and j both
+        requested to work with each other.
+        """
+        prefs = self.pref_matrix.astype(bool)
+        return prefs & prefs.T
+
+    @cached_property
+    def conflict_matrix(self):
+        """
+        Symmetric matrix where entry [i, j] is True if either student i or
+        student j requested not to work with the other.
+        """
+        return self.anti_pref_matrix | self.anti_pref_matrix.T
+
+    @cached_property
+    def topic_names(self):
+        """
+        Sorted list of every project topic voted for by any student.
+        """
+        return sorted(set().union(*(s.topics for s in self.students)))
+
+    @cached_property
+    def topic_matrix(self):
+        """
+        Matrix where entry [i, t] is True if student i voted for the topic at
+        position t of topic_names.
+        """
+        topic_ids = {topic: t for t, topic in enumerate(self.topic_names)}
+        matrix = np.zeros((len(self), len(topic_ids)), dtype=bool)
+        for student_id, student in enumerate(self.students):
+            matrix[student_id, [topic_ids[t] for t in student.topics]] = True
+        return matrix
+
+
+class _TableColumn:
+    """
+    A Student attribute that is stored in its row of the student's table.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, student, owner=None):
+        if student is None:
+            return self
+        return getattr(student.table, self.name).item(student.id)
+
+    def __set__(self, student, value):
+        getattr(student.table, self.name)[student.id] = value
+
+
 class Student:
     """
     Represents a student. Contains data about their skills, experience and
     preferences as described in a survey data file.
+
+    Skill, experience and commitment ratings live in a row of a StudentTable,
+    so students loaded together can be scored together. A student created
+    without a table gets a table of their own.
     """
+    commitment = _TableColumn()
+
+    # For each skill area, interest and experience rating from 1-5
+    intr_mgmt = _TableColumn()
+    exp_mgmt = _TableColumn()
+    intr_elec = _TableColumn()
+    exp_elec = _TableColumn()
+    intr_prog = _TableColumn()
+    exp_prog = _TableColumn()
+    intr_cad = _TableColumn()
+    exp_cad = _TableColumn()
+    intr_fab = _TableColumn()
+    exp_fab = _TableColumn()
+
+    # Combined ratings for each skill, from 2-10
+    mgmt = _TableColumn()
+    elec = _TableColumn()
+    prog = _TableColumn()
+    cad = _TableColumn()
+    fab = _TableColumn()
+
+    # Mechanical skill area, the average of CAD and fabrication
+    intr_mech = _TableColumn()
+    exp_mech = _TableColumn()
+    mech = _TableColumn()
+
     def __init__(self, name, pronouns, commitment=0, topics=None,
                  preferences=None, anti_prefs=None, intr_mgmt=0, exp_mgmt=0,
                  intr_elec=0, exp_elec=0, intr_prog=0, exp_prog=0, intr_cad=0,
-                 exp_cad=0, intr_fab=0, exp_fab=0):
-        
+                 exp_cad=0, intr_fab=0, exp_fab=0, table=None,
+                 student_id=0):
+
         self.name = name
         self.pronouns = pronouns
-        self.commitment = commitment
 
         # Create empty sets for these if no input is given
         self.topics = topics or set()
         self.preferences = preferences or set()
         self.anti_prefs = anti_prefs or set()
 
-        # For each skill area, store interest and experience rating from 1-5
-        self.intr_mgmt = intr_mgmt
-        self.exp_mgmt = exp_mgmt
-        # Also create a combined rating for this skill, from 2-10
-        self.mgmt = intr_mgmt + exp_mgmt
-
-        self.intr_elec = intr_elec
-        self.exp_elec = exp_elec
-        self.elec = intr_elec + exp_elec
-
-        self.intr_prog = intr_prog
-        self.exp_prog = exp_prog
-        self.prog = intr_prog + exp_elec
+        # Store ratings in the given row of the table, or in a new table
+        self.table = table if table is not None else StudentTable(1)
+        self.id = student_id
+        self.table.students[student_id] = self
+        self.table.set_row(
+            student_id, commitment=commitment,
+            intr_mgmt=intr_mgmt, exp_mgmt=exp_mgmt,
+            intr_elec=intr_elec, exp_elec=exp_elec,
+            intr_prog=intr_prog, exp_prog=exp_prog,
+            intr_cad=intr_cad, exp_cad=exp_cad,
+            intr_fab=intr_fab, exp_fab=exp_fab,
+        )
 
-        self.intr_cad = intr_cad
-        self.exp_cad = exp_cad
-        self.cad = intr_cad + exp_cad
+    @classmethod
+    def from_table_row(cls, table, student_id, name, pronouns, topics=None,
+                       preferences=None, anti_prefs=None):
+        """
+        Creates a student whose ratings are already stored in the given row
+        of a table, without writing them to the table again.
+        """
+        student = cls.__new__(cls)
+        student.name = name
+        student.pronouns = pronouns
+        student.topics = topics or set()
+        student.preferences = preferences or set()
+        student.anti_prefs = anti_prefs or set()
+        student.table = table
+        student.id = student_id
+        table.students[student_id] = student
+        return student
 
-        self.intr_fab = intr_fab
-        self.exp_fab = exp_fab
-        self.fab = intr_fab + exp_fab
+    def __getstate__(self):
+        """
+        Pickle the student's own ratings rather than their whole table.
+        """
+        state = dict(self.__dict__)
+        del state["table"], state["id"]
+        for field in StudentTable.FIELDS:
+            state[field] = getattr(self, field)
+        return state
 
-        # Create a mechanical skill area as the average of CAD and fabrication
-        self.intr_mech = (intr_cad + intr_fab) / 2
-        self.exp_mech = (exp_cad + exp_fab) / 2
-        self.mech = self.intr_mech + self.exp_mech
+    def __setstate__(self, state):
+        """
+        Give an unpickled student a table of their own. This also loads
+        students pickled before ratings were stored in tables.
+        """
+        state = dict(state)
+        self.table = StudentTable(1)
+        self.id = 0
+        self.table.students[0] = self
+        for field in StudentTable.FIELDS:
+            getattr(self.table, field)[0] = state.pop(field)
+        self.__dict__.update(state)
 
     def __repr__(self):
         return self.name
@@ -50,7 +414,7 @@ class Student:
     def __hash__(self):
         """
         Students with the same name should be hashed the same.
-        This way, copies of one student in different cliques loaded from a file 
+        This way, copies of one student in different cliques loaded from a file
         will be seen as the same if they have the same name.
         """
         return hash(self.name)
@@ -58,7 +422,7 @@ class Student:
     def __eq__(self, other):
         """
         Students with the same name should be considered equal.
-        This way, copies of one student in different cliques loaded from a file 
+        This way, copies of one student in different cliques loaded from a file
         will be seen as overlapping if they have the same name.
         """
         return self.name == other.name
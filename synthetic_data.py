@@ -0,0 +1,304 @@
+"""
+Generates synthetic survey results in the same format as the anonymized
+survey files in /data, for testing with far more students than the real
+data has.
+
+The distributions of ratings, topics, pronouns and how many partners each
+student names are fitted to the bundled surveys by SurveyProfile.from_surveys,
+and can be changed on the profile before generating. The same number of
+students, profile and seed always give the same file.
+
+Usage:
+    python synthetic_data.py 500
+    python synthetic_data.py 500 data/anonymized_surveys_big.csv --seed 3
+
+The first writes data/anonymized_surveys_S500.csv, which data_loader.py can
+then load with the suffix S500.
+"""
+import argparse
+import numpy as np
+import pandas as pd
+from data_loader import RATING_COLUMNS, split_column
+
+
+# Survey files the default profile is fitted to
+SURVEY_FILES = ["data/anonymized_surveys_A.csv",
+                "data/anonymized_surveys_B.csv",
+                "data/anonymized_surveys_C.csv"]
+# Columns of a survey file, in order
+SURVEY_COLUMNS = ["Student", "Pronouns", "ClassTime"] + \
+    list(RATING_COLUMNS) + ["Prefs", "AntiPrefs", "ProjTopics"]
+# Topics named by fewer students than this are one-off free text answers, and
+# aren't generated
+MIN_TOPIC_VOTES = 5
+
+
+def _count_weights(counts):
+    """
+    Returns an array where entry i is the fraction of counts equal to i.
+    """
+    weights = np.bincount(np.asarray(counts, dtype=np.int64))
+    return weights / max(weights.sum(), 1)
+
+
+def _student_names(num_names, rng):
+    """
+    Makes num_names different names of capital letters, like the initials in
+    the anonymized surveys, in a random order. Names are two letters long
+    when there are few enough of them, and longer otherwise.
+    """
+    length = 2
+    while 26**length < num_names:
+        length += 1
+    codes = rng.choice(26**length, size=num_names, replace=False)
+    letters = (codes[:, None] // 26**np.arange(length - 1, -1, -1)) % 26
+    return ["".join(chr(ord("A") + letter) for letter in row)
+            for row in letters]
+
+
+class SurveyProfile:
+    """
+    The distributions synthetic survey results are drawn from.
+
+    Attributes:
+        rating_weights: dictionary of {rating column: array of the chance of
+            each rating from 1 to 5}
+        pref_density: the average number of students in the same class each
+            student names as a preferred partner
+        anti_pref_rate: the average number of students in the same class each
+            student names as an anti-preference
+        reciprocity: the chance that a student named as a preferred partner
+            by someone names them back
+        outside_pref_weights, outside_anti_pref_weights: arrays of the chance
+            of a student also naming 0, 1, 2, ... students who aren't in the
+            class (which the data loader ignores)
+        topic_weights: dictionary of {project topic: how popular it is}
+        topic_count_weights: array of the chance of a student choosing 0, 1,
+            2, ... topics
+        pronoun_weights, class_time_weights: dictionaries of {answer: chance}
+    """
+    def __init__(self):
+        self.rating_weights = {column: np.full(5, 0.2)
+                               for column in RATING_COLUMNS}
+        self.pref_density = 1.0
+        self.anti_pref_rate = 0.3
+        self.reciprocity = 0.5
+        self.outside_pref_weights = np.array([1.0])
+        self.outside_anti_pref_weights = np.array([1.0])
+        self.topic_weights = {"art makers": 1.0}
+        self.topic_count_weights = np.array([0.0, 1.0])
+        self.pronoun_weights = {"they/them": 1.0}
+        self.class_time_weights = {"A": 1.0}
+
+    @classmethod
+    def from_surveys(cls, filenames=SURVEY_FILES):
+        """
+        Creates a profile fitted to survey files. Each file is taken to be
+        one class, so names only count as being in the same class when they
+        are in the same file.
+        """
+        profile = cls()
+        surveys = [pd.read_csv(filename) for filename in filenames]
+        survey = pd.concat(surveys, ignore_index=True)
+
+        for column in RATING_COLUMNS:
+            counts = np.bincount(survey[column], minlength=6)[1:6]
+            profile.rating_weights[column] = counts / counts.sum()
+
+        in_class = {"Prefs": [], "AntiPrefs": []}
+        outside = {"Prefs": [], "AntiPrefs": []}
+        named_back = 0
+        for part in surveys:
+            names = set(part["Student"])
+            for column in in_class:
+                entries = split_column(part[column])
+                is_in_class = entries.isin(names)
+                in_counts = is_in_class.groupby(level=0).sum().reindex(
+                    part.index, fill_value=0)
+                in_class[column].extend(in_counts)
+                outside[column].extend(
+                    (~is_in_class).groupby(level=0).sum().reindex(
+                        part.index, fill_value=0))
+
+            # Count the preferences in the class that are returned
+            entries = split_column(part["Prefs"])
+            pairs = set(zip(part["Student"][entries.index], entries))
+            named_back += sum((other, name) in pairs for name, other in pairs)
+
+        profile.pref_density = np.mean(in_class["Prefs"])
+        profile.anti_pref_rate = np.mean(in_class["AntiPrefs"])
+        profile.reciprocity = named_back / max(sum(in_class["Prefs"]), 1)
+        profile.outside_pref_weights = _count_weights(outside["Prefs"])
+        profile.outside_anti_pref_weights = _count_weights(
+            outside["AntiPrefs"])
+
+        topics = split_column(survey["ProjTopics"])
+        votes = topics.value_counts()
+        votes = votes[votes >= MIN_TOPIC_VOTES]
+        profile.topic_weights = dict(votes / votes.sum())
+        topic_counts = topics[topics.isin(votes.index)].groupby(
+            level=0).size().reindex(survey.index, fill_value=0)
+        profile.topic_count_weights = _count_weights(topic_counts)
+
+        profile.pronoun_weights = dict(
+            survey["Pronouns"].value_counts(normalize=True))
+        profile.class_time_weights = dict(
+            survey["ClassTime"].value_counts(normalize=True))
+        return profile
+
+    def set_num_topics(self, num_topics):
+        """
+        Changes the number of project topics to choose from. Fewer topics
+        keeps the most popular ones, and more topics adds new ones as popular
+        as the average topic.
+        """
+        topics = sorted(self.topic_weights, key=self.topic_weights.get,
+                        reverse=True)[:num_topics]
+        weights = {topic: self.topic_weights[topic] for topic in topics}
+        average = np.mean(list(weights.values())) if weights else 1.0
+        for i in range(len(weights), num_topics):
+            weights["project topic %i" % (i + 1)] = average
+        self.topic_weights = weights
+
+
+def _draw(rng, weights, size):
+    """
+    Draws size answers from a dictionary of {answer: weight}.
+    """
+    answers = list(weights)
+    chances = np.array([weights[answer] for answer in answers], dtype=float)
+    return [answers[i] for i in rng.choice(
+        len(answers), size=size, p=chances / chances.sum())]
+
+
+def _pick_partners(rng, counts, reciprocity=0.0, exclude=None):
+    """
+    Picks about counts[i] other students in the class for each student i to
+    name, leaving out anyone in exclude[i] if exclude is given. About a
+    reciprocity fraction of the picks are made in pairs of students who
+    name each other, and the rest are random other students.
+
+    Returns a list with the set of ids each student picked.
+    """
+    num_students = len(counts)
+    picked = [set() for _ in range(num_students)]
+    # Pair up students by shuffling one entry per pick each student makes,
+    # and matching the first few entries two at a time
+    picks = rng.permutation(np.repeat(np.arange(num_students), counts))
+    num_paired = 2 * int(round(reciprocity * len(picks) / 2))
+    for student, other in zip(picks[0:num_paired:2], picks[1:num_paired:2]):
+        if student != other and (exclude is None or (
+                other not in exclude[student] and
+                student not in exclude[other])):
+            picked[student].add(other)
+            picked[other].add(student)
+
+    for student in picks[num_paired:]:
+        skip = {student} if exclude is None else {student} | exclude[student]
+        if len(picked[student]) + len(skip) >= num_students:
+            continue
+        while True:
+            other = int(rng.integers(num_students))
+            if other not in skip and other not in picked[student]:
+                picked[student].add(other)
+                break
+    return picked
+
+
+def generate_survey(num_students, filename=None, seed=0, profile=None):
+    """
+    Generates synthetic survey results for one class of students.
+
+    Arguments:
+        num_students: the number of students in the class
+        filename: optionally, a CSV file to save the survey to
+        seed: the seed for the random numbers. The same seed (with the same
+            profile) always gives the same survey.
+        profile: the SurveyProfile to draw from. Defaults to one fitted to
+            the anonymized surveys in /data.
+
+    Return:
+        a pandas DataFrame with one row per student and the same columns as
+        the anonymized survey files
+    """
+    if profile is None:
+        profile = SurveyProfile.from_surveys()
+    rng = np.random.default_rng(seed)
+
+    # Students outside the class get names too, so that students can name
+    # them like in the real surveys
+    max_outside = max(len(profile.outside_pref_weights),
+                      len(profile.outside_anti_pref_weights)) - 1
+    num_outside = max(1, num_students // 2) if max_outside > 0 else 0
+    all_names = _student_names(num_students + num_outside, rng)
+    names, outside_names = all_names[:num_students], all_names[num_students:]
+
+    survey = pd.DataFrame({
+        "Student": names,
+        "Pronouns": _draw(rng, profile.pronoun_weights, num_students),
+        "ClassTime": _draw(rng, profile.class_time_weights, num_students),
+    })
+    for column in RATING_COLUMNS:
+        weights = profile.rating_weights[column]
+        survey[column] = rng.choice(np.arange(1, 6), size=num_students,
+                                    p=weights / weights.sum())
+
+    # Nobody names the same student as a preference and an anti-preference
+    prefs = _pick_partners(
+        rng, rng.poisson(profile.pref_density, num_students),
+        profile.reciprocity)
+    anti_prefs = _pick_partners(
+        rng, rng.poisson(profile.anti_pref_rate, num_students),
+        exclude=prefs)
+
+    for column, picked, outside_weights in (
+            ("Prefs", prefs, profile.outside_pref_weights),
+            ("AntiPrefs", anti_prefs, profile.outside_anti_pref_weights)):
+        num_outside_named = rng.choice(
+            len(outside_weights), size=num_students,
+            p=outside_weights / outside_weights.sum())
+        cells = []
+        for student in range(num_students):
+            named = [names[other] for other in sorted(picked[student])]
+            if outside_names:
+                named += [outside_names[i] for i in rng.choice(
+                    len(outside_names),
+                    size=min(num_outside_named[student], len(outside_names)),
+                    replace=False)]
+            cells.append(";".join(named))
+        survey[column] = cells
+
+    topics = list(profile.topic_weights)
+    topic_chances = np.array([profile.topic_weights[topic] for topic in topics])
+    topic_chances = topic_chances / topic_chances.sum()
+    num_topics = rng.choice(len(profile.topic_count_weights),
+                            size=num_students,
+                            p=profile.topic_count_weights /
+                            profile.topic_count_weights.sum())
+    survey["ProjTopics"] = [
+        ";".join(topics[i] for i in rng.choice(
+            len(topics), size=min(count, len(topics)), replace=False,
+            p=topic_chances))
+        for count in num_topics]
+
+    survey = survey[SURVEY_COLUMNS]
+    if filename is not None:
+        survey.to_csv(filename, index=False)
+    return survey
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("num_students", type=int,
+                        help="number of students to generate")
+    parser.add_argument("filename", nargs="?",
+                        help="CSV file to save the survey to (defaults to "
+                             "data/anonymized_surveys_S<num_students>.csv)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for the random numbers")
+    args = parser.parse_args()
+
+    filename = args.filename or \
+        "data/anonymized_surveys_S%i.csv" % args.num_students
+    generate_survey(args.num_students, filename, args.seed)
+    print("%i synthetic students saved in %s" % (args.num_students, filename))
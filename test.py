@@ -1,9 +1,44 @@
 """
-Code to test helper functions. Currently just tests `overlaps`, but additional
-tests should go here.
+Code to test the helper, clique finding, scoring and assignment functions.
+Additional tests should go here.
 """
-from helpers import overlaps
+from itertools import combinations
+from tempfile import TemporaryDirectory
+from assignments import (
+    assign_students_random, assign_teams_exact, assign_teams_greedy,
+    assign_teams_joint_greedy, improve_teams_annealing)
+from benchmark import compare, sample_cliques, synthetic_students
+from best_cliques import best_clique_set
+from cache import ArtifactCache, artifact_key
+from clique_finding import (
+    count_independent_sets, enumerate_cliques, find_k_clique,
+    iter_independent_sets, iter_k_cliques, iter_sized_independent_sets)
+from clique_shards import find_top_cliques, save_clique_shards
+from clique_store import (
+    CliqueSet, iter_clique_chunks, load_cliques, load_manifest, save_cliques)
+from clique_stream import iter_chunks, keep_top_cliques
+from constraints import TeamConstraints
+from data_loader import (
+    create_conflict_graph, create_save_cliques, load_student_data)
+from helpers import num_size_teams, overlaps, violates_anti_prefs
+from multistart import multistart_greedy
+from scoring import (
+    team_compatibility, team_compatibility_batch, team_evaluation,
+    team_evaluation_batch)
+from roster import Roster
+from scoring import assignment_cost
+from solver import Cohort, solve
+from student import Student, StudentTable
+from synthetic_data import SURVEY_COLUMNS, SurveyProfile, generate_survey
+import copy
+import json
+import os
+import random
+import threading
+import time
+import joblib
 import networkx as nx
+import numpy as np
 
 graph1 = nx.Graph()
 graph1.add_node("a")
@@ -19,3 +54,674 @@ does_overlap = overlaps(graph1.nodes(),graph2.nodes())
 
 print("overlaps:")
 print(does_overlap)
+
+# Compare find_k_clique against checking every k-subset of a random graph
+random_graph = nx.gnp_random_graph(14, 0.7, seed=1)
+matches_brute_force = True
+for k in range(2, 6):
+    found = {frozenset(clique.nodes)
+             for clique in find_k_clique(random_graph, k)}
+    expected = {frozenset(nodes)
+                for nodes in combinations(random_graph.nodes, k)
+                if all(random_graph.has_edge(*pair)
+                       for pair in combinations(nodes, 2))}
+    matches_brute_force = matches_brute_force and found == expected
+
+print("find_k_clique matches brute force:")
+print(matches_brute_force)
+
+# Compare batch scoring against scoring each team of the A20 sample on its own
+student_graph = joblib.load("data/student_graph_A20")
+students = list(student_graph.nodes)
+table = StudentTable.from_students(students)
+five_cliques = np.array(list(iter_k_cliques(student_graph, 5)))
+
+batch_compat = team_compatibility_batch(five_cliques, table)
+single_compat = [team_compatibility([students[i] for i in team])
+                 for team in five_cliques]
+
+print("team_compatibility_batch matches team_compatibility:")
+print(bool(np.all(batch_compat == single_compat)))
+
+# Do the same for batch evaluation, on 4-cliques since those include teams
+# with a filler student
+four_cliques = np.array(list(iter_k_cliques(student_graph, 4)))
+
+batch_evaluation = team_evaluation_batch(four_cliques, table)
+single_evaluation = [team_evaluation([students[i] for i in team])
+                     for team in four_cliques]
+
+print("team_evaluation_batch matches team_evaluation:")
+print(bool(np.all(batch_evaluation == single_evaluation)))
+
+# Compare the exact solver against trying every way of splitting the first 13
+# students of the A20 sample into two teams of 4 and one team of 5
+small_graph = student_graph.subgraph(students[:13])
+small_students = list(small_graph.nodes)
+small_table = StudentTable.from_students(small_students)
+small_four_cliques = list(iter_k_cliques(small_graph, 4))
+small_five_cliques = list(iter_k_cliques(small_graph, 5))
+
+exact_teams = assign_teams_exact(
+    small_four_cliques, small_five_cliques, 2, 1, small_table)
+exact_cost = assignment_cost(
+    [[small_students[i] for i in team] for team in exact_teams])
+
+team_costs = {}
+for team in small_four_cliques + small_five_cliques:
+    team_costs[frozenset(team)] = assignment_cost(
+        [[small_students[i] for i in team]])
+best_cost = float("inf")
+for five in small_five_cliques:
+    rest = [i for i in range(13) if i not in five]
+    # Put the lowest remaining student on the first team of 4 so each split
+    # is only counted once
+    for others in combinations(rest[1:], 3):
+        first = frozenset((rest[0],) + others)
+        second = frozenset(rest) - first
+        if first in team_costs and second in team_costs:
+            best_cost = min(best_cost, team_costs[frozenset(five)] +
+                            team_costs[first] + team_costs[second])
+
+print("assign_teams_exact finds the cheapest assignment:")
+print(abs(exact_cost - best_cost) < 1e-9)
+
+# Check that simulated annealing keeps every student on exactly one team, and
+# improves on a random split of the same students
+random_teams = assign_students_random(2, 1, seed=0)
+annealed_teams = improve_teams_annealing(
+    random_teams, small_table, steps=2000, seed=0)
+
+print("improve_teams_annealing keeps each student on one team:")
+print(sorted(sum(map(list, annealed_teams), [])) == list(range(13)))
+print("improve_teams_annealing improves on a random split:")
+print(assignment_cost([[small_students[i] for i in team]
+                       for team in annealed_teams]) <
+      assignment_cost([[small_students[i] for i in team]
+                       for team in random_teams]))
+
+# Check that the multi-start greedy does at least as well as plain greedy on
+# the A20 sample, since its first start is plain greedy
+table = StudentTable.from_students(students)
+sorted_cliques = []
+for cliques in (four_cliques, five_cliques):
+    compat = team_compatibility_batch(cliques, table)
+    order = np.argsort(-compat, kind="stable")
+    sorted_cliques.append(CliqueSet(cliques[order], compat[order]))
+greedy_cost = assignment_cost(
+    [[students[i] for i in team]
+     for team in assign_teams_greedy(*sorted_cliques, 0, 4)])
+_, multistart_cost, _ = multistart_greedy(
+    *sorted_cliques, 0, 4, table, num_starts=20, max_workers=2, seed=0)
+
+print("multistart_greedy does at least as well as assign_teams_greedy:")
+print(multistart_cost <= greedy_cost)
+
+# Check the index of which cliques each student is in against the cliques
+five_set = sorted_cliques[1]
+index_matches = all(
+    set(five_set.cliques_containing([student_id]).tolist()) ==
+    set(np.flatnonzero((five_set.members == student_id).any(axis=1)).tolist())
+    for student_id in range(len(students)))
+
+print("CliqueSet.cliques_containing matches clique members:")
+print(index_matches)
+
+# Check that the joint greedy puts every A20 student on exactly one team, with
+# the right numbers of teams of each size
+joint_teams = assign_teams_joint_greedy(*sorted_cliques, len(students))
+
+print("assign_teams_joint_greedy assigns each student to one team:")
+print(sorted(sum(map(list, joint_teams), [])) == list(range(len(students))) and
+      [len(team) for team in joint_teams] == [5, 5, 5, 5])
+
+# Check that greedy assignment stops with an error, rather than searching
+# forever, when a student isn't in any clique
+missing_student = CliqueSet([team for team in sorted_cliques[1]
+                             if 0 not in team], num_students=len(students))
+errors = 0
+for assign in [lambda: assign_teams_greedy(sorted_cliques[0],
+                                           missing_student, 0, 4),
+               lambda: assign_teams_joint_greedy(sorted_cliques[0],
+                                                 missing_student,
+                                                 len(students))]:
+    try:
+        assign()
+    except ValueError:
+        errors += 1
+
+print("Greedy assignment raises ValueError when a student can't be covered:")
+print(errors == 2)
+
+# Check that solve finishes the exact solver when it has no time limit, and
+# that a time budget or cancelling from another thread stops it early with
+# the best teams found so far
+cohort = Cohort(table, *sorted_cliques)
+solved_teams, solved_cost, finished = solve(cohort, "exact")
+
+print("solve finishes the exact solver with no time limit:")
+print(finished and abs(solved_cost - assignment_cost(
+    [[students[i] for i in team] for team in solved_teams])) < 1e-9)
+
+start_time = time.perf_counter()
+annealed_teams, _, finished = solve(cohort, "annealing", time_budget=0.2)
+
+print("solve stops annealing when the time budget runs out:")
+print(not finished and time.perf_counter() - start_time < 1 and
+      sorted(sum(map(list, annealed_teams), [])) == list(range(len(students))))
+
+cancel = threading.Event()
+progress = []
+threading.Timer(0.1, cancel.set).start()
+_, cancelled_cost, finished = solve(
+    cohort, "annealing", on_progress=lambda *args: progress.append(args),
+    cancel=cancel, progress_interval=0.05)
+
+print("solve stops when cancelled from another thread, reporting progress:")
+print(not finished and len(progress) >= 2 and
+      abs(progress[-1][0] - cancelled_cost) < 1e-9)
+
+# Check that a Roster's cliques and teams stay the same as building them from
+# scratch would give, as students join, drop out and add anti-preferences
+def roster_matches_rebuild(roster):
+    """
+    Returns True if the roster has every valid clique of its graph and its
+    teams put every student on exactly one team without anti-preferences.
+    """
+    names = [student.name for student in roster.graph.nodes]
+    for k, cliques in roster.cliques.items():
+        rebuilt = {frozenset(names[i] for i in clique)
+                   for clique in iter_k_cliques(roster.graph, k)
+                   if not violates_anti_prefs(
+                       [roster.students[i] for i in clique])}
+        kept = {frozenset(roster.students[i].name for i in clique)
+                for clique in cliques}
+        if rebuilt != kept:
+            return False
+    return (sorted(sum(map(list, roster.teams), [])) ==
+            list(range(len(roster.students))) and
+            not any(violates_anti_prefs([roster.students[i] for i in team])
+                    for team in roster.teams))
+
+
+roster_graph = joblib.load("data/student_graph_A20")
+roster = Roster(roster_graph, four_cliques, five_cliques)
+roster.add_student(Student(
+    "New Student", "they/them", 3, anti_prefs={roster.students[0].name},
+    intr_mgmt=3, exp_mgmt=2, intr_prog=4, exp_prog=4))
+print("Roster.add_student finds the new student's cliques and a team:")
+print(roster_matches_rebuild(roster))
+
+roster.remove_student(roster.students[5])
+print("Roster.remove_student deletes their cliques and repairs teams:")
+print(roster_matches_rebuild(roster))
+
+first, second = roster.teams[0][:2]
+roster.add_anti_pref(roster.students[first], roster.students[second].name)
+print("Roster.add_anti_pref deletes cliques and splits up the pair:")
+print(roster_matches_rebuild(roster) and
+      not any(first in team and second in team for team in roster.teams))
+
+# Check that the independent sets of the conflict graph are the valid cliques
+# of the student graph, that counting them agrees, and that slices of them
+# match the full list
+conflict_graph = create_conflict_graph(students)
+independent_matches = True
+for k in [4, 5]:
+    valid_cliques = {clique for clique in iter_k_cliques(student_graph, k)
+                     if not violates_anti_prefs([students[i] for i in clique])}
+    independent_sets = list(iter_independent_sets(conflict_graph, k))
+    independent_matches &= (
+        set(independent_sets) == valid_cliques and
+        len(independent_sets) == len(valid_cliques) ==
+        count_independent_sets(conflict_graph, k) and
+        list(iter_independent_sets(conflict_graph, k, 1000, 3000)) ==
+        independent_sets[1000:3000])
+
+print("Independent sets of the conflict graph match the valid cliques:")
+print(independent_matches)
+
+# Check that reading a survey file in chunks loads the same students, ratings
+# and preference matrices as reading it all at once, including the same
+# made-up commitment scores
+whole = load_student_data("data/anonymized_survey_data.csv")
+chunked = load_student_data("data/anonymized_survey_data.csv", chunk_size=50)
+chunks_match = all(
+    (a.name, a.topics, a.preferences, a.anti_prefs) ==
+    (b.name, b.topics, b.preferences, b.anti_prefs)
+    for a, b in zip(whole, chunked)) and len(whole) == len(chunked)
+for attribute in StudentTable.FIELDS + (
+        "pref_matrix", "anti_pref_matrix", "topic_matrix"):
+    chunks_match &= np.array_equal(getattr(whole[0].table, attribute),
+                                   getattr(chunked[0].table, attribute))
+
+print("load_student_data gives the same students when reading in chunks:")
+print(chunks_match)
+
+# Check that the artifact cache reuses artifacts with the same inputs, gives a
+# new key when a student's survey answers change, and evicts the least
+# recently used artifacts when it is full
+with TemporaryDirectory() as cache_dir:
+    cache = ArtifactCache(cache_dir, max_bytes=2000)
+    first = cache.get_or_build("scores", [students, 4], lambda: np.arange(100))
+    again = cache.get_or_build("scores", [students, 4], lambda: None)
+    cache_works = np.array_equal(first, again) and \
+        (cache.hits, cache.misses) == (1, 1)
+
+    key = artifact_key("scores", [students, 4])
+    changed = students[:]
+    changed[0] = Student(students[0].name, students[0].pronouns, commitment=5)
+    cache_works &= key != artifact_key("scores", [changed, 4])
+
+    # Each array takes about 900 bytes, so only the 2 most recent fit
+    for i in range(3):
+        cache.get_or_build("zeros", [i], lambda: np.zeros(100))
+    cache.get_or_build("zeros", [2], lambda: None)
+    cache_works &= len(os.listdir(cache_dir)) == 2 and cache.hits == 2
+
+print("ArtifactCache reuses, rekeys and evicts artifacts:")
+print(cache_works)
+
+# Check that sampled cliques from a synthetic class are valid, and that
+# comparing benchmark results flags only stages that got slower or used more
+# memory
+synthetic = synthetic_students(30)
+synthetic_table = synthetic[0].table
+sampled = sample_cliques(synthetic_table, 5, 500)
+benchmark_works = len(sampled) == 500 and \
+    not violates_anti_prefs(sampled, synthetic_table).any() and \
+    (np.diff(sampled, axis=1) > 0).all()
+
+with TemporaryDirectory() as results_dir:
+    old_result = {"cohort": "A20", "stage": "iter_k_cliques_4",
+                  "seconds": 1.0, "peak_bytes": 1000}
+    for name, seconds, peak_bytes in [("old", 1.0, 1000), ("same", 1.1, 1000),
+                                      ("slower", 2.0, 3000)]:
+        with open(os.path.join(results_dir, name + ".json"), "w") as f:
+            json.dump({"results": [dict(old_result, seconds=seconds,
+                                        peak_bytes=peak_bytes)]}, f)
+    paths = [os.path.join(results_dir, name + ".json")
+             for name in ("old", "same", "slower")]
+    benchmark_works &= compare(paths[0], paths[1]) == 0 and \
+        compare(paths[0], paths[2]) == 2
+
+print("benchmark samples valid cliques and flags regressions:")
+print(benchmark_works)
+
+# Check that synthetic surveys are the same for the same seed, have the same
+# columns as the real surveys, load like them, and have about the same
+# partner preferences as the profile they were drawn from
+profile = SurveyProfile.from_surveys()
+with TemporaryDirectory() as survey_dir:
+    survey_file = os.path.join(survey_dir, "anonymized_surveys_S2000.csv")
+    survey = generate_survey(2000, survey_file, seed=1, profile=profile)
+    fitted = SurveyProfile.from_surveys([survey_file])
+    synthetic_students_loaded = load_student_data(survey_file)
+generator_works = survey.equals(generate_survey(2000, seed=1,
+                                                profile=profile)) and \
+    not survey.equals(generate_survey(2000, seed=2, profile=profile)) and \
+    list(survey.columns) == SURVEY_COLUMNS and \
+    len(synthetic_students_loaded) == 2000 and \
+    abs(fitted.pref_density - profile.pref_density) < 0.1 and \
+    abs(fitted.anti_pref_rate - profile.anti_pref_rate) < 0.1 and \
+    abs(fitted.reciprocity - profile.reciprocity) < 0.1
+
+print("generate_survey is seeded and matches its profile:")
+print(generator_works)
+
+# Check that cliques found in shards by several processes load as the same
+# cliques as finding them all at once, that the shards' estimates are close
+# to even, and that saving one clique file over them deletes the shards
+with TemporaryDirectory() as shard_dir:
+    shard_file = os.path.join(shard_dir, "5_cliques_test")
+    shards = save_clique_shards(shard_file, conflict_graph, 5, num_workers=3)
+    sharded, roster_names = load_cliques(shard_file, students)
+    estimates = [shard["estimate"] for shard in shards]
+    shards_match = (
+        len(shards) == 3 and
+        set(map(tuple, sharded.tolist())) ==
+        set(iter_independent_sets(conflict_graph, 5)) and
+        len(sharded) == load_manifest(shard_file)["num_cliques"] and
+        max(estimates) < 1.1 * min(estimates))
+    save_cliques(shard_file, sharded, students)
+    shards_match &= load_manifest(shard_file) is None and \
+        sorted(os.listdir(shard_dir)) == ["5_cliques_test.npy",
+                                          "5_cliques_test.roster"]
+
+print("Cliques found in shards match the cliques found in one process:")
+print(shards_match)
+
+# Check that streaming cliques through keep_top_cliques in chunks keeps each
+# student's best cliques, and reports the best score of the cliques dropped
+all_cliques = np.array(list(iter_independent_sets(conflict_graph, 5)))
+all_compat = team_compatibility_batch(all_cliques, table)
+top = keep_top_cliques(iter_chunks(iter_independent_sets(conflict_graph, 5),
+                                   5, chunk_size=5000),
+                       5, table, per_student=30)
+top_matches = len(top.members) <= 30 * len(students) and \
+    top.num_seen == len(all_cliques)
+for student_id in range(len(students)):
+    best_all = np.sort(all_compat[
+        (all_cliques == student_id).any(axis=1)])[::-1][:30]
+    best_kept = np.sort(top.compat[
+        (top.members == student_id).any(axis=1)])[::-1][:30]
+    top_matches &= np.allclose(best_all, best_kept)
+kept = set(map(tuple, top.members.tolist()))
+dropped = [i for i, clique in enumerate(map(tuple, all_cliques.tolist()))
+           if clique not in kept]
+top_matches &= len(dropped) == top.num_dropped and \
+    np.isclose(all_compat[dropped].max(), top.max_dropped_compat)
+
+print("keep_top_cliques keeps the best cliques of each student:")
+print(top_matches)
+
+# Check that the best cliques found first are valid and have the highest
+# scores of all cliques, in order
+best = best_clique_set(table, 5, 500)
+best_first_works = len(best) == 500 and \
+    np.allclose(best.compat, np.sort(all_compat)[::-1][:500]) and \
+    np.allclose(best.compat, team_compatibility_batch(best.members, table)) and \
+    set(best) <= set(map(tuple, all_cliques.tolist()))
+
+print("best_clique_set finds the highest scoring cliques in order:")
+print(best_first_works)
+
+# Check that finding cliques with constraints gives the same cliques as
+# finding every clique and then filtering them, in one process and in shards
+constraints = TeamConstraints.from_conflict_graph(conflict_graph)
+constraints.require(table.mgmt >= 8)
+constraints.max_spread(table.commitment, 2)
+popular_topic = table.topic_matrix.sum(axis=0).argmax()
+constraints.require(table.topic_matrix[:, popular_topic], at_least=2)
+constraints.require(table.mgmt <= 4, at_least=0, at_most=1)
+meets_constraints = (
+    (table.mgmt[all_cliques] >= 8).any(axis=1) &
+    (np.ptp(table.commitment[all_cliques], axis=1) <= 2) &
+    (table.topic_matrix[all_cliques, popular_topic].sum(axis=1) >= 2) &
+    ((table.mgmt[all_cliques] <= 4).sum(axis=1) <= 1))
+filtered = set(map(tuple, all_cliques[meets_constraints].tolist()))
+constrained = list(constraints.iter_teams(5))
+constraints_work = len(filtered) > 0 and \
+    len(constrained) == len(set(constrained)) and \
+    set(constrained) == filtered
+with TemporaryDirectory() as shard_dir:
+    shard_file = os.path.join(shard_dir, "5_cliques_test")
+    save_clique_shards(shard_file, conflict_graph, 5, num_workers=2,
+                       constraints=constraints)
+    sharded, _ = load_cliques(shard_file, students)
+    constraints_work &= set(map(tuple, sharded.tolist())) == filtered
+
+print("Constraints checked while finding cliques match filtering after:")
+print(constraints_work)
+
+# Check that finding cliques of several sizes in one pass gives the same
+# cliques as finding each size separately, in the student graph and the
+# conflict graph
+cliques_by_size = enumerate_cliques(student_graph, sizes={3, 4, 5})
+sized_sets = list(iter_sized_independent_sets(conflict_graph, [4, 5]))
+sizes_match = True
+for k in [3, 4, 5]:
+    sizes_match &= sorted(cliques_by_size[k]) == \
+        sorted(iter_k_cliques(student_graph, k))
+for k in [4, 5]:
+    sets_of_size = [team for team in sized_sets if len(team) == k]
+    sizes_match &= len(sets_of_size) == len(set(sets_of_size)) and \
+        set(sets_of_size) == set(iter_independent_sets(conflict_graph, k))
+sizes_match &= len(sized_sets) == sum(
+    count_independent_sets(conflict_graph, k) for k in [4, 5])
+# Sizes can also be given as a generator
+sizes_match &= enumerate_cliques(student_graph, (k for k in [3, 4, 5])) == \
+    cliques_by_size
+
+print("Cliques of several sizes found at once match each size found alone:")
+print(sizes_match)
+
+# Check that num_size_teams still splits students into teams of 4 and 5 with
+# as few teams of 4 as possible, and splits them into other team sizes
+splits_work = True
+for num_students in range(200):
+    num_4 = -num_students % 5
+    expected = ((num_students - 4 * num_4) // 5, num_4) \
+        if 4 * num_4 <= num_students else (0, 0)
+    splits_work &= num_size_teams(num_students) == expected
+    for sizes in [(3, 4), (5, 6), (3, 4, 5)]:
+        counts = num_size_teams(num_students, sizes)
+        splits_work &= sum(count * size for count, size in zip(
+            counts, sorted(sizes, reverse=True))) in (0, num_students)
+splits_work &= num_size_teams(23, (5, 6)) == (3, 1) and \
+    num_size_teams(7, (3, 4)) == (1, 1) and num_size_teams(7, (4, 6)) == (0, 0)
+
+print("num_size_teams splits students into teams of any sizes:")
+print(splits_work)
+
+# Check that a sample with no valid teams saves and loads its cliques as an
+# empty array with a row length of k
+with TemporaryDirectory() as empty_dir:
+    empty_file = os.path.join(empty_dir, "5_cliques_empty")
+    save_cliques(empty_file, [], students, 5)
+    empty_cliques, _ = load_cliques(empty_file, students)
+    empty_works = empty_cliques.shape == (0, 5) and \
+        len(CliqueSet(empty_cliques, num_students=len(students))) == 0
+    try:
+        save_cliques(empty_file, [], students)
+        empty_works = False
+    except ValueError:
+        pass
+
+print("Saving no cliques keeps the shape of the clique array:")
+print(empty_works)
+
+# Check that of_students reuses the table students already share, and that
+# from_students moves students out of their old table
+shared_table = StudentTable.of_students(students)
+moved_students = students[:3]
+moved_table = StudentTable.from_students(moved_students)
+tables_work = shared_table is students[5].table and \
+    StudentTable.of_students(moved_students) is moved_table and \
+    students[0].table is moved_table and students[4].table is shared_table
+StudentTable.from_students(students)
+
+print("of_students reuses a shared table and from_students moves students:")
+print(tables_work)
+
+# Check that the exact solver finishes on a sample with many teams that cost
+# nothing, starting from the annealed assignment, and never does worse than
+# the assignment it started from
+random.seed(4)
+zero_students = random.sample(
+    load_student_data("data/anonymized_surveys_A.csv"), 28)
+zero_table = StudentTable.from_students(zero_students)
+zero_graph = create_conflict_graph(zero_students)
+zero_cliques = []
+for k in [4, 5]:
+    members = np.array(list(iter_independent_sets(zero_graph, k)))
+    compat = team_compatibility_batch(members, zero_table)
+    order = np.argsort(-compat, kind="stable")
+    zero_cliques.append(
+        CliqueSet(members[order], compat[order], len(zero_students)))
+zero_5, zero_4 = num_size_teams(len(zero_students))
+zero_annealed = improve_teams_annealing(
+    assign_teams_greedy(*zero_cliques, zero_4, zero_5), zero_table, seed=0)
+zero_exact = assign_teams_exact(*zero_cliques, zero_4, zero_5, zero_table,
+                                initial_teams=zero_annealed)
+zero_costs = [assignment_cost([[zero_students[i] for i in team]
+                               for team in teams])
+              for teams in [zero_annealed, zero_exact]]
+
+print("Exact solver finishes from a heuristic when many teams cost nothing:")
+print(zero_costs[1] <= zero_costs[0] + 1e-9 and
+      sorted(student for team in zero_exact for student in team) ==
+      list(range(len(zero_students))))
+
+# Check that joint greedy does no worse than greedy on a sample where the
+# teams with the best compatibility scores have an odd person out, and that
+# the exact and annealing solvers start from something better than either
+random.seed(13)
+filler_students = random.sample(
+    load_student_data("data/anonymized_surveys_A.csv"), 28)
+filler_table = StudentTable.from_students(filler_students)
+filler_graph = create_conflict_graph(filler_students)
+filler_cliques = []
+for k in [4, 5]:
+    members = np.array(list(iter_independent_sets(filler_graph, k)))
+    compat = team_compatibility_batch(members, filler_table)
+    order = np.argsort(-compat, kind="stable")
+    filler_cliques.append(
+        CliqueSet(members[order], compat[order], len(filler_students)))
+filler_5, filler_4 = num_size_teams(len(filler_students))
+filler_costs = [assignment_cost([[filler_students[i] for i in team]
+                                 for team in teams])
+                for teams in [
+                    assign_teams_greedy(*filler_cliques, filler_4, filler_5),
+                    assign_teams_joint_greedy(*filler_cliques,
+                                              len(filler_students))]]
+filler_cohort = Cohort(filler_table, *filler_cliques)
+solved_costs = [solve(filler_cohort, method, time_budget=60)[1]
+                for method in ["exact", "annealing"]]
+
+print("Joint greedy does no worse than greedy, and solvers improve on both:")
+print(filler_costs[1] <= filler_costs[0] + 1e-9 and
+      max(solved_costs) < min(filler_costs) - 1)
+
+# Check that multistart_greedy counts starts that fail rather than stopping,
+# and only raises a ValueError if every start fails
+small_sets = [CliqueSet(small_four_cliques), CliqueSet(small_five_cliques)]
+_, failing_cost, failing_times = multistart_greedy(
+    *small_sets, 2, 1, small_table, num_starts=20,
+    max_offset=len(small_five_cliques) + 1, max_workers=2, seed=0)
+failures_counted = failing_cost <= assignment_cost(
+    [[small_students[i] for i in team]
+     for team in assign_teams_greedy(*small_sets, 2, 1)]) and \
+    0 < sum(failed for _, failed, _ in failing_times.values()) < 20 and \
+    sum(run for run, _, _ in failing_times.values()) == 20
+try:
+    multistart_greedy(*small_sets, 4, 0, small_table, num_starts=5,
+                      max_workers=2, seed=0)
+    failures_counted = False
+except ValueError:
+    pass
+
+print("multistart_greedy skips failed starts and raises if all of them fail:")
+print(failures_counted)
+
+# Check that reordering a CliqueSet keeps each student's cliques in its index
+# in increasing order, the same as building the index from scratch
+shuffled_order = np.random.default_rng(0).permutation(len(five_set))
+shuffled_set = five_set.reordered(shuffled_order)
+fresh_starts, fresh_ids = CliqueSet(
+    five_set.members[shuffled_order]).postings
+shuffled_starts, shuffled_ids = shuffled_set.postings
+
+print("Reordering a CliqueSet keeps its index in increasing order:")
+print(np.array_equal(shuffled_ids, fresh_ids) and
+      np.array_equal(shuffled_starts[:len(fresh_starts)], fresh_starts))
+
+# Check that slices of the independent sets starting partway through the
+# sets of nodes with conflicts match slices of the full list
+slices_match = True
+for graph_seed in range(10):
+    random_conflicts = nx.gnp_random_graph(14, 0.3, seed=graph_seed)
+    all_sets = list(iter_independent_sets(random_conflicts, 4))
+    for slice_start in range(0, len(all_sets) + 2, 7):
+        for slice_stop in [None, slice_start + 1, slice_start + 30]:
+            slices_match &= list(iter_independent_sets(
+                random_conflicts, 4, slice_start, slice_stop)) == \
+                all_sets[slice_start:slice_stop]
+
+print("Slices of the independent sets skip to start correctly:")
+print(slices_match)
+
+# Check that loading the same survey twice gives the same commitment scores,
+# and that cliques found for the same students in another order (with or
+# without constraints) come from the cache the second time
+survey_path = os.path.abspath("data/anonymized_surveys_A.csv")
+working_dir = os.getcwd()
+with TemporaryDirectory() as loader_dir:
+    os.makedirs(os.path.join(loader_dir, "data"))
+    os.chdir(loader_dir)
+    try:
+        loader_cache = ArtifactCache("cache")
+        loaded_cliques = []
+        loaded_commitment = []
+        for load_seed in [0, 1]:
+            loaded = load_student_data(survey_path)[:20]
+            random.Random(load_seed).shuffle(loaded)
+            loaded_table = StudentTable.from_students(loaded)
+            loaded_commitment.append(
+                {student.name: student.commitment for student in loaded})
+            loaded_graph = create_conflict_graph(loaded)
+            managers = TeamConstraints.from_conflict_graph(loaded_graph)
+            managers.require(loaded_table.mgmt >= 8)
+            for loaded_constraints in [None, managers]:
+                create_save_cliques([4, 5], loaded_graph, "A20", loader_cache,
+                                    constraints=loaded_constraints)
+                for k in [4, 5]:
+                    cliques, roster = load_cliques("data/%i_cliques_A20" % k)
+                    loaded_cliques.append(
+                        {frozenset(roster[i] for i in clique)
+                         for clique in cliques.tolist()})
+    finally:
+        os.chdir(working_dir)
+
+print("Loading the same survey again reuses its cliques from the cache:")
+print(loaded_commitment[0] == loaded_commitment[1] and
+      loaded_cliques[:4] == loaded_cliques[4:] and
+      loaded_cliques[0] != loaded_cliques[2] and
+      (loader_cache.hits, loader_cache.misses) == (4, 4))
+
+# Check that keeping the best cliques in several processes keeps the same
+# scores for each student as keeping them in one, and that several shards
+# load as one memory mapped array without holding them all in memory
+sharded_top, top_shards = find_top_cliques(conflict_graph, 5, table, 30,
+                                           num_workers=3)
+sharded_top_matches = len(top_shards) == 3 and \
+    sharded_top.num_seen == top.num_seen == \
+    sum(shard["num_cliques"] for shard in top_shards) and \
+    np.isclose(sharded_top.max_dropped_compat, top.max_dropped_compat)
+for student_id in range(len(students)):
+    sharded_top_matches &= np.allclose(*[np.sort(kept.compat[
+        (kept.members == student_id).any(axis=1)])[::-1][:30]
+        for kept in [top, sharded_top]])
+with TemporaryDirectory() as shard_dir:
+    shard_file = os.path.join(shard_dir, "5_cliques_test")
+    save_clique_shards(shard_file, conflict_graph, 5, num_workers=3)
+    joined, _ = load_cliques(shard_file, students)
+    joined_again, _ = load_cliques(shard_file, students)
+    sharded_top_matches &= isinstance(joined, np.memmap) and \
+        np.array_equal(joined, np.concatenate(list(iter_clique_chunks(
+            shard_file)))) and np.array_equal(joined, joined_again)
+    save_clique_shards(shard_file, conflict_graph, 5, num_workers=2)
+    sharded_top_matches &= \
+        not os.path.exists(shard_file + ".joined.npy") and \
+        len(load_cliques(shard_file)[0]) == len(joined)
+
+print("Best cliques kept in several processes match, and shards load mapped:")
+print(sharded_top_matches)
+
+# Check that the table a Roster changes in place matches a table built again
+# from the same students, with the matrices built before the changes
+incremental = Roster(joblib.load("data/student_graph_A20"), four_cliques,
+                     five_cliques)
+for name in StudentTable.PAIR_MATRICES + ("topic_matrix",):
+    getattr(incremental.table, name)
+incremental.add_student(Student(
+    "Another Student", "they/them", 4, topics={"A new topic"},
+    preferences={incremental.students[1].name},
+    anti_prefs={incremental.students[2].name}, intr_prog=5))
+incremental.remove_student(incremental.students[3])
+incremental.add_anti_pref(incremental.students[0],
+                          incremental.students[4].name)
+rebuilt = StudentTable.from_students(copy.deepcopy(incremental.students))
+table_matches = roster_matches_rebuild(incremental) and \
+    incremental.table.students == incremental.students and \
+    all(student.id == student_id and student.table is incremental.table
+        for student_id, student in enumerate(incremental.students))
+for name in StudentTable.FIELDS + StudentTable.PAIR_MATRICES + (
+        "topic_names",):
+    table_matches &= np.array_equal(getattr(incremental.table, name),
+                                    getattr(rebuilt, name))
+table_matches &= np.array_equal(incremental.table.topic_matrix,
+                                rebuilt.topic_matrix)
+
+print("Roster updates its StudentTable in place like building it again:")
+print(table_matches)